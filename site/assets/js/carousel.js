@@ -34,6 +34,13 @@ class Carousel {
 
       const picture = document.createElement('picture');
 
+      if (img.srcset_avif) {
+        const source = document.createElement('source');
+        source.type = 'image/avif';
+        source.srcset = img.srcset_avif.split(', ').pop().split(' ')[0]; // Get largest
+        picture.appendChild(source);
+      }
+
       if (img.srcset_webp) {
         const source = document.createElement('source');
         source.type = 'image/webp';
@@ -143,20 +150,16 @@ document.addEventListener('DOMContentLoaded', async () => {
   if (!carouselEl) return;
 
   try {
-    // Load data
-    const resp = await fetch('data/sections.json');
-    if (!resp.ok) throw new Error(`fetch failed: ${resp.status}`);
-    const data = await resp.json();
-
     // Determine which images to use
     const section = carouselEl.dataset.section;
     let images = [];
 
     if (section && section !== 'all') {
-      // Section-specific carousel
-      images = data[section] || [];
+      // Section-specific carousel: only this section's shard is fetched
+      images = await siteData.section(section);
     } else {
       // Homepage: random selection from all sections
+      const data = await siteData.all();
       const allImages = [];
       Object.values(data).forEach(sectionImages => {
         allImages.push(...sectionImages);
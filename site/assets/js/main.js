@@ -1,19 +1,25 @@
 // Main site JS: loads manifest, renders grids, lazy loads images with new hover animation
 document.addEventListener('DOMContentLoaded', async () => {
-  // Show loading spinner
+  // Show loading spinner, unless the grid was rendered at build time (its placeholders are already painted)
   const spinner = document.createElement('div');
   spinner.className = 'loading-spinner';
   spinner.innerHTML = '<div class="spinner"></div>';
-  document.body.appendChild(spinner);
+  if (!document.querySelector('.grid .item')) document.body.appendChild(spinner);
 
-  // Load manifest
+  // Load manifest: the index page needs only the covers, section pages only their own sections
   let data = {};
   try{
-    const resp = await fetch('data/sections.json');
-    if (!resp.ok) throw new Error(`fetch failed: ${resp.status}`);
-    data = await resp.json();
+    // grids rendered at build time (e.g. one page of a paginated section) don't need their data
+    const sectionKeys = Array.from(document.querySelectorAll('.grid[data-section]'))
+      .filter(g => !g.querySelector('.item'))
+      .map(g => g.dataset.section);
+    if (document.getElementById('covers-grid')) {
+      data = await siteData.covers();
+    } else if (sectionKeys.length) {
+      data = await siteData.sections(sectionKeys);
+    }
   }catch(e){
-    console.warn('Could not load data/sections.json — section grids will be empty', e);
+    console.warn('Could not load the section manifest — section grids will be empty', e);
   } finally {
     // Hide spinner after data loads
     setTimeout(() => {
@@ -52,8 +58,15 @@ document.addEventListener('DOMContentLoaded', async () => {
       a.className = 'section-cover';
       a.href = `${key}.html`;
       a.setAttribute('aria-label', label);
+      applyPlaceholder(a, cover);
 
       const picture = document.createElement('picture');
+      if (cover.srcset_avif) {
+        const source = document.createElement('source');
+        source.type = 'image/avif';
+        source.srcset = cover.srcset_avif.split(', ')[0];
+        picture.appendChild(source);
+      }
       if (cover.srcset_webp) {
         const source = document.createElement('source');
         source.type = 'image/webp';
@@ -64,6 +77,10 @@ document.addEventListener('DOMContentLoaded', async () => {
       const img = document.createElement('img');
       img.src = cover.thumb_jpg || cover.thumb_webp || cover.full_jpg || cover.full_webp;
       img.alt = cover.alt || label;
+      if (cover.width && cover.height) {
+        img.width = cover.width;
+        img.height = cover.height;
+      }
       picture.appendChild(img);
 
       const labelDiv = document.createElement('div');
@@ -83,6 +100,16 @@ document.addEventListener('DOMContentLoaded', async () => {
   function renderSection(key){
     const grid = document.querySelector(`.grid[data-section="${key}"]`);
     if (!grid) return;
+
+    // Keep a pre-rendered grid as it is: re-rendering would replace a paginated page with the whole section
+    if (grid.querySelector('.item')) {
+      grid.querySelectorAll('img').forEach(img => {
+        imgObserver.observe(img);
+        img.addEventListener('click', openLightbox);
+      });
+      return;
+    }
+
     const imgs = data[key] || [];
 
     grid.innerHTML = '';
@@ -95,8 +122,16 @@ document.addEventListener('DOMContentLoaded', async () => {
     imgs.forEach((it, idx) => {
       const div = document.createElement('div');
       div.className = 'item';
+      applyPlaceholder(div, it);
 
       const picture = document.createElement('picture');
+      if (it.srcset_avif) {
+        const source = document.createElement('source');
+        source.type = 'image/avif';
+        source.srcset = it.srcset_avif;
+        source.sizes = it.sizes || '(max-width: 600px) 100vw, (max-width: 1200px) 50vw, 33vw';
+        picture.appendChild(source);
+      }
       if (it.srcset_webp) {
         const source = document.createElement('source');
         source.type = 'image/webp';
@@ -115,6 +150,11 @@ document.addEventListener('DOMContentLoaded', async () => {
       img.sizes = it.sizes || '(max-width: 600px) 100vw, (max-width: 1200px) 50vw, 33vw';
       img.src = it.thumb_jpg;
       img.alt = it.alt;
+      // Intrinsic size from the manifest lets the browser reserve layout space before the image arrives
+      if (it.width && it.height) {
+        img.width = it.width;
+        img.height = it.height;
+      }
       img.loading = 'lazy';
 
       picture.appendChild(img);
@@ -185,7 +225,8 @@ document.addEventListener('DOMContentLoaded', async () => {
   });
 
   // Set active navigation link based on current page
-  const currentPage = window.location.pathname.split('/').pop() || 'index.html';
+  // later pages of a paginated section (dnc-2.html) highlight the section's link
+  const currentPage = (window.location.pathname.split('/').pop() || 'index.html').replace(/-\d+\.html$/, '.html');
   const navLinks = document.querySelectorAll('.main-nav a');
   navLinks.forEach(link => {
     const linkPage = link.getAttribute('href');
@@ -202,6 +243,14 @@ document.addEventListener('DOMContentLoaded', async () => {
   });
 });
 
+// Inline background (dominant colour + tiny blurred image) shown until the real image loads
+function applyPlaceholder(el, it){
+  const layers = [];
+  if (it.placeholder) layers.push(`url(${it.placeholder}) center/cover no-repeat`);
+  if (it.color) layers.push(it.color);
+  if (layers.length) el.style.background = layers.join(' ');
+}
+
 function openLightbox(e){
   const img = e.currentTarget;
   const lb = document.getElementById('lightbox');
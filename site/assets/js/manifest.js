@@ -0,0 +1,66 @@
+// Manifest loader shared by main.js and carousel.js.
+// Section pages fetch only their own shard (data/sections/<key>.json) and the index page only
+// data/index.json; the combined data/sections.json is the fallback when shards aren't published.
+(function(){
+  const requests = {};
+
+  function fetchJSON(url){
+    if (!requests[url]) {
+      requests[url] = fetch(url).then(resp => {
+        if (!resp.ok) throw new Error(`fetch failed: ${resp.status}`);
+        return resp.json();
+      });
+    }
+    return requests[url];
+  }
+
+  // Shards store paths relative to a per-section base; put the base back
+  function expandItem(it, shard){
+    const out = Object.assign({}, it);
+    const base = shard.base || '';
+    (shard.path_keys || []).forEach(k => {
+      if (out[k]) out[k] = base + out[k];
+    });
+    (shard.srcset_keys || []).forEach(k => {
+      if (out[k]) out[k] = out[k].split(', ').map(s => base + s).join(', ');
+    });
+    return out;
+  }
+
+  function all(){
+    return fetchJSON('data/sections.json');
+  }
+
+  async function section(key){
+    try {
+      const shard = await fetchJSON(`data/sections/${key}.json`);
+      return (shard.items || []).map(it => expandItem(it, shard));
+    } catch (e) {
+      const data = await all();
+      return data[key] || [];
+    }
+  }
+
+  async function sections(keys){
+    const out = {};
+    await Promise.all(keys.map(async key => { out[key] = await section(key); }));
+    return out;
+  }
+
+  // { key: [cover] } for every section, from the small index file
+  async function covers(){
+    try {
+      const index = await fetchJSON('data/index.json');
+      const out = {};
+      Object.keys(index.sections).forEach(key => {
+        const s = index.sections[key];
+        out[key] = s.cover ? [expandItem(s.cover, s)] : [];
+      });
+      return out;
+    } catch (e) {
+      return all();
+    }
+  }
+
+  window.siteData = { all, section, sections, covers };
+})();
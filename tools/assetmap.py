@@ -0,0 +1,57 @@
+"""Map from stable asset paths to their content-hash fingerprinted names.
+
+``fingerprint-assets.py`` writes ``site/data/assets.json`` with entries like
+``"images/dnc/_MG_3726-full.jpg": "images/dnc/_MG_3726-full.3f2a9c1b0d.jpg"``
+(paths relative to ``site/``). The manifest and page generators use it to point
+pages at names that change whenever the bytes do, so they can be served with
+long-lived immutable caching.
+"""
+import os
+import re
+import json
+import hashlib
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+SITE = os.path.join(ROOT, 'site')
+MAP_FILE = os.path.join(SITE, 'data', 'assets.json')
+
+HASH_LENGTH = 10
+FINGERPRINT_RE = re.compile(r'\.[0-9a-f]{%d}(?=\.[^./]+$)' % HASH_LENGTH)
+
+
+def fingerprinted_name(path, digest):
+    stem, ext = os.path.splitext(path)
+    return f'{stem}.{digest[:HASH_LENGTH]}{ext}'
+
+
+def is_fingerprinted(path):
+    return FINGERPRINT_RE.search(path) is not None
+
+
+class AssetMap:
+    def __init__(self, mapping=None):
+        self.mapping = dict(mapping or {})
+
+    @classmethod
+    def load(cls, path=MAP_FILE):
+        """Read the map written by ``fingerprint-assets.py``; raises ``OSError`` if it is missing."""
+        with open(path, 'r', encoding='utf-8') as fh:
+            return cls(json.load(fh))
+
+    @property
+    def digest(self):
+        """Short digest of the whole map, so incremental builds notice when any name changed."""
+        blob = json.dumps(self.mapping, sort_keys=True).encode('utf-8')
+        return hashlib.sha256(blob).hexdigest()[:16]
+
+    def url(self, path):
+        """Fingerprinted name for ``path``, or ``path`` itself when it isn't in the map."""
+        return self.mapping.get(path, path)
+
+    def srcset(self, value):
+        """Rewrite every URL of a ``srcset`` value (``"<url> <width>w, ..."``)."""
+        parts = []
+        for part in value.split(', '):
+            url, _, descriptor = part.partition(' ')
+            parts.append(f'{self.url(url)} {descriptor}' if descriptor else self.url(url))
+        return ', '.join(parts)
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""Benchmark the image pipeline on a reproducible synthetic corpus.
+
+A throwaway copy of the tools is pointed at a generated tree: sources of mixed
+formats (JPEG, PNG, TIFF), orientations (EXIF-rotated JPEGs) and a few huge
+frames, split between images/originals/<category> and images/<category>. Each
+pipeline step then runs twice, cold (empty build caches) and warm (nothing to
+do), and the wall time, CPU time (user + system, worker processes included),
+peak RSS of the largest process and bytes written are recorded per run.
+
+    python3 tools/benchmark.py [--images 24] [--huge 2] [--seed 1]
+                               [--report .cache/benchmark.json]
+                               [--baseline saved.json] [--threshold 10]
+
+With ``--baseline`` the report is compared against an earlier one and the exit
+status is 1 when any cold or warm metric got slower/larger by more than
+``--threshold`` percent (tiny absolute differences are ignored as noise).
+"""
+import os
+import sys
+import json
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import ExifTags, Image, ImageDraw, __version__ as pil_version
+
+import workers
+
+TOOLS = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(TOOLS)
+REPORT_FILE = os.path.join(ROOT, '.cache', 'benchmark.json')
+
+REPORT_VERSION = 1
+
+CATEGORIES = ('dnc', 'frack-county', 'portraits')
+
+# (step, script, arguments) in pipeline order
+STEPS = [
+    ('optimize-originals', 'optimize-originals.py', []),
+    ('optimize-images', 'optimize-images.py', []),
+    ('generate-manifest', 'generate-manifest.py', []),
+    ('generate-sections', 'generate-sections.py', []),
+]
+OPTIMIZERS = ('optimize-originals', 'optimize-images')
+
+METRICS = ('wall_s', 'cpu_s', 'max_rss_kib', 'output_bytes')
+# differences below these are noise, whatever the percentage
+MIN_DELTA = {'wall_s': 0.05, 'cpu_s': 0.05, 'max_rss_kib': 4096, 'output_bytes': 4096}
+
+NORMAL_SIZES = ((2400, 1600), (1600, 2400), (3000, 2000), (1200, 1200))
+HUGE_SIZE = (8000, 5333)
+
+
+def synthetic_image(rng, size):
+    """A photo-like frame: a smooth gradient, some shapes and sensor-like noise."""
+    w, h = size
+    small = Image.new('RGB', (8, 8))
+    small.putdata([tuple(rng.randrange(256) for _ in range(3)) for _ in range(64)])
+    img = small.resize(size, Image.BICUBIC)
+    draw = ImageDraw.Draw(img)
+    for _ in range(12):
+        x, y = rng.randrange(w), rng.randrange(h)
+        r = rng.randrange(max(w, h) // 20, max(w, h) // 5)
+        draw.ellipse((x - r, y - r, x + r, y + r), fill=tuple(rng.randrange(256) for _ in range(3)))
+    # uniform noise with the chosen standard deviation, drawn from ``rng`` (Image.effect_noise uses
+    # the C library's per-process rand() state, which would tie the pixels to the worker)
+    spread = rng.choice((8, 16, 24)) * 12 ** 0.5
+    noise = Image.frombytes('L', size, rng.randbytes(w * h)).point(lambda v: round(128 + (v / 255 - 0.5) * spread))
+    return Image.blend(img, noise.convert('RGB'), 0.15)
+
+
+def write_source(spec):
+    path, size, fmt, seed = spec
+    rng = random.Random(seed)
+    img = synthetic_image(rng, size)
+    if fmt == 'jpg':
+        # about a third of the JPEGs are stored sideways with an EXIF orientation, like camera frames
+        exif = Image.Exif()
+        if rng.random() < 1 / 3:
+            img = img.transpose(Image.Transpose.ROTATE_90)
+            exif[ExifTags.Base.Orientation] = 6
+        img.save(path, 'JPEG', quality=92, exif=exif.tobytes())
+    elif fmt == 'png':
+        img.save(path, 'PNG', compress_level=1)
+    else:
+        img.save(path, 'TIFF', compression='tiff_lzw')
+    return path
+
+
+def make_corpus(dest, count, huge=0, seed=1):
+    """Write ``count`` sources (``huge`` of them at HUGE_SIZE) under ``dest``/images; returns their paths.
+
+    Even-numbered sources go to images/originals/<category>, odd-numbered ones
+    straight into images/<category>. The same arguments always give the same
+    files. They are written by worker processes: ``ru_maxrss`` survives
+    fork/exec, so a large benchmark process would inflate every step's peak RSS.
+    """
+    rng = random.Random(seed)
+    specs = []
+    for i in range(count):
+        cat = CATEGORIES[i % len(CATEGORIES)]
+        folder = os.path.join(dest, 'images', 'originals', cat) if i % 2 == 0 else os.path.join(dest, 'images', cat)
+        os.makedirs(folder, exist_ok=True)
+        size = HUGE_SIZE if i < huge else rng.choice(NORMAL_SIZES)
+        fmt = ('jpg', 'jpg', 'png', 'tiff')[i % 4]
+        specs.append((os.path.join(folder, f'synth-{i:04d}.{fmt}'), size, fmt, f'{seed}-{i}'))
+    with ProcessPoolExecutor(max_workers=workers.default_jobs()) as pool:
+        return list(pool.map(write_source, specs))
+
+
+def make_tree(dest):
+    """Copy the tools and the site skeleton (no pages, no data) into ``dest``."""
+    shutil.copytree(TOOLS, os.path.join(dest, 'tools'),
+                    ignore=shutil.ignore_patterns('tests', '__pycache__'))
+    shutil.copytree(os.path.join(ROOT, 'site', 'assets'), os.path.join(dest, 'site', 'assets'))
+    os.makedirs(os.path.join(dest, 'site', 'data'))
+    os.makedirs(os.path.join(dest, 'images'), exist_ok=True)
+    os.symlink(os.path.join('..', 'images'), os.path.join(dest, 'site', 'images'))
+
+
+def snapshot(dest):
+    """``{path: (size, mtime_ns)}`` for every file of the tree outside tools/ and .cache/."""
+    files = {}
+    for dirpath, dirnames, filenames in os.walk(dest):
+        dirnames[:] = [d for d in dirnames if d not in ('tools', '.cache')]
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            st = os.stat(path)
+            files[path] = (st.st_size, st.st_mtime_ns)
+    return files
+
+
+def run_step(dest, script, args):
+    """Run one tool in the tree and return its metrics; raises ``RuntimeError`` if it fails."""
+    before = snapshot(dest)
+    start = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, os.path.join(dest, 'tools', script)] + args, cwd=dest,
+                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    output = proc.stdout.read()
+    # wait4 reports the child's own usage plus that of the worker processes it reaped
+    _, status, usage = os.wait4(proc.pid, 0)
+    wall = time.perf_counter() - start
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    if proc.returncode:
+        raise RuntimeError(f'{script} exited with {proc.returncode}:\n{output.decode(errors="replace")}')
+    after = snapshot(dest)
+    written = sum(size for path, (size, mtime) in after.items() if before.get(path) != (size, mtime))
+    return {
+        'wall_s': round(wall, 3),
+        'cpu_s': round(usage.ru_utime + usage.ru_stime, 3),
+        'max_rss_kib': usage.ru_maxrss,
+        'output_bytes': written,
+    }
+
+
+def run_suite(dest, jobs=None):
+    steps = {}
+    for phase in ('cold', 'warm'):
+        for name, script, args in STEPS:
+            if jobs and name in OPTIMIZERS:
+                args = args + ['--jobs', str(jobs)]
+            result = run_step(dest, script, args)
+            steps.setdefault(name, {})[phase] = result
+            print(f'{name:20} {phase:5} {result["wall_s"]:8.2f}s wall {result["cpu_s"]:8.2f}s cpu '
+                  f'{result["max_rss_kib"] / 1024:8.1f} MiB rss {result["output_bytes"] / 1024:10.0f} KiB written')
+    return steps
+
+
+def compare(report, baseline, threshold):
+    """``[(step, phase, metric, old, new)]`` for every metric that grew by more than ``threshold`` percent."""
+    regressions = []
+    for step, phases in report['steps'].items():
+        for phase, metrics in phases.items():
+            old_metrics = baseline.get('steps', {}).get(step, {}).get(phase, {})
+            for metric in METRICS:
+                old, new = old_metrics.get(metric), metrics.get(metric)
+                if old is None or new is None or new - old < MIN_DELTA[metric]:
+                    continue
+                if new > old * (1 + threshold / 100):
+                    regressions.append((step, phase, metric, old, new))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--images', type=int, default=24, help='number of synthetic sources (default 24)')
+    parser.add_argument('--huge', type=int, default=2, help=f'how many of them are {HUGE_SIZE[0]}x{HUGE_SIZE[1]} (default 2)')
+    parser.add_argument('--seed', type=int, default=1, help='corpus seed; the same seed gives the same files')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='worker processes for the optimizers')
+    parser.add_argument('--report', default=REPORT_FILE, help=f'where to write the JSON report (default {REPORT_FILE})')
+    parser.add_argument('--baseline', help='earlier report to compare against')
+    parser.add_argument('--threshold', type=float, default=10.0,
+                        help='percent a metric may grow over the baseline before it is a regression (default 10)')
+    parser.add_argument('--keep', action='store_true', help='keep the generated tree and print where it is')
+    args = parser.parse_args(argv)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as fh:
+            baseline = json.load(fh)
+
+    dest = tempfile.mkdtemp(prefix='karl-bench-')
+    try:
+        make_tree(dest)
+        start = time.perf_counter()
+        sources = make_corpus(dest, args.images, args.huge, args.seed)
+        print(f'Generated {len(sources)} sources in {time.perf_counter() - start:.1f}s under {dest}')
+        steps = run_suite(dest, args.jobs)
+    finally:
+        if args.keep:
+            print(f'Kept benchmark tree: {dest}')
+        else:
+            shutil.rmtree(dest, ignore_errors=True)
+
+    report = {
+        'version': REPORT_VERSION,
+        'corpus': {'images': args.images, 'huge': args.huge, 'seed': args.seed,
+                   'formats': sorted({os.path.splitext(p)[1][1:] for p in sources})},
+        'environment': {'python': platform.python_version(), 'pillow': pil_version,
+                        'machine': platform.machine(), 'cpus': os.cpu_count(), 'jobs': args.jobs},
+        'steps': steps,
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(args.report)), exist_ok=True)
+    with open(args.report, 'w', encoding='utf-8') as fh:
+        json.dump(report, fh, indent=2, sort_keys=True)
+    print(f'Wrote report to {args.report}')
+
+    if baseline is None:
+        return 0
+    if baseline.get('corpus') != report['corpus']:
+        print(f'Warning: baseline corpus {baseline.get("corpus")} differs from this one')
+    regressions = compare(report, baseline, args.threshold)
+    for step, phase, metric, old, new in regressions:
+        print(f'REGRESSION {step} {phase} {metric}: {old} -> {new} (+{(new / old - 1) * 100 if old else float("inf"):.0f}%)')
+    if not regressions:
+        print(f'No regressions over {args.threshold:g}% against {args.baseline}')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,391 @@
+#!/usr/bin/env python3
+"""Build the site, running only the pipeline steps whose inputs changed.
+
+The steps form a dependency graph; per-category steps get one unit per
+category folder, so a new photo in dnc only reconverts and reoptimizes dnc:
+
+    convert-psds:<cat> -> optimize-originals:<cat> --+
+                          optimize-images:<cat> -----+-> generate-manifest -> crop-heroes
+        -> [fingerprint-assets] -> list-crops (generate-manifest again) -> generate-sections
+
+Every unit declares its inputs (source files plus the tool code) and outputs.
+A unit runs when it never ran, its options changed, an input was added,
+changed (size or mtime) or removed since its last successful run, or one of
+its outputs is gone. Units whose dependencies are done run together, each as
+its own ``python3 tools/<script>`` process (so a tool's worker pool is not
+nested inside another), and their output is printed line by line as it is
+produced. Each unit only scans its own category, and the tools' own build
+caches still decide which files inside a unit need work.
+
+    python3 tools/build.py [--dry-run] [-j N] [--force] [--prune] [--fingerprint]
+                           [--avif] [--adaptive] [--trace FILE]
+
+``--dry-run`` lists every unit with the reason it would run.
+"""
+import os
+import re
+import sys
+import time
+import json
+import argparse
+import threading
+import subprocess
+import importlib.util
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import tracing
+import workers
+from assetmap import is_fingerprinted
+from buildcache import replace_json
+from catalog import CROP_RE
+
+TOOLS = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(TOOLS)
+IMAGES_ROOT = os.path.join(ROOT, 'images')
+ORIGINALS_ROOT = os.path.join(IMAGES_ROOT, 'originals')
+SITE = os.path.join(ROOT, 'site')
+DATA = os.path.join(SITE, 'data')
+STATE_FILE = os.path.join(ROOT, '.cache', 'build.json')
+
+STATE_VERSION = 1
+
+# Modules the tools share; editing one reruns every step (whose own caches then skip unchanged files)
+SHARED_MODULES = ('assetmap.py', 'buildcache.py', 'catalog.py', 'dupes.py', 'imaging.py', 'tracing.py', 'workers.py')
+
+# Tools that take --jobs; a wave's worker processes are split between its units
+PARALLEL_SCRIPTS = ('convert-psds.py', 'optimize-originals.py', 'optimize-images.py')
+
+# Hero and focus files that decide which image is cropped, and where
+HERO_RE = re.compile(r'(^hero\.txt$|-hero\.|-focus\.txt$|-full\.(jpg|webp)$)')
+
+Unit = namedtuple('Unit', 'name script category argv after')
+
+_modules = {}
+
+
+def load(script):
+    """Import ``tools/<script>`` once, to read its constants and helpers when planning."""
+    if script not in _modules:
+        name = os.path.splitext(script)[0].replace('-', '_')
+        spec = importlib.util.spec_from_file_location(name, os.path.join(TOOLS, script))
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[name] = module
+        spec.loader.exec_module(module)
+        _modules[script] = module
+    return _modules[script]
+
+
+def listdir(folder):
+    try:
+        return sorted(n for n in os.listdir(folder) if not n.startswith('.'))
+    except OSError:
+        return []
+
+
+def walk(folder):
+    files = []
+    for dirpath, dirnames, filenames in os.walk(folder):
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith('.'))
+        files.extend(os.path.join(dirpath, n) for n in sorted(filenames) if not n.startswith('.'))
+    return files
+
+
+def categories(folder):
+    return [n for n in listdir(folder) if n != 'originals' and os.path.isdir(os.path.join(folder, n))]
+
+
+def manifest_categories():
+    return [c for c in load('generate-manifest.py').CATEGORIES if os.path.isdir(os.path.join(IMAGES_ROOT, c))]
+
+
+def is_source(path):
+    return path.lower().endswith(load('optimize-images.py').EXTENSIONS)
+
+
+def derivatives(folder, bases):
+    """Variants and placeholders in ``folder`` written for one of ``bases`` (hero crops excluded)."""
+    optimizer = load('optimize-images.py')
+    outs = []
+    for name in listdir(folder):
+        m = optimizer.DERIVATIVE_RE.search(name)
+        base = name[:m.start()] if m else name[:-len('-lqip.json')] if name.endswith('-lqip.json') else None
+        if base in bases and not CROP_RE.search(name) and not is_fingerprinted(name):
+            outs.append(os.path.join(folder, name))
+    return outs
+
+
+def crops():
+    return [os.path.join(IMAGES_ROOT, c, n) for c in manifest_categories()
+            for n in listdir(os.path.join(IMAGES_ROOT, c)) if CROP_RE.search(n) and not is_fingerprinted(n)]
+
+
+def manifest_outputs():
+    return [os.path.join(DATA, 'sections.json'), os.path.join(DATA, 'index.json')] + walk(os.path.join(DATA, 'sections'))
+
+
+def step_inputs(unit, opts):
+    """Data files ``unit`` reads (its tool's code is added by :func:`snapshot`)."""
+    step, cat = unit.name.split(':')[0], unit.category
+    if step == 'convert-psds':
+        return [f for f in walk(os.path.join(ORIGINALS_ROOT, cat)) if f.lower().endswith('.psd')]
+    if step == 'optimize-originals':
+        return [f for f in walk(os.path.join(ORIGINALS_ROOT, cat)) if is_source(f)]
+    if step == 'optimize-images':
+        optimizer = load('optimize-images.py')
+        return [f for f in walk(os.path.join(IMAGES_ROOT, cat)) if is_source(f) and not optimizer.is_derivative(f)]
+    if step == 'generate-manifest':
+        # crops are listed by list-crops; counting them here would rerun this step after every crop
+        return [os.path.join(IMAGES_ROOT, c, n) for c in manifest_categories()
+                for n in listdir(os.path.join(IMAGES_ROOT, c)) if not CROP_RE.search(n) and not is_fingerprinted(n)]
+    if step == 'crop-heroes':
+        return [os.path.join(IMAGES_ROOT, c, n) for c in manifest_categories()
+                for n in listdir(os.path.join(IMAGES_ROOT, c)) if HERO_RE.search(n)]
+    if step == 'fingerprint-assets':
+        return [os.path.join(SITE, path) for path in load('fingerprint-assets.py').find_assets()]
+    if step == 'list-crops':
+        return crops() + manifest_outputs() + ([os.path.join(DATA, 'assets.json')] if opts.fingerprint else [])
+    if step == 'generate-sections':
+        return ([os.path.join(DATA, 'sections.json'), os.path.join(SITE, 'assets', 'css', 'styles.css')]
+                + ([os.path.join(DATA, 'assets.json')] if opts.fingerprint else []))
+    raise ValueError(f'unknown step {step}')
+
+
+def step_outputs(unit):
+    """Files ``unit`` wrote; checked for existence before the next build."""
+    step, cat = unit.name.split(':')[0], unit.category
+    if step == 'convert-psds':
+        return [os.path.splitext(f)[0] + '.jpg' for f in walk(os.path.join(ORIGINALS_ROOT, cat))
+                if f.lower().endswith('.psd')]
+    if step == 'optimize-originals':
+        target_for = load('optimize-originals.py').target_for
+        bases = {target_for(f)[1] for f in walk(os.path.join(ORIGINALS_ROOT, cat)) if is_source(f)}
+        return derivatives(os.path.join(IMAGES_ROOT, cat), bases)
+    if step == 'optimize-images':
+        optimizer = load('optimize-images.py')
+        sources = [f for f in walk(os.path.join(IMAGES_ROOT, cat)) if is_source(f) and not optimizer.is_derivative(f)]
+        outs = []
+        for folder in sorted({os.path.dirname(f) for f in sources}):
+            bases = {optimizer.sanitize_name(os.path.splitext(os.path.basename(f))[0])
+                     for f in sources if os.path.dirname(f) == folder}
+            outs.extend(derivatives(folder, bases))
+        return outs
+    if step in ('generate-manifest', 'list-crops'):
+        return manifest_outputs()
+    if step == 'crop-heroes':
+        return crops()
+    if step == 'fingerprint-assets':
+        return [os.path.join(DATA, 'assets.json')]
+    if step == 'generate-sections':
+        try:
+            with open(os.path.join(DATA, 'sections.json'), 'r', encoding='utf-8') as fh:
+                keys = list(json.load(fh))
+        except (OSError, ValueError):
+            return []
+        pages = re.compile(r'^(%s)(-\d+)?\.html$' % '|'.join(re.escape(k) for k in keys)) if keys else None
+        return [os.path.join(SITE, n) for n in listdir(SITE) if pages and pages.match(n)]
+    raise ValueError(f'unknown step {step}')
+
+
+def plan(opts):
+    """Every unit of the build, dependencies first."""
+    optimizer_args = (['--avif'] if opts.avif else []) + (['--adaptive'] if opts.adaptive else [])
+    prune = ['--prune'] if opts.prune else []
+    fingerprint = ['--fingerprint'] if opts.fingerprint else []
+    units = []
+    for cat in categories(ORIGINALS_ROOT):
+        units.append(Unit(f'convert-psds:{cat}', 'convert-psds.py', cat, ['--category', cat] + prune, []))
+        units.append(Unit(f'optimize-originals:{cat}', 'optimize-originals.py', cat,
+                          ['--category', cat] + optimizer_args + prune, [f'convert-psds:{cat}']))
+    for cat in categories(IMAGES_ROOT):
+        units.append(Unit(f'optimize-images:{cat}', 'optimize-images.py', cat,
+                          ['--category', cat] + optimizer_args + prune, []))
+    optimized = [u.name for u in units if u.script != 'convert-psds.py']
+    units.append(Unit('generate-manifest', 'generate-manifest.py', None, ['--incremental'], optimized))
+    units.append(Unit('crop-heroes', 'crop-heroes.py', None, prune, ['generate-manifest']))
+    last = 'crop-heroes'
+    if opts.fingerprint:
+        units.append(Unit('fingerprint-assets', 'fingerprint-assets.py', None, prune, [last]))
+        last = 'fingerprint-assets'
+    # the crops crop-heroes just wrote are only listed once the manifest is generated again
+    units.append(Unit('list-crops', 'generate-manifest.py', None, ['--incremental'] + fingerprint, [last]))
+    units.append(Unit('generate-sections', 'generate-sections.py', None, fingerprint, ['list-crops']))
+    return units
+
+
+def rel(path):
+    return os.path.relpath(path, ROOT).replace('\\', '/')
+
+
+def snapshot(unit, opts):
+    """``{path: [size, mtime_ns]}`` of the unit's inputs and the code it runs."""
+    code = [os.path.join(TOOLS, unit.script)] + [os.path.join(TOOLS, m) for m in SHARED_MODULES]
+    stats = {}
+    for path in step_inputs(unit, opts) + code:
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        stats[rel(path)] = [st.st_size, st.st_mtime_ns]
+    return stats
+
+
+def sample(paths, limit=3):
+    more = f' (+{len(paths) - limit} more)' if len(paths) > limit else ''
+    return ', '.join(paths[:limit]) + more
+
+
+def reasons(unit, previous, inputs):
+    """Why ``unit`` must run, given its last successful run (``None`` if it never ran); empty when fresh."""
+    if previous is None:
+        return ['never built']
+    why = []
+    if previous['argv'] != unit.argv:
+        why.append(f"options changed: '{' '.join(previous['argv'])}' -> '{' '.join(unit.argv)}'")
+    old = previous['inputs']
+    for label, paths in (('new', sorted(set(inputs) - set(old))),
+                         ('changed', sorted(p for p in inputs if p in old and old[p] != inputs[p])),
+                         ('removed', sorted(set(old) - set(inputs)))):
+        if paths:
+            why.append(f'{len(paths)} {label} input(s): {sample(paths)}')
+    missing = [p for p in previous['outputs'] if not os.path.exists(os.path.join(ROOT, p))]
+    if missing:
+        why.append(f'{len(missing)} output(s) missing: {sample(missing)}')
+    return why
+
+
+def run_unit(script, argv, emit):
+    """Run ``tools/<script> argv`` in its own interpreter; returns ``(ok, info)``.
+
+    Every line the tool prints (stdout and stderr) is passed to ``emit`` as soon
+    as it is written.
+    """
+    start = time.perf_counter()
+    command = [sys.executable, '-u', os.path.join(TOOLS, script)] + argv
+    with tracing.span('unit', script=script, argv=' '.join(argv)):
+        try:
+            proc = subprocess.Popen(command, cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                    text=True, errors='replace')
+        except OSError as e:
+            emit(f'cannot start {script}: {e}')
+            return False, {'seconds': time.perf_counter() - start}
+        with proc:
+            for line in proc.stdout:
+                emit(line.rstrip('\n'))
+        status = proc.wait()
+    return status == 0, {'seconds': time.perf_counter() - start}
+
+
+def load_state():
+    try:
+        with open(STATE_FILE, 'r', encoding='utf-8') as fh:
+            data = json.load(fh)
+    except (OSError, ValueError):
+        return {}
+    return data.get('units', {}) if data.get('version') == STATE_VERSION else {}
+
+
+def build(units, opts, state):
+    """Run (or with ``opts.dry_run`` only explain) the units in waves; returns ``{unit name: status}``."""
+    status = {}
+    pending = list(units)
+    width = max(len(u.name) for u in units)
+    while pending:
+        ready = [u for u in pending if all(d in status for d in u.after)]
+        pending = [u for u in pending if u not in ready]
+        todo = []
+        for unit in ready:
+            upstream = [d for d in unit.after if status[d] in ('failed', 'blocked')]
+            if upstream:
+                status[unit.name] = 'blocked'
+                print(f'{unit.name:{width}} blocked: {sample(upstream)} failed')
+                continue
+            inputs = snapshot(unit, opts)
+            previous = state.get(unit.name)
+            why = ['--force'] if opts.force else reasons(unit, previous, inputs)
+            code = {rel(os.path.join(TOOLS, m)) for m in (unit.script,) + SHARED_MODULES}
+            if why and previous is None and not set(inputs) - code:
+                # nothing to work on, e.g. a category without PSDs
+                status[unit.name] = 'empty'
+                if opts.dry_run or opts.verbose:
+                    print(f'{unit.name:{width}} nothing to do')
+                continue
+            if not why:
+                rerun = [d for d in unit.after if status[d] in ('would run', 'may run')]
+                if opts.dry_run and rerun:
+                    status[unit.name] = 'may run'
+                    print(f'{unit.name:{width}} may run: {sample(rerun)} would run first and may change its inputs')
+                else:
+                    status[unit.name] = 'fresh'
+                    if opts.dry_run or opts.verbose:
+                        print(f'{unit.name:{width}} up to date')
+                continue
+            if opts.dry_run:
+                status[unit.name] = 'would run'
+                print(f"{unit.name:{width}} would run: {'; '.join(why)}")
+                continue
+            print(f"{unit.name:{width}} running: {'; '.join(why)}")
+            todo.append(unit)
+
+        if not todo:
+            continue
+        each = max(1, opts.jobs // len(todo))
+        lock = threading.Lock()
+
+        def emit(unit, line):
+            with lock:
+                print(f'  [{unit.name}] {line}', flush=True)
+
+        with ThreadPoolExecutor(max_workers=min(opts.jobs, len(todo))) as pool:
+            futures = {pool.submit(run_unit, u.script,
+                                   u.argv + (['--jobs', str(each)] if u.script in PARALLEL_SCRIPTS else []),
+                                   lambda line, u=u: emit(u, line)): u
+                       for u in todo}
+            for future in as_completed(futures):
+                unit, (ok, info) = futures[future], future.result()
+                status[unit.name] = 'ran' if ok else 'failed'
+                with lock:
+                    print(f"{unit.name:{width}} {'done' if ok else 'FAILED'} in {info['seconds']:.1f}s", flush=True)
+                if ok:
+                    # taken after the run, so files a unit rewrites among its own inputs don't rerun it
+                    state[unit.name] = {'argv': unit.argv, 'inputs': snapshot(unit, opts),
+                                        'outputs': sorted(rel(p) for p in step_outputs(unit))}
+                else:
+                    state.pop(unit.name, None)
+        replace_json(STATE_FILE, {'version': STATE_VERSION, 'units': state})
+    return status
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-n', '--dry-run', action='store_true', help='only print which units would run and why')
+    parser.add_argument('-j', '--jobs', type=int, default=workers.default_jobs(),
+                        help='worker processes, shared between the units that run together (default: number of CPUs)')
+    parser.add_argument('--force', action='store_true',
+                        help='run every unit (the tools still skip files their own caches know are up to date)')
+    parser.add_argument('--prune', action='store_true', help='pass --prune to the tools that delete stale outputs')
+    parser.add_argument('--fingerprint', action='store_true',
+                        help='also fingerprint assets and point the manifest and pages at the hashed names')
+    parser.add_argument('--avif', action='store_true', help='have the optimizers write AVIF variants too')
+    parser.add_argument('--adaptive', action='store_true', help='have the optimizers pick adaptive breakpoints')
+    parser.add_argument('-v', '--verbose', action='store_true', help='also list the units that are up to date')
+    tracing.add_arguments(parser)
+    args = parser.parse_args(argv)
+    tracing.from_args(args, 'build')
+
+    start = time.perf_counter()
+    units = plan(args)
+    status = build(units, args, {} if args.force else load_state())
+    tracing.finish(args)
+
+    counts = {}
+    for s in status.values():
+        counts[s] = counts.get(s, 0) + 1
+    summary = ', '.join(f'{n} {s}' for s, n in sorted(counts.items()))
+    print(f'Build {"plan" if args.dry_run else "finished"}: {len(units)} units ({summary}) '
+          f'in {time.perf_counter() - start:.1f}s')
+    return 1 if counts.get('failed') or counts.get('blocked') else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
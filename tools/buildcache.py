@@ -0,0 +1,266 @@
+"""Persistent build cache for the image pipeline.
+
+Entries are keyed by the source path (relative to the repo root) and store the
+source content hash, the settings that produced the outputs and the outputs
+themselves. A source is only hashed again when its size or mtime changed, so a
+no-op run costs one ``stat`` per source and per output. Saving merges the
+entries this run changed into the file on disk under a lock, so runs over
+different categories (see build.py) can share a cache.
+"""
+import os
+import json
+import hashlib
+import tempfile
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+CACHE_DIR = os.path.join(ROOT, '.cache')
+
+FORMAT_VERSION = 1
+
+# mkstemp creates files readable by the owner only; replaced files are made
+# world-readable like any output the site serves (a fixed mode, since reading
+# the umask means setting it, which would race other threads creating files)
+FILE_MODE = 0o644
+
+
+def file_hash(path, chunk_size=1024 * 1024):
+    h = hashlib.sha256()
+    with open(path, 'rb') as fh:
+        for block in iter(lambda: fh.read(chunk_size), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def settings_key(*parts):
+    """Stable digest of anything JSON-serializable that affects the outputs."""
+    blob = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(blob.encode('utf-8')).hexdigest()[:16]
+
+
+def encoder_version():
+    from PIL import features, __version__ as pil_version
+    return {
+        'pillow': pil_version,
+        'webp': features.version('webp'),
+        'jpg': features.version('jpg'),
+    }
+
+
+@contextmanager
+def locked(path):
+    """Hold an exclusive lock on ``path + '.lock'`` for a read-merge-write of ``path``."""
+    if fcntl is None:
+        yield
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.lock', 'a') as fh:
+        fcntl.flock(fh, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fh, fcntl.LOCK_UN)
+
+
+def replace_file(path, data):
+    """Write ``data`` (bytes) to a temporary file next to ``path`` and move it into place.
+
+    Readers see the old or the new contents, never a half-written file, and
+    hardlinks to the old file (fingerprinted copies) keep the old contents.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as fh:
+            fh.write(data)
+        os.chmod(tmp, FILE_MODE)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def replace_json(path, data):
+    """Write ``data`` as JSON (sorted keys) to ``path`` atomically."""
+    replace_file(path, json.dumps(data, sort_keys=True).encode('utf-8'))
+
+
+def write_if_changed(path, text):
+    """Atomically replace ``path`` with ``text`` unless it already holds exactly those bytes; True if written."""
+    data = text.encode('utf-8')
+    try:
+        with open(path, 'rb') as fh:
+            if fh.read() == data:
+                return False
+    except OSError:
+        pass
+    replace_file(path, data)
+    return True
+
+
+def _stat_sig(path):
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns]
+
+
+class BuildCache:
+    def __init__(self, name, path=None):
+        self.path = path or os.path.join(CACHE_DIR, f'{name}.json')
+        self.entries = self._load()
+        # keys this run recorded or forgot; only those are merged into the file on save
+        self.changed = set()
+        self.removed = set()
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as fh:
+                data = json.load(fh)
+        except (OSError, ValueError):
+            return {}
+        return data.get('entries', {}) if data.get('version') == FORMAT_VERSION else {}
+
+    @property
+    def dirty(self):
+        return bool(self.changed or self.removed)
+
+    def key(self, src):
+        return os.path.relpath(src, ROOT).replace('\\', '/')
+
+    def source_hash(self, src):
+        """Content hash of ``src``, reusing the cached one while size and mtime are unchanged."""
+        sig = _stat_sig(src)
+        entry = self.entries.get(self.key(src))
+        if entry and entry.get('stat') == sig:
+            return entry['hash'], sig
+        return file_hash(src), sig
+
+    def is_fresh(self, src, settings):
+        entry = self.entries.get(self.key(src))
+        if not entry or entry.get('settings') != settings:
+            return False
+        try:
+            digest, sig = self.source_hash(src)
+        except OSError:
+            return False
+        if digest != entry.get('hash'):
+            return False
+        if sig != entry.get('stat'):
+            # touched but identical content: remember the new stat so we skip hashing next time
+            entry['stat'] = sig
+            self.changed.add(self.key(src))
+        for out, size in entry.get('outputs', {}).items():
+            try:
+                if os.path.getsize(os.path.join(ROOT, out)) != size:
+                    return False
+            except OSError:
+                return False
+        return True
+
+    def get(self, src):
+        return self.entries.get(self.key(src))
+
+    def previous(self, src):
+        """Entry for ``src`` if it was built from the same content, whatever the settings."""
+        entry = self.entries.get(self.key(src))
+        if not entry:
+            return None
+        try:
+            digest, _ = self.source_hash(src)
+        except OSError:
+            return None
+        return entry if digest == entry.get('hash') else None
+
+    def record(self, src, settings, outputs, **extra):
+        """Remember that ``outputs`` were built from the current contents of ``src``.
+
+        Returns the outputs of the previous build of ``src`` that this one no
+        longer wrote (e.g. breakpoints of an older adaptive ladder).
+        """
+        previous = set((self.entries.get(self.key(src)) or {}).get('outputs', {}))
+        digest, sig = self.source_hash(src)
+        recorded = {}
+        for out in outputs:
+            try:
+                recorded[self.key(out)] = os.path.getsize(out)
+            except OSError:
+                pass
+        entry = {'hash': digest, 'stat': sig, 'settings': settings, 'outputs': recorded}
+        entry.update(extra)
+        self.entries[self.key(src)] = entry
+        self.changed.add(self.key(src))
+        self.removed.discard(self.key(src))
+        return sorted(previous - {self.key(out) for out in outputs})
+
+    def stale_outputs(self, under=()):
+        """Outputs whose recorded source no longer exists, as ``(source, [outputs])`` pairs.
+
+        With ``under`` (directories), only sources inside one of them are considered.
+        """
+        prefixes = tuple(self.key(d).rstrip('/') + '/' for d in under)
+        gone = {k for k in self.entries if (not prefixes or k.startswith(prefixes))
+                and not os.path.exists(os.path.join(ROOT, k))}
+        live_outputs = set()
+        for key, entry in self.entries.items():
+            if key not in gone:
+                live_outputs.update(entry.get('outputs', {}))
+        stale = []
+        for key in sorted(gone):
+            outs = [o for o in sorted(self.entries[key].get('outputs', {}))
+                    if o not in live_outputs and os.path.exists(os.path.join(ROOT, o))]
+            stale.append((key, outs))
+        return stale
+
+    def forget(self, key):
+        if self.entries.pop(key, None) is not None:
+            self.removed.add(key)
+            self.changed.discard(key)
+
+    def save(self):
+        if not self.dirty:
+            return
+        with locked(self.path):
+            # another run may have saved other sources since this one loaded the file
+            entries = self._load()
+            for key in self.changed:
+                entries[key] = self.entries[key]
+            for key in self.removed:
+                entries.pop(key, None)
+            replace_json(self.path, {'version': FORMAT_VERSION, 'entries': entries})
+        self.entries = entries
+        self.changed.clear()
+        self.removed.clear()
+
+
+def report_stale(cache, prune=False, under=()):
+    """Print (and optionally delete) outputs whose sources are gone (inside ``under``, if given)."""
+    for src, outs in cache.stale_outputs(under):
+        for out in outs:
+            if prune:
+                os.remove(os.path.join(ROOT, out))
+                print(f'Removed stale output: {out} (source {src} is gone)')
+            else:
+                print(f'Stale output: {out} (source {src} is gone)')
+        if prune or not outs:
+            cache.forget(src)
+
+
+def report_superseded(outputs, prune=False):
+    """Print (and optionally delete) outputs a rebuild of their source no longer writes."""
+    for out in outputs:
+        path = os.path.join(ROOT, out)
+        if not os.path.exists(path):
+            continue
+        if prune:
+            os.remove(path)
+            print(f'Removed superseded output: {out}')
+        else:
+            print(f'Superseded output: {out}')
@@ -0,0 +1,239 @@
+"""In-memory index of a category folder under images/.
+
+One ``os.scandir`` pass per category answers every variant, hero and focus
+lookup the manifest needs, instead of a ``Path.exists()`` call per candidate.
+"""
+import os
+import re
+import json
+
+from buildcache import locked, replace_json
+
+VARIANTS = ('thumb', 'medium', 'full')
+
+FOCUS_KEYWORDS = ('left', 'right', 'top', 'bottom')
+
+# Focus point (x, y as fractions of the width/height) for each keyword
+FOCUS_POINTS = {'left': (0.0, 0.5), 'right': (1.0, 0.5), 'top': (0.5, 0.0), 'bottom': (0.5, 1.0)}
+
+# Adaptive breakpoints written by the optimizers' --adaptive mode: <base>-<width>w.<ext>
+WIDTH_RE = re.compile(r'-(\d+)w\.(webp|jpg|avif)$')
+
+# Pre-cropped hero variants written by crop-heroes.py: <base>-crop-<shape>-<width>.<ext>
+CROP_RE = re.compile(r'-crop-(portrait|square)-(\d+)\.(webp|jpg)$')
+
+
+class CategoryIndex:
+    def __init__(self, cat_dir):
+        self.dir = cat_dir
+        self.entries = {}
+        self._widths = {}  # base -> {width}
+        self._crops = {}  # base -> {shape: {ext: {width: name}}}
+        with os.scandir(cat_dir) as it:
+            for entry in it:
+                self.entries[entry.name] = entry
+                m = WIDTH_RE.search(entry.name)
+                if m:
+                    self._widths.setdefault(entry.name[:m.start()], set()).add(int(m.group(1)))
+                m = CROP_RE.search(entry.name)
+                if m:
+                    shape, width, ext = m.groups()
+                    crops = self._crops.setdefault(entry.name[:m.start()], {})
+                    crops.setdefault(shape, {}).setdefault(ext, {})[int(width)] = entry.name
+        self.mtime_ns = os.stat(cat_dir).st_mtime_ns
+
+    def __contains__(self, name):
+        return name in self.entries
+
+    def names(self):
+        return self.entries.keys()
+
+    def path(self, name):
+        return os.path.join(self.dir, name)
+
+    def read_text(self, name):
+        """Contents of ``name`` if it is in the folder, else ``None``."""
+        if name not in self.entries:
+            return None
+        try:
+            with open(self.path(name), 'r', encoding='utf-8') as fh:
+                return fh.read()
+        except (OSError, UnicodeDecodeError):
+            return None
+
+    def bases(self):
+        """Image bases, discovered from their thumbnails."""
+        bases = set()
+        for name in self.entries:
+            if name.endswith('-thumb.webp') or name.endswith('-thumb.jpg'):
+                bases.add(name.rsplit('-thumb', 1)[0])
+        return bases
+
+    def hero_bases(self):
+        """Bases marked as hero by a ``<base>-hero.*`` file or listed in ``hero.txt``."""
+        heroes = set()
+        for name in self.entries:
+            if '-hero.' in name:
+                heroes.add(name.rsplit('-hero', 1)[0])
+        txt = self.read_text('hero.txt')
+        if txt:
+            for line in txt.strip().splitlines():
+                line = line.strip()
+                if line:
+                    heroes.add(line)
+        return heroes
+
+    def variant(self, base, name, ext):
+        """File name of ``<base>-<name>.<ext>`` if it exists, else ``None``."""
+        fname = f"{base}-{name}.{ext}"
+        return fname if fname in self.entries else None
+
+    def placeholder(self, base):
+        """Placeholder written by the optimizers to ``<base>-lqip.json``, or ``None``."""
+        txt = self.read_text(f"{base}-lqip.json")
+        if txt is None:
+            return None
+        try:
+            return json.loads(txt)
+        except ValueError:
+            return None
+
+    def widths(self, base):
+        """Widths of the adaptive ``<base>-<width>w.*`` variants, ascending."""
+        return sorted(self._widths.get(base, ()))
+
+    def crops(self, base):
+        """``{shape: {ext: {width: fname}}}`` for the hero crops of ``base``."""
+        return self._crops.get(base, {})
+
+    def focus_text(self, base):
+        """Raw contents of ``<base>-focus.txt``, or ``None``."""
+        return self.read_text(f"{base}-focus.txt")
+
+    def control_files(self):
+        """Small text files whose contents (not just presence) affect the manifest."""
+        return sorted(n for n in self.entries if n == 'hero.txt' or n.endswith('-focus.txt'))
+
+
+def css_position(txt):
+    """CSS ``object-position`` value for a focus file, or ``None``."""
+    txt = txt.strip()
+    if txt in FOCUS_KEYWORDS:
+        return txt
+    parts = txt.split()
+    if len(parts) == 2:
+        # expect numbers as percentages
+        x, y = parts
+        return f"{x}% {y}%"
+    return None
+
+
+def parse_focus(txt):
+    """Focus point ``(x, y)`` as fractions (0..1) for a focus file, or ``None``.
+
+    Accepts the same forms as :func:`css_position`: a keyword or "x y" percentages.
+    """
+    txt = txt.strip()
+    if txt in FOCUS_POINTS:
+        return FOCUS_POINTS[txt]
+    parts = txt.split()
+    if len(parts) == 2:
+        try:
+            x, y = (float(p.rstrip('%')) / 100 for p in parts)
+        except ValueError:
+            return None
+        return min(max(x, 0.0), 1.0), min(max(y, 0.0), 1.0)
+    return None
+
+
+class FileInfoCache:
+    """Per-file facts the manifest needs (pixel size, placeholder, dHash), cached by size/mtime.
+
+    Sizes come from ``Image.open``, which only parses the header; no pixels are
+    decoded. Placeholders are only computed for files without a ``-lqip.json``
+    sidecar from the optimizers.
+    """
+    def __init__(self, path):
+        self.path = str(path)
+        self.entries = self._load()
+        # files whose entry this run (re)computed; only those are merged into the file on save
+        self.changed = set()
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as fh:
+                return json.load(fh)
+        except (OSError, ValueError):
+            return {}
+
+    def _entry(self, index, fname):
+        """Cache entry for ``fname``, reset when the file changed; ``None`` if it is missing."""
+        dir_entry = index.entries.get(fname)
+        if dir_entry is None:
+            return None
+        try:
+            st = dir_entry.stat()
+        except OSError:
+            return None
+        key = index.path(fname)
+        sig = [st.st_size, st.st_mtime_ns]
+        cached = self.entries.get(key)
+        if not cached or cached.get('stat') != sig:
+            cached = self.entries[key] = {'stat': sig}
+            self.changed.add(key)
+        return cached
+
+    def size(self, index, fname):
+        """``(width, height)`` of ``fname`` in ``index``, or ``None`` if it can't be read."""
+        cached = self._entry(index, fname)
+        if cached is None:
+            return None
+        if 'size' not in cached:
+            from PIL import Image
+            try:
+                with Image.open(index.path(fname)) as img:
+                    cached['size'] = list(img.size)
+            except Exception:
+                return None
+            self.changed.add(index.path(fname))
+        return tuple(cached['size'])
+
+    def placeholder(self, index, fname):
+        """Placeholder dict (see ``imaging.placeholder``) computed from ``fname``, or ``None``."""
+        cached = self._entry(index, fname)
+        if cached is None:
+            return None
+        if 'placeholder' not in cached:
+            import imaging
+            try:
+                cached['placeholder'] = imaging.placeholder_from_file(index.path(fname))
+            except Exception:
+                return None
+            self.changed.add(index.path(fname))
+        return cached['placeholder']
+
+    def dhash(self, index, fname):
+        """Perceptual hash (see ``dupes.dhash``) of ``fname``, or ``None`` if it can't be read."""
+        cached = self._entry(index, fname)
+        if cached is None:
+            return None
+        if 'dhash' not in cached:
+            import dupes
+            try:
+                cached['dhash'] = dupes.dhash_file(index.path(fname))
+            except Exception:
+                return None
+            self.changed.add(index.path(fname))
+        return cached['dhash']
+
+    def save(self):
+        if not self.changed:
+            return
+        with locked(self.path):
+            # merge into what other runs (other categories) saved meanwhile
+            entries = self._load()
+            for key in self.changed:
+                entries[key] = self.entries[key]
+            replace_json(self.path, entries)
+        self.entries = entries
+        self.changed.clear()
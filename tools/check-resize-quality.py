@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""Compare the single-decode resize cascade against the previous resize path.
+
+The reference is what the optimizers used to do: decode the original at full
+resolution and LANCZOS-resize every variant from it. For each original the
+script reports the PSNR of every cascade variant against the reference, and
+for the whole run the CPU time and peak RSS of each method (each method runs
+in its own child process so the RSS figures don't mix).
+
+    python3 tools/check-resize-quality.py [--limit N] [--min-psnr 38]
+"""
+import os
+import sys
+import glob
+import math
+import time
+import argparse
+import resource
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image, ImageChops, ImageOps, ImageStat
+
+import imaging
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+ORIGINALS_ROOT = os.path.join(ROOT, 'images', 'originals')
+
+SIZES = [
+    ('thumb', 600, 80),
+    ('medium', 1200, 85),
+    ('full', 1920, 90),
+]
+
+EXTENSIONS = ('.jpg', '.jpeg', '.png', '.tiff', '.webp', '.heic')
+
+
+def reference_variants(path):
+    with Image.open(path) as img:
+        img.load()
+        upright = ImageOps.exif_transpose(img)
+        return {name: upright.resize(imaging.target_size(upright.size, width), Image.LANCZOS)
+                for name, width, _ in SIZES}
+
+
+def cascade_variants(path):
+    with Image.open(path) as img:
+        original_size = imaging.open_for_ladder(img, SIZES)
+        img.load()
+        # the size above is the upright one; the pixels are turned to match as the optimizers do
+        source, _, _ = imaging.normalize(img)
+        return dict(imaging.resize_cascade(source, original_size, SIZES))
+
+
+METHODS = {'reference': reference_variants, 'cascade': cascade_variants}
+
+
+def psnr(a, b):
+    if a.size != b.size:
+        return 0.0
+    diff = ImageChops.difference(a.convert('RGB'), b.convert('RGB'))
+    stat = ImageStat.Stat(diff)
+    mse = sum(stat.sum2) / (a.size[0] * a.size[1] * len(stat.sum2))
+    if mse == 0:
+        return math.inf
+    return 10 * math.log10(255 * 255 / mse)
+
+
+def measure(method, files):
+    """Run one method over all files in a fresh process; returns (cpu_seconds, peak_rss_kb)."""
+    func = METHODS[method]
+    start = time.process_time()
+    for f in files:
+        func(f)
+    return time.process_time() - start, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--limit', type=int, default=0, help='only check the first N originals')
+    parser.add_argument('--min-psnr', type=float, default=38.0, help='fail when a variant drops below this PSNR (dB)')
+    args = parser.parse_args(argv)
+
+    files = []
+    for ext in EXTENSIONS:
+        files.extend(glob.glob(os.path.join(ORIGINALS_ROOT, '**', f'*{ext}'), recursive=True))
+    files.sort()
+    if args.limit:
+        files = files[:args.limit]
+    if not files:
+        print('No originals found')
+        return 0
+
+    # measure first, before this process has decoded anything itself
+    for method in METHODS:
+        with ProcessPoolExecutor(max_workers=1) as pool:
+            cpu, rss = pool.submit(measure, method, files).result()
+        print(f'{method:>9}: cpu {cpu:.2f}s, peak RSS {rss / 1024:.1f} MB')
+
+    failures = 0
+    print(f'{"file":50} ' + ' '.join(f'{name:>8}' for name, _, _ in SIZES))
+    for f in files:
+        ref = reference_variants(f)
+        new = cascade_variants(f)
+        scores = {name: psnr(ref[name], new[name]) for name, _, _ in SIZES}
+        bad = [name for name, score in scores.items() if score < args.min_psnr]
+        failures += bool(bad)
+        rel = os.path.relpath(f, ORIGINALS_ROOT)
+        print(f'{rel:50} ' + ' '.join(f'{scores[name]:8.2f}' for name, _, _ in SIZES) + ('  LOW' if bad else ''))
+
+    if failures:
+        print(f'{failures} file(s) below {args.min_psnr} dB PSNR')
+        return 1
+    print(f'All variants within {args.min_psnr} dB PSNR of the reference')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,33 +1,195 @@
 #!/usr/bin/env python3
 import os
 import glob
+import time
+import struct
+import argparse
+import functools
+from collections import namedtuple
+
+import psd_tools
 from psd_tools import PSDImage
+from psd_tools.constants import Resource
 from PIL import Image
 
+import imaging
+import tracing
+import workers
+from buildcache import BuildCache, encoder_version, report_stale, settings_key
+
 ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 ORIGINALS_ROOT = os.path.join(ROOT, 'images', 'originals')
 
-if not os.path.isdir(ORIGINALS_ROOT):
-    print('No originals folder found, exiting')
-    exit(0)
+JPEG_QUALITY = 95
+
+# Rough per-pixel working set of psd-tools' layer compositing: float32 colour,
+# shape and alpha for the backdrop and the layer being blended.
+COMPOSITE_BYTES_PER_PIXEL = 48
+MIN_STRIP_HEIGHT = 64
+# Pillow keeps RGB images at four bytes per pixel
+CANVAS_BYTES_PER_PIXEL = 4
+
+# Writers (the PSD's version info) that rewrite the merged image whenever they
+# save the layers; merged images from anything else may be stale
+PREVIEW_WRITERS = ('Adobe Photoshop',)
+
+
+PsdHeader = namedtuple('PsdHeader', 'channels height width depth')
+
+
+def read_header(path):
+    """Read channels/size/depth from the 26-byte PSD/PSB file header without parsing layers."""
+    with open(path, 'rb') as fh:
+        data = fh.read(26)
+    if len(data) < 26 or data[:4] != b'8BPS':
+        raise ValueError(f'not a PSD file: {path}')
+    channels, height, width, depth = struct.unpack('>HIIH', data[12:24])
+    return PsdHeader(channels, height, width, depth)
+
+
+def header_estimate(psd):
+    """Bytes needed to hold the merged image data, from the PSD header alone.
+
+    ``psd`` may be a :class:`PSDImage` or a :class:`PsdHeader`.
+    """
+    return psd.width * psd.height * psd.channels * max(1, psd.depth // 8)
+
+
+def composite_estimate(psd):
+    return psd.width * psd.height * COMPOSITE_BYTES_PER_PIXEL
+
+
+def composite_in_strips(psd, budget):
+    """Composite the layers band by band into an RGB canvas.
+
+    Only one strip's float buffers are alive at a time, but the JPEG encoder
+    needs the whole image, so the 8-bit canvas is allocated in full: peak
+    memory is the canvas plus one strip. The strips get what the canvas leaves
+    of ``budget`` (at least ``MIN_STRIP_HEIGHT`` rows), so the budget is only
+    exceeded when the canvas alone does not fit in it.
+    """
+    width, height = psd.width, psd.height
+    left = budget - width * height * CANVAS_BYTES_PER_PIXEL
+    strip = max(MIN_STRIP_HEIGHT, left // max(1, width * COMPOSITE_BYTES_PER_PIXEL))
+    canvas = Image.new('RGB', (width, height), (255, 255, 255))
+    for top in range(0, height, strip):
+        bottom = min(height, top + strip)
+        part = psd.composite(viewport=(0, top, width, bottom), ignore_preview=True)
+        canvas.paste(imaging.to_jpeg_mode(part), (0, top))
+    return canvas
+
+
+def usable_preview(psd):
+    """The embedded merged image, if it is real, current and full resolution.
+
+    psd-tools cannot compare the merged image with the layers (``is_updated``
+    only tracks edits made since the file was opened), so for a layered PSD it
+    is trusted only when the version info says it was saved with "Maximize
+    compatibility" by one of ``PREVIEW_WRITERS``. A PSD without layers is its
+    merged image.
+    """
+    if not psd.has_preview():
+        return None
+    if len(psd):
+        version = psd.image_resources.get_data(Resource.VERSION_INFO)
+        if version is None or not version.has_composite or not str(version.writer).startswith(PREVIEW_WRITERS):
+            return None
+    image = psd.topil()
+    if image is None or image.size != (psd.width, psd.height):
+        return None
+    return image
 
-psd_files = glob.glob(os.path.join(ORIGINALS_ROOT, '**', '*.psd'), recursive=True)
-print(f'Found {len(psd_files)} PSD files to convert')
 
-for f in psd_files:
+def flatten(psd, budget=0):
+    """Return ``(rgb_image, method)`` for a PSD, staying within ``budget`` bytes when set."""
+    if budget and header_estimate(psd) > budget and len(psd):
+        # even the stored merged image would not fit; build it from the layers strip by strip
+        return composite_in_strips(psd, budget), 'strips'
+    image = usable_preview(psd)
+    if image is not None:
+        return imaging.to_jpeg_mode(image), 'preview'
+    if budget and composite_estimate(psd) > budget:
+        return composite_in_strips(psd, budget), 'strips'
+    return imaging.to_jpeg_mode(psd.composite(ignore_preview=True)), 'composite'
+
+
+def output_path(f):
+    return os.path.splitext(f)[0] + '.jpg'
+
+
+def convert_psd(f, budget=0):
+    """Flatten one PSD to JPEG and return ``(ok, log_lines)``; the log line names the path taken."""
+    start = time.perf_counter()
     try:
-        psd = PSDImage.open(f)
-        image = psd.topil()
-        out_path = os.path.splitext(f)[0] + '.jpg'
-        # Convert mode to RGB if necessary
-        if image.mode in ("RGBA", "LA"):
-            bg = Image.new("RGB", image.size, (255,255,255))
-            bg.paste(image, mask=image.split()[3])
-            bg.save(out_path, 'JPEG', quality=95)
-        else:
-            image.convert('RGB').save(out_path, 'JPEG', quality=95)
-        print(f'Converted {f} -> {out_path}')
+        with tracing.span('decode', file=f, bytes_in=os.path.getsize(f)):
+            psd = PSDImage.open(f)
+        with tracing.span('composite', file=f) as info:
+            image, method = flatten(psd, budget)
+            info['method'] = method
+        del psd
+        out_path = output_path(f)
+        imaging.save_atomic(image, out_path, 'JPEG', quality=JPEG_QUALITY)
     except Exception as e:
-        print(f'Failed to convert {f}: {e}')
+        return False, [f'Failed to convert {f}: {e}']
+    return True, [f'Converted {f} -> {out_path} ({method}, {time.perf_counter() - start:.2f}s)']
+
+
+def cost(f):
+    try:
+        header = read_header(f)
+    except (OSError, ValueError):
+        return 0
+    return max(header_estimate(header), composite_estimate(header))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Flatten PSDs under images/originals into JPEGs next to them')
+    workers.add_arguments(parser)
+    tracing.add_arguments(parser)
+    parser.add_argument('--force', action='store_true', help='ignore the composite cache and convert every PSD')
+    parser.add_argument('--prune', action='store_true', help='delete JPEGs whose PSD is gone')
+    parser.add_argument('--category', action='append', metavar='NAME',
+                        help='only convert PSDs in images/originals/NAME (repeatable; default: every category)')
+    args = parser.parse_args(argv)
+    tracing.from_args(args, 'convert-psds')
+    budget = workers.memory_budget_from_args(args)
+
+    if not os.path.isdir(ORIGINALS_ROOT):
+        print('No originals folder found, exiting')
+        return
+
+    roots = [os.path.join(ORIGINALS_ROOT, c) for c in args.category] if args.category else [ORIGINALS_ROOT]
+    psd_files = sorted(f for root in roots for f in glob.glob(os.path.join(root, '**', '*.psd'), recursive=True))
+    print(f'Found {len(psd_files)} PSD files to convert')
+
+    cache = BuildCache('convert-psds')
+    settings = settings_key(JPEG_QUALITY, PREVIEW_WRITERS, psd_tools.__version__, encoder_version())
+    todo = []
+    for f in psd_files:
+        if not args.force and cache.is_fresh(f, settings):
+            print(f'Up to date {f} -> {output_path(f)} (cached)')
+        else:
+            todo.append(f)
+
+    converted = failed = 0
+    convert = functools.partial(convert_psd, budget=budget)
+    try:
+        for f, (ok, log, _) in workers.run_jobs(convert, todo, args.jobs, workers.memory_limit_from_args(args),
+                                            cost=cost, budget=budget):
+            for line in log:
+                print(line)
+            if ok:
+                cache.record(f, settings, [output_path(f)])
+                converted += 1
+            else:
+                failed += 1
+        report_stale(cache, prune=args.prune, under=roots if args.category else ())
+    finally:
+        cache.save()
+
+    tracing.finish(args)
+    print(f'PSD conversion complete: {converted} converted, {len(psd_files) - len(todo)} cached, {failed} failed')
+
 
-print('PSD conversion complete')
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""Write art-directed hero crops for small screens.
+
+The hero of every section in site/data/sections.json is cropped around its
+focus point (``<base>-focus.txt``, parsed into the manifest's ``focus``; the
+centre when there is none) into portrait and square shapes at mobile widths:
+images/<category>/<base>-crop-<shape>-<width>.webp/.jpg. Re-run
+generate-manifest.py afterwards so the crops are listed and
+generate-sections.py can serve them through ``<source media=...>``.
+
+    python3 tools/crop-heroes.py [--force] [--prune]
+"""
+import os
+import sys
+import json
+import argparse
+
+from PIL import Image
+
+import imaging
+import tracing
+from buildcache import BuildCache, encoder_version, settings_key
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+IMAGES_ROOT = os.path.join(ROOT, 'images')
+DATA = os.path.join(ROOT, 'site', 'data', 'sections.json')
+
+# (shape, aspect ratio width/height, output widths)
+HERO_CROPS = [
+    ('portrait', 4 / 5, (480, 800)),
+    ('square', 1.0, (600, 900)),
+]
+CROP_QUALITY = 85
+
+
+def hero_source(cat, item):
+    """Largest variant of the hero (by stable name, whatever the manifest's paths look like)."""
+    for ext in ('jpg', 'webp'):
+        path = os.path.join(IMAGES_ROOT, cat, f"{item['id']}-full.{ext}")
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def crop_plan(size, focus):
+    """``[(shape, box, [widths])]`` for an image of ``size``; widths never upscale the crop."""
+    plan = []
+    for shape, aspect, widths in HERO_CROPS:
+        box = imaging.focus_box(size, aspect, focus)
+        crop_width = box[2] - box[0]
+        plan.append((shape, box, sorted({min(w, crop_width) for w in widths})))
+    return plan
+
+
+def write_crops(src, base, focus):
+    """Write every crop of ``src`` and return the files written."""
+    target_dir = os.path.dirname(src)
+    written = []
+    with Image.open(src) as img:
+        with tracing.span('decode', file=src, bytes_in=os.path.getsize(src)):
+            img.load()
+        for shape, box, widths in crop_plan(img.size, focus):
+            with tracing.span('crop', file=src, shape=shape):
+                cropped = img.crop(box)
+            # largest first, each width resized from the previous one as in the variant ladder
+            current = cropped
+            for width in sorted(widths, reverse=True):
+                size = imaging.target_size(cropped.size, width)
+                if current.size != size:
+                    with tracing.span('resize', file=src, shape=shape, size=list(size)):
+                        current = current.resize(size, Image.LANCZOS, reducing_gap=imaging.REDUCING_GAP)
+                for ext, fmt in (('webp', 'WEBP'), ('jpg', 'JPEG')):
+                    out = os.path.join(target_dir, f"{base}-crop-{shape}-{width}.{ext}")
+                    imaging.save_atomic(imaging.to_jpeg_mode(current), out, fmt, quality=CROP_QUALITY)
+                    written.append(out)
+    return written
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--force', action='store_true', help='ignore the build cache and crop every hero again')
+    parser.add_argument('--prune', action='store_true', help='delete crops of images that are no longer a hero')
+    tracing.add_arguments(parser)
+    args = parser.parse_args(argv)
+    tracing.from_args(args, 'crop-heroes')
+
+    with open(DATA, 'r', encoding='utf-8') as fh:
+        data = json.load(fh)
+
+    cache = BuildCache('crop-heroes')
+    heroes = set()
+    cropped = cached = failed = 0
+    try:
+        for cat, items in data.items():
+            hero = next((it for it in items if it.get('hero')), items[0] if items else None)
+            src = hero_source(cat, hero) if hero else None
+            if not src:
+                continue
+            heroes.add(cache.key(src))
+            focus = tuple(hero.get('focus') or (0.5, 0.5))
+            settings = settings_key(HERO_CROPS, CROP_QUALITY, focus, encoder_version(), imaging.ENGINE_VERSION)
+            if not args.force and cache.is_fresh(src, settings):
+                cached += 1
+                continue
+            try:
+                with tracing.span(tracing.FILE_SPAN, file=src):
+                    outputs = write_crops(src, hero['id'], focus)
+            except Exception as e:
+                print(f'Failed to crop {src}: {e}')
+                failed += 1
+                continue
+            cache.record(src, settings, outputs)
+            cropped += 1
+            print(f'Cropped {src} around {focus[0]:.0%} {focus[1]:.0%}: {len(outputs)} files')
+
+        # crops of images that used to be a hero
+        for key in sorted(set(cache.entries) - heroes):
+            for out in sorted(cache.entries[key].get('outputs', {})):
+                path = os.path.join(ROOT, out)
+                if not os.path.exists(path):
+                    continue
+                if args.prune:
+                    os.remove(path)
+                    print(f'Removed stale crop: {out}')
+                else:
+                    print(f'Stale crop: {out} ({key} is no longer a hero)')
+            if args.prune:
+                cache.forget(key)
+    finally:
+        cache.save()
+
+    tracing.finish(args)
+    print(f'Hero crops: {cropped} cropped, {cached} cached, {failed} failed')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
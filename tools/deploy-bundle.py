@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+"""Assemble the deployable site: only referenced files, linked, with precompressed siblings.
+
+Starting from the pages in site/, every URL they reference (href, src,
+srcset, imagesrcset; url() and @import in stylesheets) is followed, along with
+the manifest data manifest.js fetches and every image path listed in it.
+Everything else (unused variants, placeholders' sidecars, hero/focus files,
+.DS_Store, originals) stays out of the bundle.
+
+Files are hardlinked into the bundle (reflinked or copied when a hardlink
+isn't possible) and left alone while unchanged, so a rebuild only touches what
+changed; files no longer referenced are removed from it. HTML, JSON, CSS and
+JS get ``.gz`` siblings, plus ``.br`` when the ``brotli`` module is installed.
+A size report per category (pages, shard and images) is printed and saved as
+JSON, with the change since the previous report.
+
+    python3 tools/deploy-bundle.py [--out _deploy] [--report .cache/deploy-sizes.json] [-j N]
+"""
+import os
+import re
+import sys
+import gzip
+import json
+import shutil
+import argparse
+from html.parser import HTMLParser
+from urllib.parse import unquote, urlsplit
+
+import workers
+
+try:
+    import brotli
+except ImportError:  # optional: pip install brotli
+    brotli = None
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+SITE = os.path.join(ROOT, 'site')
+OUT = os.path.join(ROOT, '_deploy')
+REPORT_FILE = os.path.join(ROOT, '.cache', 'deploy-sizes.json')
+
+# Manifest data fetched by assets/js/manifest.js (shards are added per section in the index)
+DATA_FILES = ('data/index.json', 'data/sections.json')
+
+URL_ATTRS = ('href', 'src', 'poster')
+SRCSET_ATTRS = ('srcset', 'imagesrcset')
+CSS_URL_RE = re.compile(r'''url\(\s*['"]?([^'")]+)['"]?\s*\)|@import\s+['"]([^'"]+)['"]''')
+
+COMPRESSIBLE = ('.html', '.json', '.css', '.js')
+# smaller files are not worth a sibling (the headers outweigh the saving)
+MIN_COMPRESS = 256
+
+# Linux FICLONE ioctl: share the source's blocks (btrfs, XFS) when a hardlink is not possible
+FICLONE = 0x40049409
+
+SECTION_PAGE_RE = re.compile(r'^(.+?)(-\d+)?\.html$')
+
+
+class _References(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.urls = []
+
+    def handle_starttag(self, tag, attrs):
+        for name, value in attrs:
+            if not value:
+                continue
+            if name in URL_ATTRS:
+                self.urls.append(value)
+            elif name in SRCSET_ATTRS:
+                self.urls.extend(srcset_urls(value))
+
+
+def srcset_urls(value):
+    return [part.split()[0] for part in value.split(',') if part.strip()]
+
+
+def local_path(url, referrer):
+    """Site-relative path ``url`` points at from ``referrer`` (site-relative), or ``None`` if external."""
+    parts = urlsplit(url)
+    if parts.scheme or parts.netloc or not parts.path:
+        return None
+    path = unquote(parts.path)
+    joined = path.lstrip('/') if path.startswith('/') else os.path.join(os.path.dirname(referrer), path)
+    rel = os.path.normpath(joined).replace('\\', '/')
+    if rel.startswith('..') or os.path.isabs(rel):
+        return None
+    if rel == '.':
+        return 'index.html'
+    return f'{rel}/index.html' if path.endswith('/') else rel
+
+
+def json_paths(value, base=''):
+    """Strings in manifest data that may be file paths: srcset entries split, shard bases applied."""
+    if isinstance(value, dict):
+        base = value.get('base', base) if isinstance(value.get('base'), str) else base
+        for v in value.values():
+            yield from json_paths(v, base)
+    elif isinstance(value, list):
+        for v in value:
+            yield from json_paths(v, base)
+    elif isinstance(value, str) and not value.startswith('data:'):
+        for url in srcset_urls(value):
+            yield url
+            if base:
+                yield base + url
+
+
+def references(rel):
+    """Site-relative paths ``rel`` refers to."""
+    path = os.path.join(SITE, rel)
+    ext = os.path.splitext(rel)[1].lower()
+    if ext == '.html':
+        parser = _References()
+        with open(path, 'r', encoding='utf-8') as fh:
+            parser.feed(fh.read())
+        return [p for p in (local_path(u, rel) for u in parser.urls) if p]
+    if ext == '.css':
+        with open(path, 'r', encoding='utf-8') as fh:
+            text = fh.read()
+        return [p for p in (local_path(a or b, rel) for a, b in CSS_URL_RE.findall(text)) if p]
+    if ext == '.json' and rel.startswith('data/'):
+        with open(path, 'r', encoding='utf-8') as fh:
+            data = json.load(fh)
+        # paths in the manifest are relative to the pages, i.e. to site/
+        found = [p for p in (local_path(u, '') for u in json_paths(data)) if p and os.path.isfile(os.path.join(SITE, p))]
+        if rel == 'data/index.json':
+            found.extend(f'data/sections/{key}.json' for key in data.get('sections', {}))
+        return found
+    return []
+
+
+def collect(site=None):
+    """``(bundle, missing)``: every referenced site-relative path and ``{missing path: referrer}``."""
+    site = site or SITE
+    roots = sorted(n for n in os.listdir(site) if n.endswith('.html')) + list(DATA_FILES)
+    bundle, missing = set(), {}
+    queue = [(p, None) for p in roots]
+    while queue:
+        rel, referrer = queue.pop()
+        if rel in bundle:
+            continue
+        if not os.path.isfile(os.path.join(site, rel)):
+            if referrer:
+                missing.setdefault(rel, referrer)
+            continue
+        bundle.add(rel)
+        queue.extend((p, rel) for p in references(rel) if p not in bundle)
+    return bundle, missing
+
+
+def link_file(src, dst):
+    """Put ``src`` at ``dst`` as a hardlink, a reflink or a copy; returns which."""
+    try:
+        os.link(src, dst)
+        return 'linked'
+    except OSError:
+        pass
+    if fcntl is not None:
+        try:
+            with open(src, 'rb') as fin, open(dst, 'wb') as fout:
+                fcntl.ioctl(fout.fileno(), FICLONE, fin.fileno())
+            shutil.copystat(src, dst)
+            return 'reflinked'
+        except OSError:
+            os.unlink(dst)
+    shutil.copy2(src, dst)
+    return 'copied'
+
+
+def is_current(src, dst):
+    try:
+        a, b = os.stat(src), os.stat(dst)
+    except OSError:
+        return False
+    return (a.st_ino == b.st_ino and a.st_dev == b.st_dev) or (a.st_size, a.st_mtime_ns) == (b.st_size, b.st_mtime_ns)
+
+
+def compress_file(path):
+    """Write ``.gz`` (and ``.br``) next to ``path`` unless fresh; returns ``(ok, lines, {encoding: size})``."""
+    st = os.stat(path)
+    sizes = {}
+    data = None
+    for ext, encode in (('.gz', lambda d: gzip.compress(d, compresslevel=9, mtime=0)),
+                        ('.br', brotli.compress if brotli else None)):
+        if encode is None:
+            continue
+        sibling = path + ext
+        try:
+            sib = os.stat(sibling)
+            if sib.st_mtime_ns == st.st_mtime_ns:
+                sizes[ext[1:]] = sib.st_size
+                continue
+        except OSError:
+            pass
+        if data is None:
+            with open(path, 'rb') as fh:
+                data = fh.read()
+        packed = encode(data)
+        if len(packed) >= len(data):
+            if os.path.exists(sibling):
+                os.remove(sibling)
+            continue
+        tmp = sibling + '.tmp'
+        with open(tmp, 'wb') as fh:
+            fh.write(packed)
+        # same mtime as the file it belongs to: that is how a fresh sibling is recognized
+        os.utime(tmp, ns=(st.st_atime_ns, st.st_mtime_ns))
+        os.replace(tmp, sibling)
+        sizes[ext[1:]] = len(packed)
+    return True, [], sizes
+
+
+def category_of(rel, sections):
+    """Section a bundle file belongs to (its pages, shard and images), or ``shared``."""
+    parts = rel.split('/')
+    if parts[0] == 'images' and len(parts) > 2:
+        return parts[1]
+    if rel.startswith('data/sections/'):
+        return os.path.splitext(parts[-1])[0]
+    m = SECTION_PAGE_RE.match(rel)
+    if m and m.group(1) in sections:
+        return m.group(1)
+    return 'shared'
+
+
+def size_report(bundle, out, compressed, sections):
+    """``{category: {files, bytes, transfer_bytes, images_bytes}}``; transfer counts the smallest encoding."""
+    report = {}
+    for rel in sorted(bundle):
+        size = os.path.getsize(os.path.join(out, rel))
+        row = report.setdefault(category_of(rel, sections),
+                                {'files': 0, 'bytes': 0, 'transfer_bytes': 0, 'images_bytes': 0})
+        row['files'] += 1
+        row['bytes'] += size
+        row['transfer_bytes'] += min([size] + list(compressed.get(rel, {}).values()))
+        if rel.startswith('images/'):
+            row['images_bytes'] += size
+    return report
+
+
+def print_report(report, previous):
+    print(f"{'category':16} {'files':>6} {'KiB':>10} {'transfer KiB':>13} {'images KiB':>11} {'change KiB':>11}")
+    for cat in sorted(report, key=lambda c: (c == 'shared', c)):
+        row = report[cat]
+        old = previous.get(cat, {}).get('transfer_bytes')
+        change = f'{(row["transfer_bytes"] - old) / 1024:+11.1f}' if old is not None else f"{'new':>11}"
+        print(f"{cat:16} {row['files']:6d} {row['bytes'] / 1024:10.1f} {row['transfer_bytes'] / 1024:13.1f} "
+              f"{row['images_bytes'] / 1024:11.1f} {change}")
+    for cat in sorted(set(previous) - set(report)):
+        print(f'{cat:16} gone (was {previous[cat]["transfer_bytes"] / 1024:.1f} KiB)')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--out', default=OUT, help=f'bundle directory (default {OUT})')
+    parser.add_argument('--report', default=REPORT_FILE, help=f'size report JSON (default {REPORT_FILE})')
+    parser.add_argument('-j', '--jobs', type=int, default=workers.default_jobs(),
+                        help='worker processes for compression (default: number of CPUs)')
+    args = parser.parse_args(argv)
+    out = os.path.abspath(args.out)
+    if out == SITE or out.startswith(SITE + os.sep) or SITE.startswith(out + os.sep):
+        parser.error('the bundle directory must be outside site/')
+
+    bundle, missing = collect()
+    for rel, referrer in sorted(missing.items()):
+        print(f'Missing: {rel} (referenced by {referrer})')
+
+    counts = {'unchanged': 0}
+    for rel in sorted(bundle):
+        src, dst = os.path.join(SITE, rel), os.path.join(out, rel)
+        if is_current(src, dst):
+            counts['unchanged'] += 1
+            continue
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        if os.path.lexists(dst):
+            os.unlink(dst)
+        how = link_file(src, dst)
+        counts[how] = counts.get(how, 0) + 1
+
+    targets = sorted(rel for rel in bundle if rel.endswith(COMPRESSIBLE)
+                     and os.path.getsize(os.path.join(out, rel)) >= MIN_COMPRESS)
+    keep = bundle | {rel + ext for rel in targets for ext in ('.gz', '.br')}
+
+    # whatever is left in the bundle from earlier runs and no longer referenced
+    removed = 0
+    for dirpath, dirnames, filenames in os.walk(out, topdown=False):
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            if os.path.relpath(path, out).replace('\\', '/') not in keep:
+                os.remove(path)
+                removed += 1
+        if dirpath != out and not os.listdir(dirpath):
+            os.rmdir(dirpath)
+
+    compressed = {}
+    paths = [os.path.join(out, rel) for rel in targets]
+    for path, (ok, lines, sizes) in workers.run_jobs(compress_file, paths, args.jobs):
+        compressed[os.path.relpath(path, out).replace('\\', '/')] = sizes
+    if brotli is None:
+        print('brotli module not installed: wrote .gz siblings only (pip install brotli for .br)')
+
+    try:
+        with open(os.path.join(SITE, 'data', 'index.json'), 'r', encoding='utf-8') as fh:
+            sections = set(json.load(fh).get('sections', {}))
+    except (OSError, ValueError):
+        sections = set()
+    report = size_report(bundle, out, compressed, sections)
+    try:
+        with open(args.report, 'r', encoding='utf-8') as fh:
+            previous = json.load(fh).get('categories', {})
+    except (OSError, ValueError):
+        previous = {}
+    print_report(report, previous)
+    os.makedirs(os.path.dirname(os.path.abspath(args.report)), exist_ok=True)
+    with open(args.report, 'w', encoding='utf-8') as fh:
+        json.dump({'categories': report}, fh, indent=2, sort_keys=True)
+
+    done = ', '.join(f'{n} {how}' for how, n in sorted(counts.items()))
+    print(f'Bundled {len(bundle)} files into {out} ({done}; {removed} removed; '
+          f'{len(targets)} precompressed); {len(missing)} missing references')
+    return 1 if missing else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
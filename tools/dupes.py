@@ -0,0 +1,137 @@
+"""Perceptual near-duplicate detection for the originals and their derivatives.
+
+Each image gets a 64-bit difference hash (dHash) computed from a tiny
+grayscale copy; JPEGs are draft-decoded at 1/8 scale first, so hashing costs a
+fraction of a full decode. Near-identical frames differ in only a few bits, and
+a BK-tree answers "everything within N bits of this hash" without comparing
+every pair.
+"""
+import os
+
+from PIL import Image
+
+import tracing
+
+HASH_SIZE = 8
+# Hamming distance (out of 64 bits) up to which two images count as the same frame
+DEFAULT_THRESHOLD = 6
+
+
+def dhash(img):
+    """64-bit difference hash: one bit per horizontally adjacent pixel pair of a 9x8 copy."""
+    small = img.convert('L').resize((HASH_SIZE + 1, HASH_SIZE), Image.BOX, reducing_gap=2.0)
+    px = small.tobytes()
+    bits = 0
+    for y in range(HASH_SIZE):
+        row = px[y * (HASH_SIZE + 1):(y + 1) * (HASH_SIZE + 1)]
+        for x in range(HASH_SIZE):
+            bits = (bits << 1) | (row[x] > row[x + 1])
+    return bits
+
+
+def dhash_file(path):
+    with tracing.span('dhash', file=path), Image.open(path) as img:
+        img.draft('L', (HASH_SIZE * 8, HASH_SIZE * 8))
+        return dhash(img)
+
+
+def distance(a, b):
+    return (a ^ b).bit_count()
+
+
+class HammingIndex:
+    """BK-tree over integer hashes; ``near(h, radius)`` visits only subtrees that can match."""
+
+    def __init__(self):
+        self.root = None
+
+    def add(self, key, h):
+        node = [h, [key], {}]  # hash, keys with exactly this hash, children by distance
+        if self.root is None:
+            self.root = node
+            return
+        current = self.root
+        while True:
+            d = distance(h, current[0])
+            if d == 0:
+                current[1].append(key)
+                return
+            child = current[2].get(d)
+            if child is None:
+                current[2][d] = node
+                return
+            current = child
+
+    def near(self, h, radius):
+        """``[(key, distance)]`` for every stored hash within ``radius`` bits of ``h``."""
+        found = []
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node_hash, keys, children = stack.pop()
+            d = distance(h, node_hash)
+            if d <= radius:
+                found.extend((key, d) for key in keys)
+            for child_d, child in children.items():
+                if d - radius <= child_d <= d + radius:
+                    stack.append(child)
+        return found
+
+
+def clusters(hashes, threshold=DEFAULT_THRESHOLD, preferred=()):
+    """Group ``{key: hash}`` into near-duplicate clusters (lists of 2+ keys, sorted).
+
+    Each cluster is built around the member :func:`representative` keeps, and
+    every other member is within ``threshold`` of it. Matching is not chained:
+    if A~B and B~C but A and C are further apart, C is not put with A just
+    because of B. Keys are taken as centres in the order ``representative``
+    prefers them, so the kept member of a cluster is always its centre.
+    """
+    index = HammingIndex()
+    for key, h in hashes.items():
+        index.add(key, h)
+    assigned = set()
+    groups = []
+    for key in sorted(hashes, key=lambda k: _priority(k, preferred)):
+        if key in assigned:
+            continue
+        members = [other for other, _ in index.near(hashes[key], threshold) if other not in assigned]
+        assigned.update(members)
+        if len(members) > 1:
+            groups.append(sorted(members))
+    return sorted(groups)
+
+
+def hash_files(paths, info):
+    """``{path: dhash}`` for ``paths``, through a ``catalog.FileInfoCache`` so unchanged files aren't decoded again."""
+    from catalog import CategoryIndex
+
+    indexes = {}
+    hashes = {}
+    for path in paths:
+        folder, fname = os.path.split(path)
+        if folder not in indexes:
+            indexes[folder] = CategoryIndex(folder)
+        h = info.dhash(indexes[folder], fname)
+        if h is not None:
+            hashes[path] = h
+    return hashes
+
+
+def _priority(key, preferred):
+    return (0, '', key) if key in preferred else (1, len(key), key)
+
+
+def representative(cluster, preferred=()):
+    """Member of ``cluster`` to keep: the first one in ``preferred``, else the shortest name
+    (``_MG_3976`` over its re-export ``_MG_3976-2``)."""
+    return min(cluster, key=lambda k: _priority(k, preferred))
+
+
+def report(groups, hashes, label=str):
+    """Print each cluster with the member that is kept and the distance of the others to it."""
+    for cluster in groups:
+        keep = representative(cluster)
+        print(f'  keep {label(keep)}')
+        for key in cluster:
+            if key != keep:
+                print(f'    ~ {label(key)} (distance {distance(hashes[key], hashes[keep])})')
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""Report near-duplicate originals before they are encoded.
+
+Every original under images/originals is hashed with a perceptual dHash (the
+hashes are cached in .cache/file-info.json by size/mtime, so reruns only hash
+new or edited files) and grouped into clusters of frames whose hashes differ
+in at most ``--threshold`` bits. For each cluster the member that
+``optimize-originals.py --skip-duplicates`` and ``generate-manifest.py --dedupe``
+keep is listed first.
+
+    python3 tools/find-duplicates.py [--threshold 6]
+"""
+import os
+import sys
+import glob
+import argparse
+
+import dupes
+import tracing
+from catalog import FileInfoCache
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+ORIGINALS_ROOT = os.path.join(ROOT, 'images', 'originals')
+FILE_INFO_FILE = os.path.join(ROOT, '.cache', 'file-info.json')
+
+EXTENSIONS = ('.jpg', '.jpeg', '.png', '.tiff', '.webp', '.heic')
+
+
+def find_originals():
+    files = []
+    for ext in EXTENSIONS:
+        files.extend(glob.glob(os.path.join(ORIGINALS_ROOT, '**', f'*{ext}'), recursive=True))
+    return sorted(files)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threshold', type=int, default=dupes.DEFAULT_THRESHOLD,
+                        help=f'max differing hash bits (of 64) for a near-duplicate (default {dupes.DEFAULT_THRESHOLD})')
+    tracing.add_arguments(parser)
+    args = parser.parse_args(argv)
+    tracing.from_args(args, 'find-duplicates')
+
+    files = find_originals()
+    info = FileInfoCache(FILE_INFO_FILE)
+    hashes = dupes.hash_files(files, info)
+    info.save()
+
+    groups = dupes.clusters(hashes, args.threshold)
+    redundant = sum(len(g) - 1 for g in groups)
+    print(f'Hashed {len(hashes)} of {len(files)} originals: {len(groups)} near-duplicate clusters, '
+          f'{redundant} redundant file(s)')
+    dupes.report(groups, hashes, label=lambda p: os.path.relpath(p, ORIGINALS_ROOT))
+    tracing.finish(args)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""Give derivatives, stylesheets and scripts content-hash fingerprinted names.
+
+Every image variant under images/<category> and every file in site/assets/css
+and site/assets/js gets a hardlinked sibling named
+``<name>.<hash>.<ext>`` (a copy where hardlinks aren't supported), and
+site/data/assets.json maps the stable path to it. Hashes are reused from the
+build cache while a file's size and mtime are unchanged, so unchanged files keep
+their fingerprinted names across builds and a no-op run only stats files.
+The copies are build outputs (git-ignored); older fingerprints of files that
+have changed since are listed, and removed with ``--prune`` (pages or caches
+may still point at them until then).
+
+Use the map with ``generate-manifest.py --fingerprint`` and
+``generate-sections.py --fingerprint``.
+
+    python3 tools/fingerprint-assets.py [--prune]
+"""
+import os
+import re
+import sys
+import glob
+import shutil
+import argparse
+
+import tracing
+from assetmap import MAP_FILE, SITE, AssetMap, fingerprinted_name, is_fingerprinted
+from buildcache import ROOT, BuildCache, replace_json, report_stale, report_superseded
+
+VARIANT_RE = re.compile(r'-(thumb|medium|full|\d+w|crop-(?:portrait|square)-\d+)\.(webp|jpg|avif)$')
+
+SETTINGS = 'fingerprint-v1'
+
+
+def find_assets():
+    """Stable site-relative paths of everything that gets a fingerprint."""
+    paths = []
+    for cat_dir in sorted(glob.glob(os.path.join(SITE, 'images', '*', ''))):
+        if os.path.basename(os.path.dirname(cat_dir)) == 'originals':
+            continue
+        for name in sorted(os.listdir(cat_dir)):
+            if VARIANT_RE.search(name):
+                paths.append(f'images/{os.path.basename(os.path.dirname(cat_dir))}/{name}')
+    for pattern in ('assets/css/*.css', 'assets/js/*.js'):
+        paths.extend(sorted(os.path.relpath(p, SITE).replace('\\', '/')
+                            for p in glob.glob(os.path.join(SITE, pattern))))
+    return [p for p in paths if not is_fingerprinted(p)]
+
+
+def link_or_copy(src, dst):
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--prune', action='store_true',
+                        help='delete fingerprinted copies of files that no longer exist or have changed since')
+    tracing.add_arguments(parser)
+    args = parser.parse_args(argv)
+    tracing.from_args(args, 'fingerprint-assets')
+
+    cache = BuildCache('fingerprint-assets')
+    assets = find_assets()
+    mapping = {}
+    created = 0
+    try:
+        for rel in assets:
+            src = os.path.join(SITE, rel)
+            if cache.is_fresh(src, SETTINGS):
+                mapping[rel] = fingerprinted_name(rel, cache.get(src)['hash'])
+                continue
+            with tracing.span(tracing.FILE_SPAN, file=src):
+                with tracing.span('hash', file=src, bytes_in=os.path.getsize(src)):
+                    digest, _ = cache.source_hash(src)
+                hashed_rel = fingerprinted_name(rel, digest)
+                hashed = os.path.join(SITE, hashed_rel)
+                if not os.path.exists(hashed):
+                    with tracing.span('link', file=hashed):
+                        link_or_copy(src, hashed)
+                    created += 1
+            cache.record(src, SETTINGS, [hashed])
+            mapping[rel] = hashed_rel
+        report_stale(cache, prune=args.prune)
+    finally:
+        cache.save()
+
+    # earlier fingerprints of files that have changed since
+    current = set(mapping.values())
+    folders = {os.path.dirname(rel) for rel in assets}
+    superseded = sorted(f'{folder}/{name}' for folder in folders for name in os.listdir(os.path.join(SITE, folder))
+                        if is_fingerprinted(name) and f'{folder}/{name}' not in current)
+    report_superseded([os.path.relpath(os.path.join(SITE, rel), ROOT) for rel in superseded], prune=args.prune)
+
+    try:
+        unchanged = AssetMap.load().mapping == mapping
+    except (OSError, ValueError):
+        unchanged = False
+    if not unchanged:
+        replace_json(MAP_FILE, mapping)
+    tracing.finish(args)
+    print(f'Fingerprinted {len(mapping)} assets ({created} new, {len(superseded)} superseded); '
+          f'map {"unchanged" if unchanged else "written to " + MAP_FILE}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
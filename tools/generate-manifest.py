@@ -1,12 +1,20 @@
 #!/usr/bin/env python3
 import os
 import json
+import argparse
 from pathlib import Path
 
+import dupes
+import tracing
+from assetmap import AssetMap
+from buildcache import replace_json, write_if_changed
+from catalog import CategoryIndex, FileInfoCache, css_position, parse_focus
+
 ROOT = Path(__file__).resolve().parents[1]
 IMAGES = ROOT / 'images'
 OUT = ROOT / 'site' / 'data'
-OUT.mkdir(parents=True, exist_ok=True)
+STATE_FILE = ROOT / '.cache' / 'manifest-state.json'
+FILE_INFO_FILE = ROOT / '.cache' / 'file-info.json'
 
 CATEGORIES = [
     'frack-county',
@@ -20,92 +28,122 @@ CATEGORIES = [
 
 EXTS = ('.webp', '.jpg', '.jpeg', '.png')
 
-def find_images(cat_dir):
-    files = list(cat_dir.glob('*'))
+# Item fields holding one path / a srcset list; shards store them relative to the section base
+PATH_KEYS = ('thumb_webp', 'thumb_jpg', 'full_webp', 'full_jpg', 'full_avif')
+SRCSET_KEYS = ('srcset_avif', 'srcset_webp', 'srcset_jpg')
+
+def find_images(cat_dir, index=None, info=None):
+    index = index or CategoryIndex(cat_dir)
+    info = info or FileInfoCache(FILE_INFO_FILE)
+
+    def rel(fname):
+        return str((cat_dir / fname).relative_to(ROOT)).replace('\\','/')
 
     # discover bases by thumbs
-    thumbs = [f for f in files if f.name.endswith('-thumb.webp') or f.name.endswith('-thumb.jpg')]
-    bases = set()
-    for t in thumbs:
-        base = t.name.rsplit('-thumb', 1)[0]
-        bases.add(base)
+    bases = index.bases()
 
     # detect explicit hero markers: files like <base>-hero.webp or a hero.txt file containing base name
-    hero_bases = set()
-    for f in files:
-        if '-hero.' in f.name:
-            base = f.name.rsplit('-hero', 1)[0]
-            hero_bases.add(base)
-    hero_txt = cat_dir / 'hero.txt'
-    if hero_txt.exists():
-        try:
-            txt = hero_txt.read_text().strip().splitlines()
-            for line in txt:
-                line = line.strip()
-                if line:
-                    hero_bases.add(line)
-        except Exception:
-            pass
+    hero_bases = index.hero_bases()
 
     items = []
     for b in sorted(bases):
-        # Available size files
+        # Available size files, with their real pixel sizes (the ladder never upscales,
+        # so a narrow original gives variants narrower than the nominal width)
         variants = []
         size_map = {
             'thumb': 600,
             'medium': 1200,
             'full': 1920,
         }
+        largest = None
         for name in ['thumb', 'medium', 'full']:
-            webp = cat_dir / f"{b}-{name}.webp"
-            jpg = cat_dir / f"{b}-{name}.jpg"
-            if webp.exists() or jpg.exists():
-                variants.append((name, size_map[name], webp if webp.exists() else None, jpg if jpg.exists() else None))
-
-        # Build srcsets
-        webp_srcs = []
-        jpg_srcs = []
-        for name, width, webp, jpg in variants:
+            webp = index.variant(b, name, 'webp')
+            jpg = index.variant(b, name, 'jpg')
+            if webp or jpg:
+                webp_size = info.size(index, webp) if webp else None
+                jpg_size = info.size(index, jpg) if jpg else None
+                size = webp_size or jpg_size
+                largest = size or largest
+                variants.append((name, webp, (webp_size or (size_map[name],))[0], jpg, (jpg_size or (size_map[name],))[0]))
+        # breakpoints of an adaptive ladder (optimizers run with --adaptive); the name is the real width
+        for width in index.widths(b):
+            name = f"{width}w"
+            webp = index.variant(b, name, 'webp')
+            jpg = index.variant(b, name, 'jpg')
+            if webp or jpg:
+                variants.append((name, webp, width, jpg, width))
+
+        # Build srcsets; when several variants share a width (small originals) keep the
+        # largest one, since it was encoded at the highest quality
+        webp_srcs = {}
+        jpg_srcs = {}
+        avif_srcs = {}
+        for name, webp, webp_width, jpg, jpg_width in variants:
             if webp:
-                webp_rel = str(webp.relative_to(ROOT)).replace('\\','/')
-                webp_srcs.append(f"{webp_rel} {width}w")
+                webp_srcs[webp_width] = rel(webp)
             if jpg:
-                jpg_rel = str(jpg.relative_to(ROOT)).replace('\\','/')
-                jpg_srcs.append(f"{jpg_rel} {width}w")
-
-        # Fallbacks
-        thumb_webp = (cat_dir / f"{b}-thumb.webp")
-        thumb_jpg = (cat_dir / f"{b}-thumb.jpg")
-        full_webp = (cat_dir / f"{b}-full.webp")
-        full_jpg = (cat_dir / f"{b}-full.jpg")
+                jpg_srcs[jpg_width] = rel(jpg)
+            # optional AVIF tier (optimizers run with --avif); same pixels as the WebP/JPG
+            avif = index.variant(b, name, 'avif')
+            if avif:
+                avif_srcs[webp_width if webp else jpg_width] = rel(avif)
 
         item = {
             'id': b,
-            'thumb_webp': str(thumb_webp.relative_to(ROOT)).replace('\\','/'),
-            'thumb_jpg': str(thumb_jpg.relative_to(ROOT)).replace('\\','/'),
-            'full_webp': str(full_webp.relative_to(ROOT)).replace('\\','/'),
-            'full_jpg': str(full_jpg.relative_to(ROOT)).replace('\\','/'),
-            'srcset_webp': ", ".join(webp_srcs),
-            'srcset_jpg': ", ".join(jpg_srcs),
+            'thumb_webp': rel(f"{b}-thumb.webp"),
+            'thumb_jpg': rel(f"{b}-thumb.jpg"),
+            'full_webp': rel(f"{b}-full.webp"),
+            'full_jpg': rel(f"{b}-full.jpg"),
+            'srcset_webp': ", ".join(f"{path} {width}w" for width, path in sorted(webp_srcs.items())),
+            'srcset_jpg': ", ".join(f"{path} {width}w" for width, path in sorted(jpg_srcs.items())),
             'sizes': "(max-width: 600px) 100vw, (max-width: 1200px) 50vw, 33vw",
             'alt': b.replace('-', ' '),
             'hero': True if b in hero_bases else False,
         }
+        if avif_srcs:
+            item['srcset_avif'] = ", ".join(f"{path} {width}w" for width, path in sorted(avif_srcs.items()))
+            full_avif = index.variant(b, 'full', 'avif')
+            if full_avif:
+                item['full_avif'] = rel(full_avif)
+        if largest:
+            item['width'], item['height'] = largest
+            item['aspect_ratio'] = round(largest[0] / largest[1], 4)
+        # tiny inline placeholder + dominant colour, painted before the thumbnail arrives
+        placeholder = index.placeholder(b)
+        if placeholder is None:
+            thumb = index.variant(b, 'thumb', 'jpg') or index.variant(b, 'thumb', 'webp')
+            placeholder = info.placeholder(index, thumb) if thumb else None
+        if placeholder:
+            # fixed key order, whether it came from -lqip.json or was computed here
+            for key in ('color', 'placeholder'):
+                if key in placeholder:
+                    item[key] = placeholder[key]
         # optional focal point via <base>-focus.txt containing either "left", "right", "top", "bottom" or "x y" as percentages
-        focus_file = cat_dir / f"{b}-focus.txt"
-        if focus_file.exists():
-            try:
-                txt = focus_file.read_text().strip()
-                if txt in ('left','right','top','bottom'):
-                    item['object_position'] = {'position': txt}
-                else:
-                    parts = txt.split()
-                    if len(parts) == 2:
-                        # expect numbers as percentages
-                        x, y = parts
-                        item['object_position'] = {'position': f"{x}% {y}%"}
-            except Exception:
-                pass
+        focus = index.focus_text(b)
+        if focus is not None:
+            position = css_position(focus)
+            if position:
+                item['object_position'] = {'position': position}
+            point = parse_focus(focus)
+            if point:
+                item['focus'] = list(point)
+        # art-directed hero crops from crop-heroes.py
+        crops = {}
+        for shape, by_ext in sorted(index.crops(b).items()):
+            crop = {}
+            for ext in ('webp', 'jpg'):
+                by_width = by_ext.get(ext, {})
+                if by_width:
+                    crop[f'srcset_{ext}'] = ", ".join(f"{rel(fname)} {width}w"
+                                                      for width, fname in sorted(by_width.items()))
+            widest = max(w for by_width in by_ext.values() for w in by_width)
+            fname = next(by_width[widest] for by_width in by_ext.values() if widest in by_width)
+            size = info.size(index, fname)
+            if size:
+                crop['width'], crop['height'] = size
+            crops[shape] = crop
+        if crops:
+            item['crops'] = crops
         items.append(item)
 
     # If no explicit hero was found, mark the first image as hero (for having a reasonable default)
@@ -115,14 +153,205 @@ def find_images(cat_dir):
     return items
 
 
-manifest = {}
-for cat in CATEGORIES:
-    cat_dir = IMAGES / cat
-    if cat_dir.exists() and cat_dir.is_dir():
-        manifest[cat] = find_images(cat_dir)
-    else:
-        manifest[cat] = []
+def drop_duplicates(items, index, info, threshold=dupes.DEFAULT_THRESHOLD):
+    """Keep one item per near-duplicate cluster (the hero when it is in one).
+
+    Hashes come from the thumbnails. Returns ``(kept_items, dropped_ids)``.
+    """
+    hashes = {}
+    for it in items:
+        thumb = index.variant(it['id'], 'thumb', 'jpg') or index.variant(it['id'], 'thumb', 'webp')
+        h = info.dhash(index, thumb) if thumb else None
+        if h is not None:
+            hashes[it['id']] = h
+    heroes = [it['id'] for it in items if it.get('hero')]
+    dropped = set()
+    for cluster in dupes.clusters(hashes, threshold, heroes):
+        keep = dupes.representative(cluster, heroes)
+        dropped.update(k for k in cluster if k != keep)
+    return [it for it in items if it['id'] not in dropped], sorted(dropped)
+
+
+def fingerprint(item, assets):
+    """Copy of ``item`` with its image paths replaced by their fingerprinted names."""
+    out = dict(item)
+    for k in PATH_KEYS:
+        if out.get(k):
+            out[k] = assets.url(out[k])
+    for k in SRCSET_KEYS:
+        if out.get(k):
+            out[k] = assets.srcset(out[k])
+    if out.get('crops'):
+        out['crops'] = {shape: {k: assets.srcset(v) if k.startswith('srcset_') else v for k, v in crop.items()}
+                        for shape, crop in out['crops'].items()}
+    return out
+
+
+def compact_section(cat, items):
+    """Shard for one category: paths relative to a shared ``base``, listed in ``path_keys``/``srcset_keys``.
+
+    A key is only made relative when every item's value lives under the base, so
+    ``manifest.js`` can expand the listed keys blindly.
+    """
+    base = f"{IMAGES.relative_to(ROOT).as_posix()}/{cat}/"
+
+    def under_base(value, srcset):
+        parts = value.split(', ') if srcset else [value]
+        return all(p.startswith(base) for p in parts if p)
+
+    def shared(k, srcset):
+        return any(it.get(k) for it in items) and all(under_base(it.get(k, ''), srcset) for it in items)
+
+    path_keys = [k for k in PATH_KEYS if shared(k, False)]
+    srcset_keys = [k for k in SRCSET_KEYS if shared(k, True)]
+
+    def strip(item):
+        out = dict(item)
+        for k in path_keys:
+            if out.get(k):
+                out[k] = out[k][len(base):]
+        for k in srcset_keys:
+            if out.get(k):
+                out[k] = ', '.join(p[len(base):] for p in out[k].split(', '))
+        return out
+
+    return {'base': base, 'path_keys': path_keys, 'srcset_keys': srcset_keys, 'items': [strip(it) for it in items]}
+
+
+def section_index(shards):
+    """Small index for the home page: item count and cover (hero) per category."""
+    sections = {}
+    for cat, shard in shards.items():
+        items = shard['items']
+        cover = next((it for it in items if it.get('hero')), items[0] if items else None)
+        sections[cat] = {k: shard[k] for k in ('base', 'path_keys', 'srcset_keys')}
+        sections[cat].update({'count': len(items), 'cover': cover})
+    return {'sections': sections}
+
+
+def compact_json(data):
+    return json.dumps(data, separators=(',', ':'))
+
+
+def write_output(path, text):
+    """Atomically write one manifest file unless it already holds ``text``; returns True if written."""
+    with tracing.span('write', file=str(path), bytes_out=len(text)):
+        return write_if_changed(path, text)
+
+
+def load_json(path, default):
+    try:
+        return json.loads(Path(path).read_text())
+    except (OSError, ValueError):
+        return default
+
+
+def category_state(index):
+    """What incremental mode compares: the folder mtime plus the mtimes of hero/focus files.
+
+    Editing a file in place does not touch its folder's mtime, so the few text
+    files whose contents feed the manifest are tracked individually.
+    """
+    control = {}
+    for name in index.control_files():
+        try:
+            control[name] = os.stat(index.path(name)).st_mtime_ns
+        except OSError:
+            pass
+    return {'dir_mtime_ns': index.mtime_ns, 'control': control}
+
+
+def is_unchanged(cat_dir, state):
+    """True when neither the folder nor any tracked hero/focus file changed since ``state``."""
+    if not state:
+        return False
+    try:
+        if os.stat(cat_dir).st_mtime_ns != state['dir_mtime_ns']:
+            return False
+        for name, mtime_ns in state['control'].items():
+            if os.stat(cat_dir / name).st_mtime_ns != mtime_ns:
+                return False
+    except (OSError, KeyError):
+        return False
+    return True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Write site/data/sections.json from the images/<category> folders')
+    parser.add_argument('--incremental', action='store_true',
+                        help='only rescan categories whose folder (or hero/focus files) changed since the last run')
+    parser.add_argument('--no-shards', dest='shards', action='store_false',
+                        help='only write the combined sections.json, not the compact per-section '
+                             'data/sections/<category>.json shards and data/index.json that the pages load')
+    parser.add_argument('--dedupe', nargs='?', type=int, const=dupes.DEFAULT_THRESHOLD, default=0, metavar='BITS',
+                        help='keep only one image per near-duplicate cluster in each category '
+                             f'(hashes differing in at most BITS bits, default {dupes.DEFAULT_THRESHOLD})')
+    parser.add_argument('--fingerprint', action='store_true',
+                        help='point at the content-hashed file names from tools/fingerprint-assets.py '
+                             '(site/data/assets.json)')
+    tracing.add_arguments(parser)
+    args = parser.parse_args(argv)
+    tracing.from_args(args, 'generate-manifest')
+
+    assets = None
+    if args.fingerprint:
+        try:
+            assets = AssetMap.load()
+        except (OSError, ValueError):
+            parser.error('no asset map found; run tools/fingerprint-assets.py first')
+    # options that change a category's items; a category is rescanned when they differ
+    options = {'dedupe': args.dedupe, 'assets': assets.digest if assets else None}
+
+    OUT.mkdir(parents=True, exist_ok=True)
+    out_file = OUT / 'sections.json'
+
+    previous = load_json(out_file, {}) if args.incremental else {}
+    old_state = load_json(STATE_FILE, {}) if args.incremental else {}
+    state = {}
+    info = FileInfoCache(FILE_INFO_FILE)
+
+    manifest = {}
+    rescanned = []
+    for cat in CATEGORIES:
+        cat_dir = IMAGES / cat
+        old = old_state.get(cat)
+        if (cat in previous and is_unchanged(cat_dir, old)
+                and all(old.get(k) == v for k, v in options.items())):
+            manifest[cat] = previous[cat]
+            state[cat] = old
+        elif cat_dir.exists() and cat_dir.is_dir():
+            with tracing.span(tracing.FILE_SPAN, file=str(cat_dir)):
+                with tracing.span('scan', file=str(cat_dir)) as span:
+                    index = CategoryIndex(cat_dir)
+                    manifest[cat] = find_images(cat_dir, index, info)
+                    span['items'] = len(manifest[cat])
+                if args.dedupe:
+                    with tracing.span('dedupe', file=str(cat_dir)):
+                        manifest[cat], dropped = drop_duplicates(manifest[cat], index, info, args.dedupe)
+                    if dropped:
+                        print(f"Dropped {len(dropped)} near-duplicates from {cat}: {', '.join(dropped)}")
+                if assets:
+                    manifest[cat] = [fingerprint(it, assets) for it in manifest[cat]]
+            state[cat] = dict(category_state(index), **options)
+            rescanned.append(cat)
+        else:
+            manifest[cat] = []
+
+    info.save()
+
+    write_output(out_file, json.dumps(manifest, indent=2))
+    if args.shards:
+        shards = {cat: compact_section(cat, items) for cat, items in manifest.items()}
+        for cat, shard in shards.items():
+            write_output(OUT / 'sections' / f'{cat}.json', compact_json(shard))
+        write_output(OUT / 'index.json', compact_json(section_index(shards)))
+        print(f'Wrote {len(shards)} section shards to {OUT / "sections"} and {OUT / "index.json"}')
+    replace_json(STATE_FILE, state)
+    if args.incremental:
+        print(f"Rescanned {len(rescanned)} of {len(CATEGORIES)} categories: {', '.join(rescanned) or 'none'}")
+    tracing.finish(args)
+    print(f'Wrote manifest to {out_file}')
+
 
-out_file = OUT / 'sections.json'
-out_file.write_text(json.dumps(manifest, indent=2))
-print(f'Wrote manifest to {out_file}')
+if __name__ == '__main__':
+    main()
@@ -2,13 +2,48 @@
 """Generate per-section static HTML pages from site/data/sections.json
 
 Creates site/<category>.html for each category found in the manifest.
+The page template is compiled once per run (navigation, relative links and
+asset names baked in) and each page is rendered from it in a single pass.
+A page is only rendered again when its section's manifest slice or the
+template changed, and only written when its bytes differ.
 """
+import re
 import json
+import hashlib
+import argparse
 from pathlib import Path
 import html
 
+import tracing
+from assetmap import AssetMap
+from buildcache import replace_json, write_if_changed
+
 ROOT = Path(__file__).resolve().parents[1] / 'site'
 DATA = ROOT / 'data' / 'sections.json'
+STYLESHEET = ROOT / 'assets' / 'css' / 'styles.css'
+STATE_FILE = ROOT.parent / '.cache' / 'sections-pages.json'
+
+# Stylesheet/scripts referenced by TEMPLATE, rewritten to fingerprinted names with --fingerprint
+ASSETS = (
+  'assets/css/styles.css',
+  'assets/js/manifest.js',
+  'assets/js/lightbox.js',
+  'assets/js/main.js',
+)
+
+# Hand-written pages whose stylesheet/script links follow --fingerprint like the generated ones
+STATIC_PAGES = ('index.html', 'about.html', 'contact.html')
+ASSET_LINK_RE = re.compile(r'"(assets/(?:css|js)/[\w-]+)(?:\.[0-9a-f]{10})?\.(css|js)"')
+
+# Rules of the stylesheet that the header and hero need for the first paint; they
+# are inlined into each page's <head> and the full stylesheet loads without blocking
+CRITICAL_RE = re.compile(r'(:root|\*|html|body|main|h1|h2|a|\.container|\.site-header|\.header-inner'
+                         r'|\.brand|\.main-nav|\.menu-toggle|\.site-sidebar|\.hero[\w-]*)(?![\w-])')
+
+# The hero spans the viewport width
+HERO_SIZES = '100vw'
+# Art-directed crops from crop-heroes.py and the widest screen (px) each one is for, narrowest first
+HERO_CROP_MEDIA = (('portrait', 600), ('square', 900))
 
 NAV_LINKS = [
   ('frack-county', 'Frack County'),
@@ -26,7 +61,9 @@ TEMPLATE = """<!doctype html>
   <meta charset="utf-8" />
   <meta name="viewport" content="width=device-width,initial-scale=1" />
   <title>{title} — Karl Dukstein</title>
-  <link rel="stylesheet" href="assets/css/styles.css">
+  <style>{critical_css}</style>
+  <link rel="preload" href="assets/css/styles.css" as="style" onload="this.onload=null;this.rel='stylesheet'">
+  <noscript><link rel="stylesheet" href="assets/css/styles.css"></noscript>{head_html}
 </head>
 <body>
   <header class="site-header">
@@ -47,6 +84,7 @@ TEMPLATE = """<!doctype html>
       <div class="brand"><a href="/">KARL DUKSTEIN</a></div>
       <nav class="main-nav">
         <ul class="nav-list">
+{nav_links}
         </ul>
       </nav>
     </div>
@@ -61,8 +99,8 @@ TEMPLATE = """<!doctype html>
     <div class="container">
       <section class="section">
         <h2>{title}</h2>
-        <div class="grid" data-section="{key}"></div>
-        <nav class="pagination" aria-label="Pagination"></nav>
+        {grid_html}
+        {pagination_html}
       </section>
     </div>
   </main>
@@ -81,6 +119,7 @@ TEMPLATE = """<!doctype html>
     <button class="lb-next" aria-label="Next">▶</button>
   </div>
 
+  <script src="assets/js/manifest.js" defer></script>
   <script src="assets/js/lightbox.js" defer></script>
   <script src="assets/js/main.js" defer></script>
 </body>
@@ -95,37 +134,151 @@ def make_nav_links():
     return "\n".join(out)
 
 
+def dimension_attrs(item):
+    """` width=".." height=".."` from the manifest's intrinsic size, so the browser can reserve space."""
+    if item.get('width') and item.get('height'):
+        return f' width="{int(item["width"])}" height="{int(item["height"])}"'
+    return ''
+
+
+def placeholder_style(item):
+    """Inline background with the dominant colour and blurred placeholder, painted before the image loads."""
+    layers = []
+    if item.get('placeholder'):
+        layers.append(f"url({item['placeholder']}) center/cover no-repeat")
+    if item.get('color'):
+        layers.append(item['color'])
+    return f"background:{' '.join(layers)}" if layers else ''
+
+
+def style_attr(styles):
+    styles = [st for st in styles if st]
+    return f' style="{html.escape(";".join(styles))}"' if styles else ''
+
+
+def hero_item(items):
+    return next((it for it in items if it.get('hero')), items[0]) if items else None
+
+
+def hero_sources(hero):
+    """``[(mime_type, srcset)]`` for the hero, best format first; falls back to the single full-size file."""
+    sources = []
+    for ext, mime in (('avif', 'image/avif'), ('webp', 'image/webp'), ('jpg', 'image/jpeg')):
+        srcset = hero.get(f'srcset_{ext}') or hero.get(f'full_{ext}')
+        if srcset:
+            sources.append((mime, srcset))
+    return sources
+
+
+def hero_crops(hero):
+    """``[(max_width, [(mime_type, srcset)])]`` for the hero's crops, narrowest screens first."""
+    crops = hero.get('crops') or {}
+    out = []
+    for shape, max_width in HERO_CROP_MEDIA:
+        crop = crops.get(shape) or {}
+        sources = [(mime, crop[f'srcset_{ext}']) for ext, mime in (('webp', 'image/webp'), ('jpg', 'image/jpeg'))
+                   if crop.get(f'srcset_{ext}')]
+        if sources:
+            out.append((max_width, sources))
+    return out
+
+
 def pick_hero(items):
-    # return HTML for hero picture if available
-    if not items:
-        return ''
-    hero = next((it for it in items if it.get('hero')), items[0])
+    """HTML for the section's hero picture: the LCP element, so it is responsive and fetched eagerly."""
+    hero = hero_item(items)
     if not hero:
         return ''
-    # prefer webp source if present, wrap in picture with hero-img class and centerable object-position
+    src = hero.get('full_jpg') or hero.get('full_webp')
+    sources = hero_sources(hero)
+    if not src or not sources:
+        return ''
     out = '<picture class="hero-pic">\n'
-    if hero.get('full_webp'):
-        out += f'  <source srcset="{html.escape(hero["full_webp"])}" type="image/webp">\n'
-    if hero.get('full_jpg'):
-        op = ''
-        if hero.get('object_position') and hero['object_position'].get('position'):
-            op = f' style="object-position:{html.escape(hero["object_position"]["position"])}"'
-        out += f'  <img class="hero-img" src="{html.escape(hero["full_jpg"])}" alt="{html.escape(hero.get("alt",""))}" loading="lazy"{op}>'
-    elif hero.get('full_webp'):
-        op = ''
-        if hero.get('object_position') and hero['object_position'].get('position'):
-            op = f' style="object-position:{html.escape(hero["object_position"]["position"])}"'
-        out += f'  <img class="hero-img" src="{html.escape(hero["full_webp"])}" alt="{html.escape(hero.get("alt",""))}" loading="lazy"{op}>'
+    # the first matching <source> wins, so the crops for narrow screens come first
+    for max_width, crop_sources in hero_crops(hero):
+        for mime, srcset in crop_sources:
+            out += (f'  <source media="(max-width: {max_width}px)" type="{mime}" '
+                    f'srcset="{html.escape(srcset)}" sizes="{HERO_SIZES}">\n')
+    # every format but the <img> fallback gets a <source>; the fallback srcset goes on the <img>
+    for mime, srcset in sources[:-1]:
+        out += f'  <source type="{mime}" srcset="{html.escape(srcset)}" sizes="{HERO_SIZES}">\n'
+    styles = [placeholder_style(hero)]
+    if hero.get('object_position') and hero['object_position'].get('position'):
+        styles.append(f'object-position:{hero["object_position"]["position"]}')
+    out += (f'  <img class="hero-img" src="{html.escape(src)}" srcset="{html.escape(sources[-1][1])}" '
+            f'sizes="{HERO_SIZES}" alt="{html.escape(hero.get("alt",""))}"{dimension_attrs(hero)} '
+            f'loading="eager" decoding="sync" fetchpriority="high"{style_attr(styles)}>')
     out += '\n</picture>'
     return out
 
 
-def render_grid(items, key):
+def hero_preload(items):
+    """``<link rel="preload">`` for the hero in its preferred format.
+
+    The ``type`` makes browsers without that format skip the preload instead of
+    fetching a file the ``<picture>`` will not use. With crops there is one
+    preload per crop, scoped by non-overlapping ``media`` queries so each screen
+    preloads only the picture it will show.
+    """
+    hero = hero_item(items)
+    sources = hero_sources(hero) if hero else []
+    if not sources:
+        return ''
+    out = ''
+    lower = 0
+    for max_width, crop_sources in hero_crops(hero):
+        media = f'(min-width: {lower + 1}px) and (max-width: {max_width}px)' if lower else f'(max-width: {max_width}px)'
+        out += _preload_link(*crop_sources[0], media)
+        lower = max_width
+    return out + _preload_link(*sources[0], f'(min-width: {lower + 1}px)' if lower else None)
+
+
+def _preload_link(mime, srcset, media=None):
+    media_attr = f' media="{media}"' if media else ''
+    return (f'\n  <link rel="preload" as="image" type="{mime}"{media_attr} imagesrcset="{html.escape(srcset)}" '
+            f'imagesizes="{HERO_SIZES}" fetchpriority="high">')
+
+
+def _css_blocks(css):
+    """Yield ``(prelude, body)`` for each top-level ``{...}`` block of ``css``."""
+    i = 0
+    while True:
+        start = css.find('{', i)
+        if start < 0:
+            return
+        depth, j = 1, start + 1
+        while depth and j < len(css):
+            depth += {'{': 1, '}': -1}.get(css[j], 0)
+            j += 1
+        # drop statements such as @import that end before the block
+        prelude = css[i:start].rsplit(';', 1)[-1]
+        yield ' '.join(prelude.split()), css[start + 1:j - 1]
+        i = j
+
+
+def _minify(declarations):
+    return re.sub(r'\s*([:;,])\s*', r'\1', ' '.join(declarations.split())).strip()
+
+
+def critical_css(css):
+    """The rules of ``css`` matching CRITICAL_RE (inside @media too), minified."""
+    out = []
+    for prelude, body in _css_blocks(re.sub(r'/\*.*?\*/', '', css, flags=re.S)):
+        if prelude.startswith('@media'):
+            inner = critical_css(body)
+            if inner:
+                out.append(f'{prelude}{{{inner}}}')
+        elif not prelude.startswith('@') and any(CRITICAL_RE.match(sel.strip()) for sel in prelude.split(',')):
+            out.append(f'{prelude}{{{_minify(body)}}}')
+    return ''.join(out)
+
+
+def render_grid(items, key, start=0):
     """Return HTML for a fully-rendered grid of items for inclusion in the section page.
 
     This produces the same structure `main.js` expects (div.item.fade-in with a <picture> and <img>),
     so the lightbox and other client-side behaviors still work. Generating the grid at build-time
     ensures pages show images even when opened via file:// or when the manifest can't be fetched.
+    ``start`` is the index of the first item within the whole section (for paginated pages).
     """
     if not items:
         return '<div class="grid" data-section="{k}"><p class="empty">No images found for this section.</p></div>'.format(k=html.escape(key))
@@ -134,19 +287,23 @@ def render_grid(items, key):
     for idx, it in enumerate(items):
         sizes = html.escape(it.get('sizes', '(max-width: 600px) 100vw, (max-width: 1200px) 50vw, 33vw'))
         # build picture element
-        pic = ['    <div class="item fade-in">', '      <picture>']
+        pic = [f'    <div class="item fade-in"{style_attr([placeholder_style(it)])}>', '      <picture>']
+        if it.get('srcset_avif'):
+            pic.append(f'        <source type="image/avif" srcset="{html.escape(it["srcset_avif"])}" sizes="{sizes}">')
         if it.get('srcset_webp'):
             pic.append(f'        <source type="image/webp" srcset="{html.escape(it["srcset_webp"])}" sizes="{sizes}">')
         img_attrs = {
             'data-full-webp': it.get('full_webp',''),
             'data-full-jpg': it.get('full_jpg',''),
-            'data-id': f"{key}-{idx}",
+            'data-id': f"{key}-{start + idx}",
             'data-base': it.get('id',''),
             'data-section': key,
             'srcset': it.get('srcset_jpg',''),
             'sizes': sizes,
             'src': it.get('thumb_jpg', it.get('thumb_webp', it.get('full_jpg', it.get('full_webp','')))),
             'alt': it.get('alt',''),
+            'width': str(it['width']) if it.get('width') else None,
+            'height': str(it['height']) if it.get('height') else None,
         }
         attrs = ' '.join([f'{k}="{html.escape(v)}"' for k, v in img_attrs.items() if v is not None])
         pic.append(f'        <img loading="lazy" {attrs}>')
@@ -157,39 +314,173 @@ def render_grid(items, key):
     return '\n'.join(out)
 
 
-def main():
+def page_name(key, page):
+    """File name of ``page`` (1-based) of a section: ``dnc.html``, ``dnc-2.html``, ..."""
+    return f"{key}.html" if page == 1 else f"{key}-{page}.html"
+
+
+def paginate(items, page_size):
+    """Split a section's items into pages; always at least one (possibly empty) page."""
+    if not page_size or len(items) <= page_size:
+        return [items]
+    return [items[i:i + page_size] for i in range(0, len(items), page_size)]
+
+
+def render_pagination(key, page, count):
+    """The ``<nav class="pagination">`` for ``page`` of ``count``; empty for a single page."""
+    if count == 1:
+        return '<nav class="pagination" aria-label="Pagination"></nav>'
+    out = ['<nav class="pagination" aria-label="Pagination">']
+    if page > 1:
+        out.append(f'          <a class="page-prev" href="{page_name(key, page - 1)}" rel="prev">&larr; Previous</a>')
+    out.append(f'          <span class="page-info">Page {page} of {count}</span>')
+    if page < count:
+        out.append(f'          <a class="page-next" href="{page_name(key, page + 1)}" rel="next">Next &rarr;</a>')
+    out.append('        </nav>')
+    return '\n'.join(out)
+
+
+def prefetch_links(key, page, next_items):
+    """``<link rel="prefetch">`` tags for the next page and its thumbnails, so paging feels instant."""
+    if not next_items:
+        return ''
+    links = [f'\n  <link rel="prefetch" href="{page_name(key, page + 1)}">']
+    for it in next_items:
+        thumb = it.get('thumb_webp') or it.get('thumb_jpg')
+        if thumb:
+            links.append(f'\n  <link rel="prefetch" href="{html.escape(thumb)}" as="image">')
+    return ''.join(links)
+
+
+# Fields of a compiled template: every ``{name}`` left after compile_template
+FIELD_RE = re.compile(r'\{(\w+)\}')
+
+
+def relative_links(text):
+    """Point the absolute nav and brand links at sibling pages, so pages work from file:// or a subpath."""
+    for page in [key for key, _ in NAV_LINKS] + ['about', 'contact']:
+        text = text.replace(f'href="/{page}.html"', f'href="{page}.html"')
+    return text.replace('href="/"', 'href="index.html"')
+
+
+def link_assets(text, assets):
+    """Point a page's stylesheet/script links at their names in ``assets`` (the stable names without a map)."""
+    return ASSET_LINK_RE.sub(lambda m: f'"{assets.url(f"{m.group(1)}.{m.group(2)}")}"', text)
+
+
+def compile_template(assets):
+    """Split TEMPLATE into alternating literal text and field names, with the
+    per-run constants (nav links, relative links, asset names, critical CSS) already applied."""
+    text = TEMPLATE.replace('{nav_links}', make_nav_links())
+    text = relative_links(text)
+    for asset in ASSETS:
+        text = text.replace(f'"{asset}"', f'"{assets.url(asset)}"')
+    constants = {'critical_css': critical_css(STYLESHEET.read_text(encoding='utf-8'))}
+    # fold constant fields into the surrounding literal text (after splitting, so CSS braces are safe)
+    compiled = ['']
+    for i, part in enumerate(FIELD_RE.split(text)):
+        if i % 2 and part not in constants:
+            compiled += [part, '']
+        else:
+            compiled[-1] += constants[part] if i % 2 else part
+    return compiled
+
+
+def render_page(compiled, fields):
+    return ''.join(fields[part] if i % 2 else part for i, part in enumerate(compiled))
+
+
+def page_digest(page_inputs, compiled):
+    """Everything a page depends on: its manifest slice (and position), the compiled template and this generator."""
+    h = hashlib.sha256()
+    h.update(json.dumps(page_inputs, sort_keys=True).encode('utf-8'))
+    h.update('\0'.join(compiled).encode('utf-8'))
+    h.update(Path(__file__).read_bytes())
+    return h.hexdigest()
+
+
+def load_state():
+    try:
+        return json.loads(STATE_FILE.read_text())
+    except (OSError, ValueError):
+        return {}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Write site/<category>.html for every section in site/data/sections.json')
+    parser.add_argument('--fingerprint', action='store_true',
+                        help='link the stylesheet and scripts by their content-hashed names from '
+                             'tools/fingerprint-assets.py (build the manifest with --fingerprint too)')
+    parser.add_argument('--force', action='store_true', help='render every page even if its inputs are unchanged')
+    parser.add_argument('--page-size', type=int, default=0, metavar='N',
+                        help='split sections into pages of N images (dnc.html, dnc-2.html, ...); 0 keeps one page')
+    tracing.add_arguments(parser)
+    args = parser.parse_args(argv)
+    tracing.from_args(args, 'generate-sections')
+    assets = AssetMap()
+    if args.fingerprint:
+        try:
+            assets = AssetMap.load()
+        except (OSError, ValueError):
+            parser.error('no asset map found; run tools/fingerprint-assets.py first')
+
     with open(DATA, 'r', encoding='utf-8') as f:
         data = json.load(f)
 
-    nav_links = make_nav_links()
+    compiled = compile_template(assets)
+    old_state = {} if args.force else load_state()
+    state = {}
+    written = unchanged = 0
 
     for key in data.keys():
+        items = data.get(key, [])
         # use label from NAV_LINKS mapping if present, otherwise friendly title
         label = dict(NAV_LINKS).get(key, key.replace('-', ' ').title())
-        hero_html = pick_hero(data.get(key, []))
-        grid_html = render_grid(data.get(key, []), key)
-        out = TEMPLATE.format(title=html.escape(label), hero_html=hero_html or '', key=html.escape(key), nav_links=nav_links)
-        # Replace the empty grid placeholder with the pre-rendered HTML
-        out = out.replace(f'<div class="grid" data-section="{html.escape(key)}"></div>', grid_html)
-        # Ensure nav_links are inserted into the aside nav (formatting could leave an empty list if spacing differs)
-        if 'class="nav-list">\n        </ul>' in out and nav_links:
-            out = out.replace('class="nav-list">\n        </ul>', f'class="nav-list">\n{nav_links}\n        </ul>')
-        # Convert absolute links in nav to relative to make pages work when opened from file:// or subpaths
-        out = out.replace('href="/frack-county.html"', 'href="frack-county.html"')
-        out = out.replace('href="/dnc.html"', 'href="dnc.html"')
-        out = out.replace('href="/weld-county.html"', 'href="weld-county.html"')
-        out = out.replace('href="/patriotism.html"', 'href="patriotism.html"')
-        out = out.replace('href="/portraits.html"', 'href="portraits.html"')
-        out = out.replace('href="/misc.html"', 'href="misc.html"')
-        out = out.replace('href="/student-work.html"', 'href="student-work.html"')
-        out = out.replace('href="/contact.html"', 'href="contact.html"')
-        out = out.replace('href="/about.html"', 'href="about.html"')
-        # Make brand links relative as well
-        out = out.replace('href="/"', 'href="index.html"')
-        path = ROOT / f"{key}.html"
-        with open(path, 'w', encoding='utf-8') as fh:
-            fh.write(out)
-        print('Wrote', path)
+        pages = paginate(items, args.page_size)
+        for number, page_items in enumerate(pages, 1):
+            name = page_name(key, number)
+            path = ROOT / name
+            start = (number - 1) * args.page_size
+            next_items = pages[number] if number < len(pages) else []
+            # every page shows the section's hero and prefetches the next page, so it depends on the whole slice
+            digest = page_digest([items, number, args.page_size], compiled)
+            state[name] = digest
+            if old_state.get(name) == digest and path.exists():
+                unchanged += 1
+                continue
+            with tracing.span(tracing.FILE_SPAN, file=str(path)):
+                with tracing.span('render', file=str(path), items=len(page_items)):
+                    out = render_page(compiled, {
+                        'title': html.escape(label),
+                        'head_html': hero_preload(items) + prefetch_links(key, number, next_items),
+                        'hero_html': pick_hero(items) or '',
+                        'grid_html': render_grid(page_items, key, start),
+                        'pagination_html': render_pagination(key, number, len(pages)),
+                    })
+                with tracing.span('write', file=str(path), bytes_out=len(out)):
+                    changed = write_if_changed(path, out)
+            if changed:
+                written += 1
+                print('Wrote', path)
+            else:
+                unchanged += 1
+
+    for name in STATIC_PAGES:
+        path = ROOT / name
+        if path.exists() and write_if_changed(path, link_assets(path.read_text(encoding='utf-8'), assets)):
+            written += 1
+            print('Updated asset links in', path)
+
+    # extra pages a previous run generated beyond the current page count
+    for name in sorted(set(load_state()) - set(state)):
+        path = ROOT / name
+        if re.search(r'-\d+\.html$', name) and path.exists():
+            path.unlink()
+            print('Removed', path)
+
+    replace_json(STATE_FILE, state)
+    tracing.finish(args)
+    print(f'{written} page(s) written, {unchanged} unchanged')
 
 
 if __name__ == '__main__':
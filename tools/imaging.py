@@ -0,0 +1,637 @@
+"""Shared decode/resize/encode engine for the image pipeline scripts.
+
+Each source is decoded once. JPEGs are decoded with ``Image.draft`` at the
+smallest DCT scale that is still at least as large as the biggest variant, and
+multi-resolution TIFFs are read from the smallest pyramid level that still
+covers it. Other formats are box-reduced by an integer factor before the final
+LANCZOS pass (``reducing_gap``). The ladder is then built top-down: full is
+resized from the decoded source, medium from full, thumb from medium, and the
+decoded source is released as soon as the first variant exists.
+
+Before resizing, every source is normalized once: the EXIF orientation is
+applied, an embedded non-sRGB ICC profile is converted to sRGB and the camera
+metadata is dropped, so variants carry no EXIF/XMP/ICC beyond an allow-list.
+
+With an adaptive ladder the widths are chosen per image from the decoded
+source first (see ``breakpoints``), by how many bytes each step adds.
+"""
+import os
+import json
+import base64
+import functools
+from io import BytesIO
+from PIL import ExifTags, Image, ImageOps
+
+import tracing
+import workers
+from buildcache import encoder_version, replace_file, report_superseded, settings_key
+
+# Bump when the resize/encode logic changes so build caches are invalidated.
+ENGINE_VERSION = 4
+
+# Keep LANCZOS for the final pass but let Pillow box-reduce first while the
+# source is at least this many times larger than the target.
+REDUCING_GAP = 3.0
+
+# Low-quality image placeholder: a tiny WebP inlined as a data URI
+PLACEHOLDER_WIDTH = 16
+PLACEHOLDER_QUALITY = 40
+
+# AVIF quality search: the lowest quality on this grid whose decoded result
+# still scores at least the target SSIM against the resized variant
+AVIF_QUALITIES = tuple(range(30, 95, 5))
+AVIF_SSIM = 0.97
+AVIF_SPEED = 8
+SSIM_WINDOW = 8
+
+# Adaptive breakpoints: per-image widths between ADAPTIVE_MIN_WIDTH and
+# ADAPTIVE_MAX_WIDTH, spaced so consecutive WebP variants differ by about
+# ADAPTIVE_STEP bytes. The byte curve is measured at ADAPTIVE_SAMPLES widths.
+ADAPTIVE_STEP = 20 * 1024
+ADAPTIVE_MIN_WIDTH = 320
+ADAPTIVE_MAX_WIDTH = 2560
+ADAPTIVE_SAMPLES = 8
+ADAPTIVE_MAX_WIDTHS = 10
+ADAPTIVE_ROUND = 10
+
+# Source metadata that variants never carry (the pixels are converted to sRGB,
+# which browsers assume without a profile)
+METADATA_KEYS = ('exif', 'xmp', 'icc_profile')
+# What normalize() can change about a source, as reported at the end of a run
+NORMALIZATIONS = {'rotated': 'rotated upright', 'srgb': 'converted to sRGB',
+                  'metadata': 'stripped of EXIF/XMP/ICC'}
+# EXIF orientations that swap width and height
+TRANSPOSED_ORIENTATIONS = (5, 6, 7, 8)
+# Modes LittleCMS can convert to sRGB
+ICC_MODES = ('RGB', 'RGBA', 'CMYK', 'L')
+
+BYTES_PER_PIXEL = {
+    '1': 1, 'L': 1, 'P': 1, 'LA': 2, 'PA': 2, 'RGB': 3, 'YCbCr': 3, 'LAB': 3, 'HSV': 3,
+    'RGBA': 4, 'RGBa': 4, 'CMYK': 4, 'I': 4, 'F': 4, 'I;16': 2, 'I;16B': 2, 'I;16L': 2,
+}
+
+
+def target_size(original_size, width):
+    """Size of a variant ``width`` pixels wide, never upscaling the original."""
+    original_width, original_height = original_size
+    use_width = min(width, original_width) if original_width else width
+    ratio = use_width / float(original_width)
+    return use_width, int(original_height * ratio)
+
+
+def _select_pyramid_level(img, want):
+    """Seek a multi-page TIFF to the smallest page that still covers ``want``."""
+    original_width, original_height = img.size
+    best = None
+    for frame in range(1, getattr(img, 'n_frames', 1)):
+        img.seek(frame)
+        w, h = img.size
+        same_aspect = abs(w / original_width - h / original_height) < 0.01
+        if same_aspect and w >= want[0] and h >= want[1] and (best is None or w < best[1]):
+            best = (frame, w)
+    img.seek(best[0] if best else 0)
+
+
+def open_for_ladder(img, sizes):
+    """Prepare an opened image for the ladder and return its original size.
+
+    Nothing is decoded here. For JPEGs this switches the decoder to draft mode
+    so only enough DCT coefficients for the largest variant are decoded; for
+    pyramid TIFFs it selects the smallest level that covers the largest variant.
+    The returned size is the upright one, after the EXIF orientation that
+    :func:`normalize` applies.
+    """
+    transposed = is_transposed(img)
+    original_size = img.size[::-1] if transposed else img.size
+    largest = max(width for _, width, _ in sizes)
+    want = target_size(original_size, largest)
+    if want[0] < original_size[0]:
+        stored_want = want[::-1] if transposed else want
+        if img.format == 'JPEG':
+            img.draft(img.mode, stored_want)
+        elif img.format == 'TIFF' and getattr(img, 'n_frames', 1) > 1:
+            _select_pyramid_level(img, stored_want)
+    return original_size
+
+
+def estimate_decoded_bytes(path, sizes):
+    """Estimate peak pixel memory for building the ladder of ``path`` from its header only.
+
+    Counts the (draft/pyramid-reduced) decode plus the largest variant, which
+    is the most ``write_variants`` holds at once. Unreadable files count as 0
+    so they fail fast in a worker instead of here.
+    """
+    try:
+        img = Image.open(path)
+    except Exception:
+        return 0
+    with img:
+        original_size = open_for_ladder(img, sizes)
+        bpp = BYTES_PER_PIXEL.get(img.mode, 4)
+        decoded = img.size[0] * img.size[1] * bpp
+    largest = max(width for _, width, _ in sizes)
+    w, h = target_size(original_size, largest)
+    return decoded + w * h * max(bpp, 3)
+
+
+def is_transposed(img):
+    """Whether the EXIF orientation swaps the stored width and height."""
+    return img.getexif().get(ExifTags.Base.Orientation, 1) in TRANSPOSED_ORIENTATIONS
+
+
+def _is_srgb(profile):
+    from PIL import ImageCms
+    return 'srgb' in ImageCms.getProfileDescription(profile).lower()
+
+
+def normalize(img, keep_exif=()):
+    """Upright, sRGB, metadata-free version of a loaded source.
+
+    Applies the EXIF orientation, converts an embedded ICC profile that isn't
+    sRGB to sRGB and drops EXIF, XMP and the profile. ``keep_exif`` names EXIF
+    tags (``ExifTags.Base`` names such as ``Copyright``) that variants keep.
+
+    Returns ``(image, save_params, changes)``: the image to resize (``img``
+    itself when nothing had to change), save parameters carrying the kept EXIF
+    tags and the names (see ``NORMALIZATIONS``) of what was changed.
+    """
+    exif = img.getexif()
+    changes = ['metadata'] if any(img.info.get(key) for key in METADATA_KEYS) else []
+    kept = Image.Exif()
+    for name in keep_exif:
+        tag = ExifTags.Base[name]
+        if tag in exif:
+            kept[tag] = exif[tag]
+    params = {'exif': kept.tobytes()} if len(kept) else {}
+
+    out = img
+    icc = img.info.get('icc_profile')
+    if exif.get(ExifTags.Base.Orientation, 1) != 1:
+        out = ImageOps.exif_transpose(out)
+        changes.append('rotated')
+    if icc and out.mode in ICC_MODES:
+        from PIL import ImageCms
+        try:
+            profile = ImageCms.ImageCmsProfile(BytesIO(icc))
+            if not _is_srgb(profile):
+                mode = 'RGBA' if out.mode == 'RGBA' else 'RGB'
+                out = ImageCms.profileToProfile(out, profile, ImageCms.createProfile('sRGB'), outputMode=mode)
+                changes.append('srgb')
+        except (ImageCms.PyCMSError, OSError):
+            # an unusable profile: keep the pixels as they are, like before normalization
+            pass
+    # resized copies inherit ``info``; some encoders would write it back out
+    out.info = {}
+    return out, params, sorted(changes)
+
+
+def exif_tags(names):
+    """Validate comma-separated ``ExifTags.Base`` names (``"Copyright,Artist"``); raises ``ValueError``."""
+    tags = [name.strip() for name in names.split(',') if name.strip()]
+    unknown = [name for name in tags if name not in ExifTags.Base.__members__]
+    if unknown:
+        raise ValueError(f"unknown EXIF tag(s): {', '.join(unknown)}")
+    return tags
+
+
+def normalized_summary(counts, total):
+    """One line for ``{change: number of sources}`` out of ``total`` sources."""
+    parts = ', '.join(f'{counts.get(name, 0)} {label}' for name, label in NORMALIZATIONS.items())
+    return f'Normalized {total} sources: {parts}'
+
+
+def resize_cascade(img, original_size, sizes):
+    """Yield ``(name, resized_image)`` for every entry in ``sizes``, largest first.
+
+    Targets are computed from the original size so variant dimensions do not
+    depend on how far the draft decode got. Each step is resized from the
+    previous one, and only that previous step is kept alive.
+    """
+    current = img
+    for name, width, _ in sorted(sizes, key=lambda s: s[1], reverse=True):
+        size = target_size(original_size, width)
+        with tracing.span('resize', variant=name, size=list(size)):
+            if current.size == size:
+                resized = current if current is not img else img.copy()
+            else:
+                resized = current.resize(size, Image.LANCZOS, reducing_gap=REDUCING_GAP)
+        yield name, resized
+        current = resized
+
+
+def focus_box(size, aspect, focus=(0.5, 0.5)):
+    """Largest ``(left, top, right, bottom)`` box of ``aspect`` (width/height) inside ``size``,
+    centred on ``focus`` (fractions of the width/height) as far as the edges allow."""
+    width, height = size
+    crop_w, crop_h = width, round(width / aspect)
+    if crop_h > height:
+        crop_w, crop_h = round(height * aspect), height
+    left = min(max(round(focus[0] * width - crop_w / 2), 0), width - crop_w)
+    top = min(max(round(focus[1] * height - crop_h / 2), 0), height - crop_h)
+    return left, top, left + crop_w, top + crop_h
+
+
+def to_jpeg_mode(img):
+    """Flatten alpha onto white and convert to RGB for JPEG output."""
+    if img.mode in ("RGBA", "LA"):
+        bg = Image.new("RGB", img.size, (255, 255, 255))
+        bg.paste(img, mask=img.split()[-1])
+        return bg
+    return img.convert('RGB')
+
+
+def save_atomic(img, path, fmt, **params):
+    """Encode ``img`` in memory, then write it through a temporary file renamed into place.
+
+    The old file is replaced rather than rewritten in place, so readers never
+    see a half-written variant and hardlinked fingerprinted copies of the old
+    version (see ``fingerprint-assets.py``) keep their contents. Encoding and
+    writing are separate trace spans.
+    """
+    with tracing.span(f'encode-{fmt.lower()}', file=path) as info:
+        buf = BytesIO()
+        img.save(buf, fmt, **params)
+        info['bytes_out'] = buf.tell()
+    write_bytes_atomic(path, buf.getbuffer())
+
+
+def write_bytes_atomic(path, data):
+    with tracing.span('write', file=path, bytes_out=len(data)):
+        replace_file(path, data)
+
+
+def placeholder(img):
+    """Return ``{'placeholder': data_uri, 'color': '#rrggbb'}`` for an image.
+
+    Both come from Pillow's C resamplers/quantizer working on a 16px copy, so
+    the cost is negligible next to encoding the variants.
+    """
+    width = min(PLACEHOLDER_WIDTH, img.size[0])
+    height = max(1, round(img.size[1] * width / img.size[0]))
+    tiny = to_jpeg_mode(img).resize((width, height), Image.BOX, reducing_gap=2.0)
+    buf = BytesIO()
+    tiny.save(buf, 'WEBP', quality=PLACEHOLDER_QUALITY)
+    data_uri = 'data:image/webp;base64,' + base64.b64encode(buf.getvalue()).decode('ascii')
+    # dominant colour: most frequent entry of a small adaptive palette
+    palette = tiny.quantize(colors=8, method=Image.Quantize.FASTOCTREE)
+    count, idx = max(palette.getcolors())
+    r, g, b = palette.getpalette()[idx * 3:idx * 3 + 3]
+    return {'placeholder': data_uri, 'color': f'#{r:02x}{g:02x}{b:02x}'}
+
+
+def placeholder_from_file(path):
+    with Image.open(path) as img:
+        img.draft('RGB', (PLACEHOLDER_WIDTH, PLACEHOLDER_WIDTH))
+        return placeholder(img)
+
+
+def avif_supported():
+    from PIL import features
+    return bool(features.check('avif'))
+
+
+def ssim(a, b):
+    """Mean SSIM of the luma of two same-sized images over ``SSIM_WINDOW`` box windows."""
+    import numpy as np
+
+    x = np.asarray(a.convert('L'), dtype=np.float64)
+    y = np.asarray(b.convert('L'), dtype=np.float64)
+    k = min(SSIM_WINDOW, *x.shape)
+
+    def box_mean(m):
+        # summed-area table, so every window costs four lookups
+        c = np.pad(m.cumsum(0).cumsum(1), ((1, 0), (1, 0)))
+        return (c[k:, k:] - c[:-k, k:] - c[k:, :-k] + c[:-k, :-k]) / (k * k)
+
+    c1, c2 = (0.01 * 255) ** 2, (0.03 * 255) ** 2
+    mx, my = box_mean(x), box_mean(y)
+    vx = box_mean(x * x) - mx * mx
+    vy = box_mean(y * y) - my * my
+    cov = box_mean(x * y) - mx * my
+    s = ((2 * mx * my + c1) * (2 * cov + c2)) / ((mx * mx + my * my + c1) * (vx + vy + c2))
+    return float(s.mean())
+
+
+def encode_avif(img, quality, **params):
+    buf = BytesIO()
+    img.save(buf, 'AVIF', quality=quality, speed=AVIF_SPEED, **params)
+    return buf.getvalue()
+
+
+def search_avif_quality(img, target=AVIF_SSIM, qualities=AVIF_QUALITIES, **params):
+    """Return ``(quality, avif_bytes)`` for the lowest quality scoring ``target`` SSIM.
+
+    Binary search over ``qualities`` (ascending), assuming SSIM grows with
+    quality. When nothing reaches the target the highest quality is used.
+    """
+    ref = to_jpeg_mode(img)
+    lo, hi = 0, len(qualities) - 1
+    best = None
+    while lo <= hi:
+        mid = (lo + hi) // 2
+        data = encode_avif(ref, qualities[mid], **params)
+        with Image.open(BytesIO(data)) as decoded:
+            score = ssim(ref, decoded)
+        if score >= target:
+            best = (qualities[mid], data)
+            hi = mid - 1
+        else:
+            lo = mid + 1
+    if best is None:
+        best = (qualities[-1], encode_avif(ref, qualities[-1], **params))
+    return best
+
+
+def avif_settings(target=AVIF_SSIM):
+    """Everything that decides which AVIF quality the search picks."""
+    from PIL import features
+    return {'ssim': target, 'qualities': list(AVIF_QUALITIES), 'speed': AVIF_SPEED,
+            'avif': features.version('avif')}
+
+
+def avif_options(settings, previous=None):
+    """``write_variants`` AVIF options, reusing the qualities chosen last time for an
+    unchanged source (``previous`` is its build cache entry) under the same settings."""
+    known = (previous or {}).get('avif') or {}
+    qualities = known.get('qualities', {}) if known.get('settings') == settings else {}
+    return {'ssim': settings['ssim'], 'qualities': qualities}
+
+
+def adaptive_settings(step=ADAPTIVE_STEP, min_width=ADAPTIVE_MIN_WIDTH, max_width=ADAPTIVE_MAX_WIDTH):
+    """Everything that decides which widths the adaptive ladder picks."""
+    return {'step': step, 'min_width': min_width, 'max_width': max_width,
+            'samples': ADAPTIVE_SAMPLES, 'max_widths': ADAPTIVE_MAX_WIDTHS}
+
+
+def adaptive_options(settings, previous=None):
+    """``write_variants`` adaptive options, reusing the widths chosen last time for an
+    unchanged source (``previous`` is its build cache entry) under the same settings."""
+    known = (previous or {}).get('adaptive') or {}
+    widths = known.get('widths') if known.get('settings') == settings else None
+    return dict(settings, widths=widths)
+
+
+def decode_sizes(sizes, adaptive=None):
+    """``sizes`` plus the adaptive maximum width, which the decode has to cover too."""
+    if not adaptive:
+        return sizes
+    return list(sizes) + [('adaptive', adaptive['max_width'], 0)]
+
+
+def quality_for_width(width, sizes):
+    """Quality of the smallest entry of ``sizes`` at least ``width`` wide (the largest one's above that)."""
+    ordered = sorted(sizes, key=lambda s: s[1])
+    return next((quality for _, w, quality in ordered if width <= w), ordered[-1][2])
+
+
+def _width_for_bytes(samples, target):
+    """Invert the piecewise-linear ``[(width, bytes)]`` curve (bytes non-decreasing)."""
+    for (w0, b0), (w1, b1) in zip(samples, samples[1:]):
+        if b0 <= target <= b1:
+            return w0 if b1 == b0 else w0 + (w1 - w0) * (target - b0) / (b1 - b0)
+    return samples[0][0]
+
+
+def breakpoints(img, original_size, adaptive, sizes):
+    """Ascending widths whose WebP variants differ by about ``adaptive['step']`` bytes.
+
+    The encoded size is measured at ``ADAPTIVE_SAMPLES`` geometrically spaced
+    widths between the minimum and maximum width (never upscaling), and the
+    ladder walks down that curve from the largest width one byte step at a time.
+    """
+    top_size = target_size(original_size, adaptive['max_width'])
+    low = min(adaptive['min_width'], top_size[0])
+    top = img.resize(top_size, Image.LANCZOS, reducing_gap=REDUCING_GAP) if img.size != top_size else img
+    count = max(2, adaptive.get('samples', ADAPTIVE_SAMPLES))
+    samples = []
+    for i in range(count):
+        width = round(low * (top_size[0] / low) ** (i / (count - 1)))
+        probe = top if width == top_size[0] else top.resize(target_size(original_size, width), Image.LANCZOS,
+                                                            reducing_gap=REDUCING_GAP)
+        buf = BytesIO()
+        probe.save(buf, 'WEBP', quality=quality_for_width(width, sizes))
+        # bytes never shrink as the width grows
+        samples.append((width, max(buf.tell(), samples[-1][1] if samples else 0)))
+
+    widths = [top_size[0]]
+    target = samples[-1][1] - adaptive['step']
+    while len(widths) < adaptive.get('max_widths', ADAPTIVE_MAX_WIDTHS) - 1 and target > samples[0][1]:
+        width = int(round(_width_for_bytes(samples, target) / ADAPTIVE_ROUND) * ADAPTIVE_ROUND)
+        if width <= low or width >= widths[-1]:
+            break
+        widths.append(width)
+        target -= adaptive['step']
+    if low < widths[-1]:
+        widths.append(low)
+    return sorted(widths)
+
+
+def adaptive_sizes(widths, sizes):
+    """Ladder for ``write_variants`` from adaptive ``widths``.
+
+    The smallest entry of ``sizes`` (the grid thumbnail) is kept as it is, the
+    largest width is written as ``full`` (the lightbox and the hero load both
+    by name) and every other width as ``<width>w``.
+    """
+    thumb = min(sizes, key=lambda s: s[1])
+    ladder = [thumb]
+    for width in widths:
+        if width == max(widths):
+            ladder.append(('full', width, quality_for_width(width, sizes)))
+        elif width != thumb[1]:
+            ladder.append((f'{width}w', width, quality_for_width(width, sizes)))
+    return ladder
+
+
+def write_avif(img, out, target=AVIF_SSIM, quality=None, **params):
+    """Write ``img`` as AVIF to ``out`` and return the quality used.
+
+    A known ``quality`` (from the build cache) is encoded directly; otherwise
+    it is searched for with :func:`search_avif_quality`.
+    """
+    if quality is None:
+        with tracing.span('avif-search', file=out) as info:
+            quality, data = search_avif_quality(img, target, **params)
+            info.update(quality=quality, bytes_out=len(data))
+    else:
+        with tracing.span('encode-avif', file=out, quality=quality) as info:
+            data = encode_avif(to_jpeg_mode(img), quality, **params)
+            info['bytes_out'] = len(data)
+    write_bytes_atomic(out, data)
+    return quality
+
+
+def write_variants(src, target_dir, sanitized, sizes, note='', avif=None, adaptive=None, keep_exif=()):
+    """Decode ``src`` once and write ``<sanitized>-<name>.webp/.jpg`` for every size,
+    plus ``<sanitized>-lqip.json`` with the placeholder computed from the smallest one.
+
+    With ``avif={'ssim': target, 'qualities': {name: quality}}`` an AVIF is
+    written per size too; sizes missing from ``qualities`` get a quality search.
+
+    With ``adaptive`` (see :func:`adaptive_options`) the widths come from
+    :func:`breakpoints` instead (or its known ``widths``) and are written as
+    described in :func:`adaptive_sizes`.
+
+    The source is normalized first (see :func:`normalize`); only the EXIF tags
+    named in ``keep_exif`` are written to the variants.
+
+    Returns ``(ok, log_lines, info)`` in the form the worker pool expects, where
+    ``info['avif_qualities']`` holds the AVIF quality used per size,
+    ``info['sizes']`` the ladder that was written (``info['widths']`` the
+    adaptive widths it came from) and ``info['normalized']`` what
+    :func:`normalize` changed about the source.
+    """
+    ok = True
+    widths = None
+    logs = {}
+    avif_qualities = {}
+    normalized = []
+    try:
+        with Image.open(src) as img:
+            with tracing.span('decode', file=src, bytes_in=os.path.getsize(src)) as info:
+                original_size = open_for_ladder(img, decode_sizes(sizes, adaptive))
+                img.load()
+                info['size'] = list(img.size)
+            with tracing.span('normalize', file=src):
+                source, params, normalized = normalize(img, keep_exif)
+            if adaptive:
+                with tracing.span('breakpoints', file=src):
+                    widths = adaptive.get('widths') or breakpoints(source, original_size, adaptive, sizes)
+                sizes = adaptive_sizes(widths, sizes)
+            quality_for = {name: quality for name, _, quality in sizes}
+            for name, resized in resize_cascade(source, original_size, sizes):
+                # the decoded source is no longer needed once the largest variant exists
+                source.close()
+                img.close()
+                quality = quality_for[name]
+                webp_out = os.path.join(target_dir, f"{sanitized}-{name}.webp")
+                jpg_out = os.path.join(target_dir, f"{sanitized}-{name}.jpg")
+                log = logs.setdefault(name, [])
+
+                try:
+                    save_atomic(resized, webp_out, 'WEBP', quality=quality, **params)
+                except Exception as e:
+                    ok = False
+                    log.append(f"Warning: failed to write WebP for {webp_out}: {e}")
+
+                try:
+                    save_atomic(to_jpeg_mode(resized), jpg_out, 'JPEG', quality=quality, **params)
+                except Exception as e:
+                    ok = False
+                    log.append(f"Warning: failed to write JPG for {jpg_out}: {e}")
+
+                written = f"{webp_out} and {jpg_out}"
+                if avif is not None:
+                    avif_out = os.path.join(target_dir, f"{sanitized}-{name}.avif")
+                    try:
+                        known = avif.get('qualities', {}).get(name)
+                        avif_qualities[name] = write_avif(resized, avif_out, avif['ssim'], known, **params)
+                        written = f"{webp_out}, {jpg_out} and {avif_out} (AVIF q{avif_qualities[name]})"
+                    except Exception as e:
+                        ok = False
+                        log.append(f"Warning: failed to write AVIF for {avif_out}: {e}")
+
+                log.append(f"Wrote: {written}{note}")
+                smallest = resized
+
+            lqip_out = os.path.join(target_dir, f"{sanitized}-lqip.json")
+            with tracing.span('placeholder', file=lqip_out):
+                write_bytes_atomic(lqip_out, json.dumps(placeholder(smallest)).encode('utf-8'))
+    except Exception as e:
+        ok = False
+        logs.setdefault(None, []).append(f"Failed to process {src}: {e}")
+    # report variants in SIZES order, whatever order they were built in
+    lines = [line for name, _, _ in sizes for line in logs.get(name, [])]
+    return ok, lines + logs.get(None, []), {'avif_qualities': avif_qualities, 'sizes': sizes, 'widths': widths,
+                                        'normalized': normalized}
+
+
+# What optimize-images.py and optimize-originals.py share: their options, and
+# running a ladder task over the sources and recording the results
+
+
+def add_arguments(parser, folder):
+    """The optimizers' encoding options; ``folder`` is where ``--category NAME`` looks."""
+    parser.add_argument('--force', action='store_true', help='ignore the build cache and rebuild everything')
+    parser.add_argument('--prune', action='store_true',
+                        help='delete stale outputs whose sources are gone and files a rebuild no longer writes')
+    parser.add_argument('--avif', action='store_true', help='also write AVIF variants at a searched quality')
+    parser.add_argument('--avif-ssim', type=float, default=AVIF_SSIM,
+                        help=f'SSIM the AVIF variants must reach (default {AVIF_SSIM})')
+    parser.add_argument('--adaptive', action='store_true',
+                        help='pick each image\'s widths by byte size instead of the fixed medium/full widths')
+    parser.add_argument('--byte-step', type=int, default=ADAPTIVE_STEP // 1024,
+                        help=f'target KiB between adaptive widths (default {ADAPTIVE_STEP // 1024})')
+    parser.add_argument('--min-width', type=int, default=ADAPTIVE_MIN_WIDTH,
+                        help=f'smallest adaptive width (default {ADAPTIVE_MIN_WIDTH})')
+    parser.add_argument('--max-width', type=int, default=ADAPTIVE_MAX_WIDTH,
+                        help=f'largest adaptive width (default {ADAPTIVE_MAX_WIDTH})')
+    parser.add_argument('--keep-exif', default='',
+                        help='comma-separated EXIF tags the variants keep, e.g. Copyright,Artist (default: none)')
+    parser.add_argument('--category', action='append', metavar='NAME',
+                        help=f'only process {folder}/NAME (repeatable; default: every category)')
+
+
+def options_from_args(parser, args):
+    """``{'avif', 'adaptive', 'keep_exif'}`` settings from :func:`add_arguments`' options (``None``/``[]`` when off).
+
+    Options this Pillow build can't honour end the run through ``parser.error``.
+    """
+    if args.avif and not avif_supported():
+        parser.error('this Pillow build cannot encode AVIF')
+    try:
+        keep_exif = exif_tags(args.keep_exif)
+    except ValueError as e:
+        parser.error(str(e))
+    adaptive = None
+    if args.adaptive:
+        adaptive = adaptive_settings(args.byte_step * 1024, args.min_width, args.max_width)
+    return {'avif': avif_settings(args.avif_ssim) if args.avif else None, 'adaptive': adaptive,
+            'keep_exif': keep_exif}
+
+
+def ladder_settings(sizes, options):
+    """Build cache settings key for ``sizes`` encoded with ``options`` (see :func:`options_from_args`)."""
+    avif, adaptive, keep_exif = options['avif'], options['adaptive'], options['keep_exif']
+    extras = [x for x in (avif, {'adaptive': adaptive} if adaptive else None,
+                          {'keep_exif': keep_exif} if keep_exif else None) if x]
+    return settings_key(sizes, encoder_version(), ENGINE_VERSION, *extras)
+
+
+def encode_sources(task, todo, args, cache, settings, sizes, options, output_paths):
+    """Run ``task(f, avif_for=, adaptive_for=, keep_exif=)`` over ``todo`` in worker processes.
+
+    Each source's log is printed as it finishes. A source whose ladder was
+    written is recorded in ``cache`` with its AVIF qualities, adaptive widths
+    and normalization, and the files an earlier ladder had but this one does
+    not are reported (deleted with ``args.prune``). ``output_paths(f, avif,
+    sizes)`` names a source's outputs.
+    """
+    avif, adaptive = options['avif'], options['adaptive']
+    avif_for = {f: avif_options(avif, cache.previous(f)) for f in todo} if avif else None
+    adaptive_for = {f: adaptive_options(adaptive, cache.previous(f)) for f in todo} if adaptive else None
+    func = functools.partial(task, avif_for=avif_for, adaptive_for=adaptive_for, keep_exif=options['keep_exif'])
+    covered = decode_sizes(sizes, adaptive)
+    for f, (ok, log, info) in workers.run_jobs(func, todo, args.jobs, workers.memory_limit_from_args(args),
+                                              cost=lambda f: estimate_decoded_bytes(f, covered),
+                                              budget=workers.memory_budget_from_args(args)):
+        for line in log:
+            print(line)
+        if ok:
+            extra = {'avif': {'settings': avif, 'qualities': info['avif_qualities']}} if avif else {}
+            extra['normalized'] = info['normalized']
+            if adaptive:
+                extra['adaptive'] = {'settings': adaptive, 'widths': info['widths']}
+            outputs = output_paths(f, avif=bool(avif), sizes=info['sizes'])
+            report_superseded(cache.record(f, settings, outputs, **extra), prune=args.prune)
+
+
+def report_normalized(cache, files):
+    """Print what normalization changed, over every one of ``files`` the cache knows about."""
+    counts = {}
+    known = [entry for entry in (cache.get(f) for f in files) if entry and 'normalized' in entry]
+    for entry in known:
+        for name in entry['normalized']:
+            counts[name] = counts.get(name, 0) + 1
+    if known:
+        print(normalized_summary(counts, len(known)))
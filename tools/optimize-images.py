@@ -1,8 +1,14 @@
 #!/usr/bin/env python3
 import os
-from PIL import Image
+import re
+import argparse
 import glob
 
+import imaging
+import tracing
+import workers
+from buildcache import BuildCache, report_stale
+
 ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 IMAGES_ROOT = os.path.join(ROOT, 'images')
 
@@ -14,60 +20,70 @@ SIZES = [
 
 EXTENSIONS = ('.jpg', '.jpeg', '.png', '.tiff', '.webp', '.heic')
 
+# Files this script writes itself (and their fingerprinted copies from
+# fingerprint-assets.py); they must never be picked up as sources again
+DERIVATIVE_RE = re.compile(r'-(thumb|medium|full|\d+w|crop-(?:portrait|square)-\d+)(\.[0-9a-f]{10})?\.(webp|jpg|avif)$')
+
 def sanitize_name(name):
     return name.replace(' ', '-')
 
-def process_image(filepath):
+def is_derivative(filepath):
+    return DERIVATIVE_RE.search(os.path.basename(filepath)) is not None
+
+def output_paths(filepath, avif=False, sizes=SIZES):
+    dirpath = os.path.dirname(filepath)
+    sanitized = sanitize_name(os.path.splitext(os.path.basename(filepath))[0])
+    outs = []
+    for name, _, _ in sizes:
+        outs.append(os.path.join(dirpath, f"{sanitized}-{name}.webp"))
+        outs.append(os.path.join(dirpath, f"{sanitized}-{name}.jpg"))
+        if avif:
+            outs.append(os.path.join(dirpath, f"{sanitized}-{name}.avif"))
+    outs.append(os.path.join(dirpath, f"{sanitized}-lqip.json"))
+    return outs
+
+def process_image(filepath, avif_for=None, adaptive_for=None, keep_exif=()):
+    """Write all variants for ``filepath`` and return ``(ok, log_lines, info)``."""
     dirpath = os.path.dirname(filepath)
     base = os.path.splitext(os.path.basename(filepath))[0]
-    sanitized = sanitize_name(base)
+    avif = avif_for.get(filepath) if avif_for else None
+    adaptive = adaptive_for.get(filepath) if adaptive_for else None
+    return imaging.write_variants(filepath, dirpath, sanitize_name(base), SIZES, avif=avif, adaptive=adaptive,
+                                  keep_exif=keep_exif)
 
-    try:
-        with Image.open(filepath) as img:
-            original_width, original_height = img.size
-            for name, width, quality in SIZES:
-                use_width = min(width, original_width) if original_width else width
-                # Preserve aspect ratio
-                ratio = use_width / float(original_width)
-                new_height = int(original_height * ratio)
-                resized = img.resize((use_width, new_height), Image.LANCZOS)
-
-                webp_out = os.path.join(dirpath, f"{sanitized}-{name}.webp")
-                jpg_out = os.path.join(dirpath, f"{sanitized}-{name}.jpg")
-
-                # Save WebP
-                try:
-                    resized.save(webp_out, 'WEBP', quality=quality)
-                except Exception as e:
-                    print(f"Warning: failed to write WebP for {webp_out}: {e}")
-
-                # Save JPEG
-                try:
-                    # Convert to RGB if image has alpha channel for JPEG
-                    if resized.mode in ("RGBA", "LA"):
-                        bg = Image.new("RGB", resized.size, (255,255,255))
-                        bg.paste(resized, mask=resized.split()[3])
-                        bg.save(jpg_out, 'JPEG', quality=quality)
-                    else:
-                        resized.convert('RGB').save(jpg_out, 'JPEG', quality=quality)
-                except Exception as e:
-                    print(f"Warning: failed to write JPG for {jpg_out}: {e}")
-
-                print(f"Wrote: {webp_out} and {jpg_out}")
-
-    except Exception as e:
-        print(f"Failed to process {filepath}: {e}")
-
-
-def main():
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Create thumb/medium/full WebP + JPEG variants for images under images/')
+    workers.add_arguments(parser)
+    tracing.add_arguments(parser)
+    imaging.add_arguments(parser, 'images')
+    args = parser.parse_args(argv)
+    tracing.from_args(args, 'optimize-images')
+    options = imaging.options_from_args(parser, args)
+
+    roots = [os.path.join(IMAGES_ROOT, c) for c in args.category] if args.category else [IMAGES_ROOT]
     files = []
-    for ext in EXTENSIONS:
-        files.extend(glob.glob(os.path.join(IMAGES_ROOT, '**', f'*{ext}'), recursive=True))
+    for root in roots:
+        for ext in EXTENSIONS:
+            files.extend(glob.glob(os.path.join(root, '**', f'*{ext}'), recursive=True))
 
-    files = [f for f in files if '/originals/' not in f.replace('\\','/')]
+    files = sorted(f for f in files if '/originals/' not in f.replace('\\','/') and not is_derivative(f))
     print(f"Found {len(files)} images to process")
-    for f in files:
-        process_image(f)
+
+    cache = BuildCache('optimize-images')
+    settings = imaging.ladder_settings(SIZES, options)
+    todo = [f for f in files if args.force or not cache.is_fresh(f, settings)]
+    if len(todo) < len(files):
+        print(f"Skipping {len(files) - len(todo)} up-to-date images")
+
+    try:
+        imaging.encode_sources(process_image, todo, args, cache, settings, SIZES, options, output_paths)
+        report_stale(cache, prune=args.prune, under=roots if args.category else ())
+    finally:
+        cache.save()
+
+    imaging.report_normalized(cache, files)
+    tracing.finish(args)
 
 if __name__ == '__main__':
     main()
@@ -1,10 +1,18 @@
 #!/usr/bin/env python3
 import os
 import glob
-from PIL import Image
+import argparse
+
+import dupes
+import imaging
+import tracing
+import workers
+from buildcache import BuildCache, report_stale
+from catalog import FileInfoCache
 
 ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 ORIGINALS_ROOT = os.path.join(ROOT, 'images', 'originals')
+FILE_INFO_FILE = os.path.join(ROOT, '.cache', 'file-info.json')
 
 SIZES = [
     ('thumb', 600, 80),
@@ -14,56 +22,93 @@ SIZES = [
 
 EXTENSIONS = ('.jpg', '.jpeg', '.png', '.tiff', '.webp', '.heic')
 
-if not os.path.isdir(ORIGINALS_ROOT):
-    print('No originals folder found, exiting')
-    exit(0)
-
-files = []
-for ext in EXTENSIONS:
-    files.extend(glob.glob(os.path.join(ORIGINALS_ROOT, '**', f'*{ext}'), recursive=True))
 
-print(f'Found {len(files)} originals to process')
-
-for f in files:
+def target_for(f):
+    """Return ``(target_dir, sanitized_base)`` for an original."""
     rel = os.path.relpath(f, ORIGINALS_ROOT)  # dnc/filename.jpg
     parts = rel.split(os.sep)
     category = parts[0]
     base = os.path.splitext(parts[-1])[0]
-    sanitized = base.replace(' ', '-')
+    return os.path.join(ROOT, 'images', category), base.replace(' ', '-')
+
 
-    target_dir = os.path.join(ROOT, 'images', category)
+def output_paths(f, avif=False, sizes=SIZES):
+    target_dir, sanitized = target_for(f)
+    outs = []
+    for name, _, _ in sizes:
+        outs.append(os.path.join(target_dir, f"{sanitized}-{name}.webp"))
+        outs.append(os.path.join(target_dir, f"{sanitized}-{name}.jpg"))
+        if avif:
+            outs.append(os.path.join(target_dir, f"{sanitized}-{name}.avif"))
+    outs.append(os.path.join(target_dir, f"{sanitized}-lqip.json"))
+    return outs
+
+
+def process_original(f, avif_for=None, adaptive_for=None, keep_exif=()):
+    """Write all variants for the original ``f`` into images/<category> and return ``(ok, log_lines, info)``."""
+    target_dir, sanitized = target_for(f)
     os.makedirs(target_dir, exist_ok=True)
+    avif = avif_for.get(f) if avif_for else None
+    adaptive = adaptive_for.get(f) if adaptive_for else None
+    return imaging.write_variants(f, target_dir, sanitized, SIZES, note=f' (from {f})', avif=avif,
+                                  adaptive=adaptive, keep_exif=keep_exif)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Create thumb/medium/full variants from images/originals/<category> into images/<category>')
+    workers.add_arguments(parser)
+    tracing.add_arguments(parser)
+    imaging.add_arguments(parser, 'images/originals')
+    parser.add_argument('--skip-duplicates', action='store_true',
+                        help='only encode one original per near-duplicate cluster (see find-duplicates.py)')
+    parser.add_argument('--duplicate-threshold', type=int, default=dupes.DEFAULT_THRESHOLD,
+                        help=f'max differing hash bits for a near-duplicate (default {dupes.DEFAULT_THRESHOLD})')
+    args = parser.parse_args(argv)
+    tracing.from_args(args, 'optimize-originals')
+    options = imaging.options_from_args(parser, args)
+
+    if not os.path.isdir(ORIGINALS_ROOT):
+        print('No originals folder found, exiting')
+        return
+
+    roots = [os.path.join(ORIGINALS_ROOT, c) for c in args.category] if args.category else [ORIGINALS_ROOT]
+    files = []
+    for root in roots:
+        for ext in EXTENSIONS:
+            files.extend(glob.glob(os.path.join(root, '**', f'*{ext}'), recursive=True))
+    files.sort()
+
+    print(f'Found {len(files)} originals to process')
+
+    cache = BuildCache('optimize-originals')
+    settings = imaging.ladder_settings(SIZES, options)
+    todo = [f for f in files if args.force or not cache.is_fresh(f, settings)]
+    if len(todo) < len(files):
+        print(f'Skipping {len(files) - len(todo)} up-to-date originals')
+    if todo or args.skip_duplicates:
+        # report near-duplicates before spending time on encoding them
+        info = FileInfoCache(FILE_INFO_FILE)
+        hashes = dupes.hash_files(files, info)
+        info.save()
+        groups = dupes.clusters(hashes, args.duplicate_threshold)
+        if groups:
+            print(f'Found {len(groups)} near-duplicate clusters among the originals:')
+            dupes.report(groups, hashes, label=lambda p: os.path.relpath(p, ORIGINALS_ROOT))
+        if args.skip_duplicates:
+            redundant = {f for g in groups for f in g if f != dupes.representative(g)}
+            todo = [f for f in todo if f not in redundant]
+            print(f'Skipping {len(redundant)} near-duplicate originals')
 
     try:
-        with Image.open(f) as img:
-            original_width, original_height = img.size
-            for name, width, quality in SIZES:
-                use_width = min(width, original_width) if original_width else width
-                ratio = use_width / float(original_width)
-                new_height = int(original_height * ratio)
-                resized = img.resize((use_width, new_height), Image.LANCZOS)
-
-                webp_out = os.path.join(target_dir, f"{sanitized}-{name}.webp")
-                jpg_out = os.path.join(target_dir, f"{sanitized}-{name}.jpg")
-
-                try:
-                    resized.save(webp_out, 'WEBP', quality=quality)
-                except Exception as e:
-                    print(f'Warning: failed to write WebP for {webp_out}: {e}')
-
-                try:
-                    if resized.mode in ("RGBA", "LA"):
-                        bg = Image.new("RGB", resized.size, (255,255,255))
-                        bg.paste(resized, mask=resized.split()[3])
-                        bg.save(jpg_out, 'JPEG', quality=quality)
-                    else:
-                        resized.convert('RGB').save(jpg_out, 'JPEG', quality=quality)
-                except Exception as e:
-                    print(f'Warning: failed to write JPG for {jpg_out}: {e}')
-
-                print(f'Wrote: {webp_out} and {jpg_out} (from {f})')
-
-    except Exception as e:
-        print(f'Failed to process {f}: {e}')
-
-print('Done optimizing originals')
+        imaging.encode_sources(process_original, todo, args, cache, settings, SIZES, options, output_paths)
+        report_stale(cache, prune=args.prune, under=roots if args.category else ())
+    finally:
+        cache.save()
+
+    imaging.report_normalized(cache, files)
+    tracing.finish(args)
+    print('Done optimizing originals')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,388 @@
+#!/usr/bin/env python3
+"""Serve site/ for local previews, rebuilding and reloading the browser on changes.
+
+Requests are served on a thread each, with ETag/If-None-Match (304),
+single byte Range requests (206) and gzip: a precompressed ``<file>.br`` /
+``<file>.gz`` sibling when there is a fresh one, otherwise text responses are
+compressed on the fly (and kept in memory until the file changes).
+Fingerprinted files are sent as immutable; everything else must revalidate.
+site/images is the symlink to images/ and is followed like any folder.
+
+A watcher polls images/, site/ and tools/; after a change it runs
+tools/build.py, which only redoes the affected variants, manifest shards and
+pages, and then every open page reloads (a small script injected into HTML
+responses listens on ``/__livereload``).
+
+    python3 tools/serve-site.py [--port 8000] [--bind 127.0.0.1] [--no-watch]
+                                [--no-reload] [--interval 1] [-- BUILD_ARGS...]
+"""
+import io
+import os
+import re
+import sys
+import gzip
+import json
+import argparse
+import threading
+import subprocess
+import http.server
+import email.utils
+from functools import lru_cache, partial
+from http import HTTPStatus
+
+from assetmap import is_fingerprinted
+
+TOOLS = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(TOOLS)
+SITE = os.path.join(ROOT, 'site')
+BUILD = os.path.join(TOOLS, 'build.py')
+
+RELOAD_PATH = '/__livereload'
+RELOAD_SCRIPT = (b'<script>/* serve-site.py live reload */new EventSource("' + RELOAD_PATH.encode()
+                 + b'").onmessage = function () { location.reload(); };</script>\n')
+# seconds between keep-alive comments on an idle live-reload stream
+RELOAD_PING = 15
+
+COMPRESSIBLE = ('text/', 'application/javascript', 'application/json', 'image/svg+xml')
+MIN_COMPRESS = 1024
+# precompressed siblings, preferred first
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'no-cache'
+
+# paths skipped when polling for changes
+IGNORED_DIRS = {'__pycache__', '.cache', 'node_modules', 'tests'}
+
+# Files the build writes into the watched folders: variants, hero crops and placeholders
+OUTPUT_RE = re.compile(r'-(thumb|medium|full|\d+w|crop-(?:portrait|square)-\d+)\.(webp|jpg|avif)$|-lqip\.json$')
+DATA = os.path.join(SITE, 'data')
+
+
+class Reloader:
+    """Generation counter the live-reload streams wait on."""
+    def __init__(self):
+        self.generation = 0
+        self.changed = threading.Condition()
+
+    def bump(self):
+        with self.changed:
+            self.generation += 1
+            self.changed.notify_all()
+
+    def wait(self, generation, timeout):
+        """Block until the generation moves past ``generation`` (or ``timeout``); returns the current one."""
+        with self.changed:
+            self.changed.wait_for(lambda: self.generation != generation, timeout)
+            return self.generation
+
+
+def etag_for(st, suffix=''):
+    return f'"{st.st_ino:x}-{st.st_size:x}-{st.st_mtime_ns:x}{suffix}"'
+
+
+def accepts(header, coding):
+    """True when an Accept-Encoding header allows ``coding`` (``q=0`` refuses it)."""
+    for part in (header or '').split(','):
+        name, _, params = part.strip().partition(';')
+        if name.strip().lower() in (coding, '*'):
+            q = params.strip()
+            return not (q.startswith('q=') and float(q[2:] or 0) == 0)
+    return False
+
+
+def parse_range(header, size):
+    """``(start, end)`` (inclusive) for a single ``bytes=`` range; ``None`` to send everything, ``False`` if unsatisfiable."""
+    if not header or not header.startswith('bytes=') or ',' in header:
+        return None  # multiple ranges are allowed to be answered with the whole file
+    first, _, last = header[6:].strip().partition('-')
+    try:
+        if first:
+            start, end = int(first), int(last) if last else size - 1
+        else:
+            start, end = max(0, size - int(last)), size - 1
+    except ValueError:
+        return None
+    if start >= size or start > end:
+        return False
+    return start, min(end, size - 1)
+
+
+@lru_cache(maxsize=256)
+def _compressed(path, etag, inject):
+    """Gzipped body of ``path`` (with the reload script if ``inject``); ``etag`` keys the cache."""
+    return gzip.compress(_read(path, inject), compresslevel=6)
+
+
+def _read(path, inject):
+    with open(path, 'rb') as fh:
+        data = fh.read()
+    if inject:
+        end = data.lower().rfind(b'</body>')
+        data = data[:end] + RELOAD_SCRIPT + data[end:] if end >= 0 else data + RELOAD_SCRIPT
+    return data
+
+
+class Handler(http.server.SimpleHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    extensions_map = dict(http.server.SimpleHTTPRequestHandler.extensions_map,
+                          **{'.webp': 'image/webp', '.avif': 'image/avif', '.js': 'application/javascript',
+                             '.json': 'application/json'})
+    reloader = None
+    quiet = False
+
+    def log_message(self, format, *args):
+        if not self.quiet:
+            super().log_message(format, *args)
+
+    def do_GET(self):
+        if self.reloader and self.path.split('?')[0] == RELOAD_PATH:
+            return self.stream_reloads()
+        super().do_GET()
+
+    def stream_reloads(self):
+        # read before the headers go out, so a rebuild finishing right after the client connects still counts
+        seen = self.reloader.generation
+        self.send_response(HTTPStatus.OK)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-store')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        try:
+            while True:
+                current = self.reloader.wait(seen, RELOAD_PING)
+                self.wfile.write(b'data: reload\n\n' if current != seen else b': ping\n\n')
+                self.wfile.flush()
+                seen = current
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def send_head(self):
+        path = self.translate_path(self.path)
+        if os.path.isdir(path):
+            index = os.path.join(path, 'index.html')
+            if not self.path.split('?')[0].endswith('/') or not os.path.isfile(index):
+                return super().send_head()  # redirect to the slash URL, or a directory listing
+            path = index
+        try:
+            st = os.stat(path)
+        except OSError:
+            self.send_error(HTTPStatus.NOT_FOUND, 'File not found')
+            return None
+
+        ctype = self.guess_type(path)
+        inject = bool(self.reloader) and ctype == 'text/html'
+        accept = self.headers.get('Accept-Encoding')
+        encoding, body_path, etag = None, path, etag_for(st, '-live' if inject else '')
+        if not inject:
+            for coding, ext in ENCODINGS:
+                try:
+                    sibling = os.stat(path + ext)
+                except OSError:
+                    continue
+                if sibling.st_mtime_ns >= st.st_mtime_ns and accepts(accept, coding):
+                    encoding, body_path, etag = coding, path + ext, etag_for(sibling, '-' + coding)
+                    break
+        compress = (encoding is None and ctype.startswith(COMPRESSIBLE) and st.st_size >= MIN_COMPRESS
+                    and accepts(accept, 'gzip'))
+        if compress:
+            encoding, etag = 'gzip', etag[:-1] + '-gzip"'
+
+        if self._not_modified(etag, st):
+            self.send_response(HTTPStatus.NOT_MODIFIED)
+            self._common_headers(path, etag, st)
+            self.end_headers()
+            return None
+
+        if compress:
+            body = _compressed(path, etag, inject)
+        elif encoding or inject:
+            body = _read(body_path, inject)
+        else:
+            body = None
+        size = len(body) if body is not None else st.st_size
+
+        byte_range = None
+        if encoding is None and not inject:
+            if_range = self.headers.get('If-Range')
+            if not if_range or if_range == etag:
+                byte_range = parse_range(self.headers.get('Range'), size)
+        if byte_range is False:
+            self.send_response(HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+            self.send_header('Content-Range', f'bytes */{size}')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return None
+
+        if byte_range:
+            start, end = byte_range
+            with open(body_path, 'rb') as fh:
+                fh.seek(start)
+                body = fh.read(end - start + 1)
+            self.send_response(HTTPStatus.PARTIAL_CONTENT)
+            self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        else:
+            self.send_response(HTTPStatus.OK)
+        self._common_headers(path, etag, st)
+        self.send_header('Content-Type', ctype)
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        elif not inject:
+            self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Length', str(len(body) if body is not None else size))
+        self.end_headers()
+        return io.BytesIO(body) if body is not None else open(body_path, 'rb')
+
+    def _not_modified(self, etag, st):
+        match = self.headers.get('If-None-Match')
+        if match:
+            return match.strip() == '*' or etag in [m.strip() for m in match.split(',')]
+        since = self.headers.get('If-Modified-Since')
+        if since:
+            try:
+                return email.utils.parsedate_to_datetime(since).timestamp() >= int(st.st_mtime)
+            except (TypeError, ValueError, IndexError, OverflowError):
+                return False
+        return False
+
+    def _common_headers(self, path, etag, st):
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', self.date_time_string(st.st_mtime))
+        self.send_header('Cache-Control', IMMUTABLE if is_fingerprinted(path) else REVALIDATE)
+        self.send_header('Vary', 'Accept-Encoding')
+
+
+def make_server(directory=SITE, bind='127.0.0.1', port=8000, reloader=None, quiet=False):
+    """A threaded server for ``directory``; call ``serve_forever()`` on it."""
+    handler = type('SiteHandler', (Handler,), {'reloader': reloader, 'quiet': quiet})
+    return http.server.ThreadingHTTPServer((bind, port), partial(handler, directory=directory))
+
+
+def snapshot(roots):
+    """``{path: (size, mtime_ns)}`` for the files under ``roots`` (symlinked folders not followed)."""
+    files = {}
+    for root in roots:
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames[:] = [d for d in dirnames if d not in IGNORED_DIRS and not d.startswith('.')]
+            for name in filenames:
+                if name.startswith('.'):
+                    continue  # editor swap files and the tools' temporary files
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                files[path] = (st.st_size, st.st_mtime_ns)
+    return files
+
+
+def generated_pages():
+    """Section pages generate-sections.py writes: ``<category>.html`` and ``<category>-<n>.html``."""
+    try:
+        with open(os.path.join(DATA, 'sections.json'), 'r', encoding='utf-8') as fh:
+            keys = list(json.load(fh))
+    except (OSError, ValueError):
+        return None
+    if not keys:
+        return None
+    return re.compile(r'^(%s)(-\d+)?\.html$' % '|'.join(re.escape(k) for k in keys))
+
+
+def is_output(path, pages=None):
+    """True for a file the build writes, whose changes are no reason to build again."""
+    name = os.path.basename(path)
+    if OUTPUT_RE.search(name) or is_fingerprinted(name):
+        return True
+    if path.startswith(DATA + os.sep) and name.endswith('.json'):
+        return True
+    if os.path.dirname(path) == SITE and pages and pages.match(name):
+        return True
+    # JPEGs flattened from a PSD next to them
+    stem, ext = os.path.splitext(path)
+    return ext.lower() == '.jpg' and os.path.exists(stem + '.psd')
+
+
+class Watcher(threading.Thread):
+    """Poll ``roots`` every ``interval`` seconds and call ``on_change(changed_paths)`` after a change.
+
+    Paths for which ``ignore(paths)`` says True (the build's own outputs) never
+    trigger a call.
+    """
+    def __init__(self, roots, interval, on_change, ignore=None):
+        super().__init__(daemon=True)
+        self.roots = roots
+        self.interval = interval
+        self.on_change = on_change
+        self.ignore = ignore or (lambda paths: set())
+        self.stopped = threading.Event()
+
+    def run(self):
+        previous = snapshot(self.roots)
+        while not self.stopped.wait(self.interval):
+            current = snapshot(self.roots)
+            if current == previous:
+                continue
+            changed = sorted(p for p in set(current) | set(previous) if current.get(p) != previous.get(p))
+            # the baseline is taken before the build runs, so edits made while it runs are seen next time
+            previous = current
+            ignored = self.ignore(changed)
+            changed = [p for p in changed if p not in ignored]
+            if changed:
+                self.on_change(changed)
+
+
+def build_outputs(paths):
+    pages = generated_pages()
+    return {p for p in paths if is_output(p, pages)}
+
+
+def rebuild(build_args, reloader):
+    def on_change(changed):
+        shown = ', '.join(os.path.relpath(p, ROOT) for p in changed[:3])
+        print(f"Changed: {shown}{f' (+{len(changed) - 3} more)' if len(changed) > 3 else ''}; rebuilding")
+        result = subprocess.run([sys.executable, BUILD] + build_args, cwd=ROOT)
+        if result.returncode:
+            print(f'Build failed (exit {result.returncode}); pages not reloaded')
+        elif reloader:
+            reloader.bump()
+    return on_change
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', type=int, default=8000, help='port to listen on (default 8000)')
+    parser.add_argument('--bind', default='127.0.0.1', help='address to listen on (default 127.0.0.1)')
+    parser.add_argument('--no-watch', dest='watch', action='store_false',
+                        help='only serve; do not rebuild when images, pages or tools change')
+    parser.add_argument('--no-reload', dest='reload', action='store_false',
+                        help='do not inject the live-reload script into pages')
+    parser.add_argument('--interval', type=float, default=1.0, help='seconds between change checks (default 1)')
+    parser.add_argument('--quiet', action='store_true', help='do not log every request')
+    parser.add_argument('build_args', nargs=argparse.REMAINDER,
+                        help='arguments for tools/build.py, after "--" (e.g. -- --fingerprint)')
+    args = parser.parse_args(argv)
+    build_args = args.build_args[1:] if args.build_args[:1] == ['--'] else args.build_args
+
+    reloader = Reloader() if args.reload else None
+    server = make_server(SITE, args.bind, args.port, reloader, args.quiet)
+    watcher = None
+    if args.watch:
+        watcher = Watcher([os.path.join(ROOT, 'images'), SITE, TOOLS], args.interval, rebuild(build_args, reloader),
+                          ignore=build_outputs)
+        watcher.start()
+    print(f'Serving {SITE} on http://{args.bind}:{server.server_address[1]}/'
+          f"{' (watching for changes)' if watcher else ''}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if watcher:
+            watcher.stopped.set()
+        server.server_close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+import io
+import os
+import sys
+import tempfile
+import contextlib
+import importlib.util
+
+TOOLS = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, TOOLS)
+
+import buildcache  # noqa: E402
+from assetmap import AssetMap, fingerprinted_name, is_fingerprinted  # noqa: E402
+
+
+def load_fingerprint_module():
+    spec = importlib.util.spec_from_file_location('fingerprint_assets', os.path.join(TOOLS, 'fingerprint-assets.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_fingerprinted_names_are_recognised():
+    name = fingerprinted_name('images/dnc/shot-full.jpg', '0123456789abcdef')
+    assert name == 'images/dnc/shot-full.0123456789.jpg'
+    assert is_fingerprinted(name)
+    assert not is_fingerprinted('images/dnc/shot-full.jpg')
+    assert not is_fingerprinted('images/dnc/_MG_3726-full.jpg')
+
+
+def test_srcset_rewrites_only_mapped_urls():
+    assets = AssetMap({'images/a-thumb.webp': 'images/a-thumb.aaaaaaaaaa.webp'})
+    srcset = 'images/a-thumb.webp 600w, images/a-full.webp 1920w'
+    assert assets.srcset(srcset) == 'images/a-thumb.aaaaaaaaaa.webp 600w, images/a-full.webp 1920w'
+    assert assets.url('assets/js/main.js') == 'assets/js/main.js'
+
+
+def test_old_fingerprints_are_kept_until_pruned():
+    fp = load_fingerprint_module()
+    cache_dir = buildcache.CACHE_DIR
+    with tempfile.TemporaryDirectory() as tmp:
+        site = os.path.join(tmp, 'site')
+        os.makedirs(os.path.join(site, 'assets', 'css'))
+        os.makedirs(os.path.join(site, 'data'))
+        css = os.path.join(site, 'assets', 'css', 'styles.css')
+        fp.SITE, fp.MAP_FILE = site, os.path.join(site, 'data', 'assets.json')
+        buildcache.CACHE_DIR = os.path.join(tmp, '.cache')
+
+        def run(*argv):
+            out = io.StringIO()
+            with contextlib.redirect_stdout(out):
+                fp.main(list(argv))
+            return sorted(n for n in os.listdir(os.path.dirname(css)) if is_fingerprinted(n)), out.getvalue()
+
+        try:
+            with open(css, 'w') as fh:
+                fh.write('body { color: red }')
+            (old,), _ = run()
+            with open(css, 'w') as fh:
+                fh.write('body { color: blue }')
+            hashed, out = run()
+            assert old in hashed and len(hashed) == 2
+            assert 'Superseded output: ' in out and old in out
+            hashed, out = run('--prune')
+            assert old not in hashed and len(hashed) == 1 and 'Removed superseded output' in out
+        finally:
+            buildcache.CACHE_DIR = cache_dir
+
+
+if __name__ == '__main__':
+    test_fingerprinted_names_are_recognised()
+    test_srcset_rewrites_only_mapped_urls()
+    test_old_fingerprints_are_kept_until_pruned()
+    print('OK')
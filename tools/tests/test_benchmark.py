@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+import os
+import sys
+import tempfile
+import importlib.util
+
+TOOLS = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, TOOLS)
+
+from buildcache import file_hash  # noqa: E402
+
+
+def load_benchmark_module():
+    spec = importlib.util.spec_from_file_location('benchmark', os.path.join(TOOLS, 'benchmark.py'))
+    module = importlib.util.module_from_spec(spec)
+    # registered so the corpus workers can unpickle its functions
+    sys.modules['benchmark'] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_corpus_is_reproducible():
+    bench = load_benchmark_module()
+    bench.NORMAL_SIZES = ((160, 120), (120, 160))
+    bench.HUGE_SIZE = (400, 300)
+    with tempfile.TemporaryDirectory() as a, tempfile.TemporaryDirectory() as b:
+        first = bench.make_corpus(a, 5, huge=1, seed=3)
+        second = bench.make_corpus(b, 5, huge=1, seed=3)
+        assert [os.path.relpath(p, a) for p in first] == [os.path.relpath(p, b) for p in second]
+        assert [file_hash(p) for p in first] == [file_hash(p) for p in second]
+        assert {os.path.splitext(p)[1] for p in first} == {'.jpg', '.png', '.tiff'}
+        assert any('/originals/' in p for p in first) and not all('/originals/' in p for p in first)
+
+        # rendered again in this process, after other images, a source still comes out the same
+        once = bench.write_source((os.path.join(a, 'once.png'), (160, 120), 'png', '3-4'))
+        bench.write_source((os.path.join(a, 'other.png'), (120, 160), 'png', '3-5'))
+        again = bench.write_source((os.path.join(a, 'again.png'), (160, 120), 'png', '3-4'))
+        assert file_hash(once) == file_hash(again)
+
+
+def test_only_growth_beyond_threshold_and_noise_is_a_regression():
+    bench = load_benchmark_module()
+    baseline = {'steps': {'optimize-images': {'cold': {'wall_s': 10.0, 'cpu_s': 9.0, 'max_rss_kib': 100000},
+                                              'warm': {'wall_s': 0.10, 'cpu_s': 0.10}}}}
+    report = {'steps': {'optimize-images': {'cold': {'wall_s': 11.5, 'cpu_s': 9.5, 'max_rss_kib': 90000},
+                                            'warm': {'wall_s': 0.13, 'cpu_s': 0.10}},
+                        'generate-sections': {'cold': {'wall_s': 1.0}}}}
+    assert bench.compare(report, baseline, 10) == [('optimize-images', 'cold', 'wall_s', 10.0, 11.5)]
+    assert bench.compare(report, baseline, 20) == []
+
+
+if __name__ == '__main__':
+    test_corpus_is_reproducible()
+    test_only_growth_beyond_threshold_and_noise_is_a_regression()
+    print('OK')
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import build  # noqa: E402
+
+
+def test_units_run_after_their_dependencies_and_explain_why():
+    opts = argparse.Namespace(avif=False, adaptive=False, prune=False, fingerprint=True)
+    units = build.plan(opts)
+    order = [u.name for u in units]
+    for unit in units:
+        assert all(order.index(dep) < order.index(unit.name) for dep in unit.after)
+    by_name = {u.name: u for u in units}
+    assert by_name['list-crops'].after == ['fingerprint-assets']
+    assert '--fingerprint' in by_name['generate-sections'].argv
+    # every tool imports tracing, so editing it reruns the steps
+    assert 'tools/tracing.py' in build.snapshot(by_name['generate-sections'], opts)
+
+    unit = build.Unit('optimize-originals:dnc', 'optimize-originals.py', 'dnc', ['--category', 'dnc'], [])
+    assert build.reasons(unit, None, {}) == ['never built']
+    previous = {'argv': ['--category', 'dnc'], 'outputs': ['images/dnc/gone-thumb.jpg'],
+                'inputs': {'a.jpg': [1, 1], 'b.jpg': [2, 2], 'c.jpg': [3, 3]}}
+    assert build.reasons(unit, previous, dict(previous['inputs'])) == [
+        '1 output(s) missing: images/dnc/gone-thumb.jpg']
+    why = build.reasons(unit._replace(argv=['--category', 'dnc', '--avif']), dict(previous, outputs=[]),
+                        {'a.jpg': [1, 1], 'b.jpg': [2, 5], 'd.jpg': [4, 4]})
+    assert why == ["options changed: '--category dnc' -> '--category dnc --avif'",
+                   '1 new input(s): d.jpg', '1 changed input(s): b.jpg', '1 removed input(s): c.jpg']
+
+
+def test_units_run_in_their_own_process_and_stream_their_output():
+    tools = build.TOOLS
+    with tempfile.TemporaryDirectory() as tmp:
+        with open(os.path.join(tmp, 'slow.py'), 'w') as fh:
+            fh.write('import sys, time\nprint("started")\ntime.sleep(1)\nprint("oops", file=sys.stderr)\nsys.exit(2)\n')
+        lines = []
+        build.TOOLS = tmp
+        try:
+            start = time.perf_counter()
+            ok, info = build.run_unit('slow.py', [], lambda line: lines.append((line, time.perf_counter() - start)))
+        finally:
+            build.TOOLS = tools
+
+    assert not ok and info['seconds'] >= 1
+    assert [line for line, _ in lines] == ['started', 'oops']
+    # printed while the tool was still running, not when it exited
+    assert lines[0][1] < 0.9
+
+
+if __name__ == '__main__':
+    test_units_run_after_their_dependencies_and_explain_why()
+    test_units_run_in_their_own_process_and_stream_their_output()
+    print('OK')
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from buildcache import BuildCache, replace_file  # noqa: E402
+
+
+def test_fresh_until_source_or_output_changes():
+    with tempfile.TemporaryDirectory() as tmp:
+        src = os.path.join(tmp, 'a.jpg')
+        out = os.path.join(tmp, 'a-thumb.jpg')
+        with open(src, 'wb') as fh:
+            fh.write(b'source')
+        with open(out, 'wb') as fh:
+            fh.write(b'output')
+
+        cache_path = os.path.join(tmp, 'cache.json')
+        cache = BuildCache('test', path=cache_path)
+        assert not cache.is_fresh(src, 'settings')
+        cache.record(src, 'settings', [out])
+        assert cache.is_fresh(src, 'settings')
+        assert not cache.is_fresh(src, 'other-settings')
+
+        # touching without changing content keeps the entry fresh
+        st = os.stat(src)
+        os.utime(src, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+        assert cache.is_fresh(src, 'settings')
+
+        # a modified output forces a rebuild
+        with open(out, 'ab') as fh:
+            fh.write(b'!')
+        assert not cache.is_fresh(src, 'settings')
+        cache.record(src, 'settings', [out])
+        cache.save()
+
+        reloaded = BuildCache('test', path=cache_path)
+        assert reloaded.is_fresh(src, 'settings')
+
+        with open(src, 'wb') as fh:
+            fh.write(b'edited')
+        assert not reloaded.is_fresh(src, 'settings')
+
+        os.remove(src)
+        stale = reloaded.stale_outputs()
+        assert len(stale) == 1
+        assert stale[0][1] == [reloaded.key(out)]
+
+
+def test_runs_over_different_sources_merge_on_save():
+    with tempfile.TemporaryDirectory() as tmp:
+        sources = []
+        for name in ('a.jpg', 'b.jpg', 'c.jpg'):
+            sources.append(os.path.join(tmp, name))
+            with open(sources[-1], 'wb') as fh:
+                fh.write(name.encode())
+        cache_path = os.path.join(tmp, 'cache.json')
+        seed = BuildCache('test', path=cache_path)
+        seed.record(sources[2], 'settings', [])
+        seed.save()
+
+        # two runs (e.g. two categories) load the same file, then save one after the other
+        first, second = BuildCache('test', path=cache_path), BuildCache('test', path=cache_path)
+        first.record(sources[0], 'settings', [])
+        first.forget(first.key(sources[2]))
+        second.record(sources[1], 'settings', [])
+        first.save()
+        second.save()
+
+        merged = BuildCache('test', path=cache_path)
+        assert merged.is_fresh(sources[0], 'settings') and merged.is_fresh(sources[1], 'settings')
+        assert merged.get(sources[2]) is None
+
+
+def test_replaced_files_are_world_readable_without_touching_the_umask():
+    old = os.umask(0o077)
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'out.json')
+            replace_file(path, b'{}')
+            assert os.stat(path).st_mode & 0o777 == 0o644
+            assert sorted(os.listdir(tmp)) == ['out.json']
+        assert os.umask(0o077) == 0o077
+    finally:
+        os.umask(old)
+
+
+if __name__ == '__main__':
+    test_fresh_until_source_or_output_changes()
+    test_runs_over_different_sources_merge_on_save()
+    test_replaced_files_are_world_readable_without_touching_the_umask()
+    print('OK')
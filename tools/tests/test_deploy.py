@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+import os
+import sys
+import gzip
+import json
+import tempfile
+import importlib.util
+
+TOOLS = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, TOOLS)
+
+
+def load_deploy_module():
+    spec = importlib.util.spec_from_file_location('deploy_bundle', os.path.join(TOOLS, 'deploy-bundle.py'))
+    module = importlib.util.module_from_spec(spec)
+    # registered so the compression workers can unpickle its functions
+    sys.modules['deploy_bundle'] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def write(root, rel, data):
+    path = os.path.join(root, rel)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as fh:
+        fh.write(data.encode() if isinstance(data, str) else data)
+
+
+def test_bundle_keeps_only_referenced_files_and_precompresses_text():
+    deploy = load_deploy_module()
+    with tempfile.TemporaryDirectory() as tmp:
+        site, out = os.path.join(tmp, 'site'), os.path.join(tmp, 'out')
+        write(site, 'index.html', '<link rel="stylesheet" href="assets/css/styles.css"><a href="dnc.html">dnc</a>'
+                                  + '<p>portfolio</p>' * 50)
+        write(site, 'dnc.html', '<img src="images/dnc/a-thumb.jpg" srcset="images/dnc/a-thumb.jpg 600w, '
+                                'images/dnc/a-full.jpg 1200w"><a href="https://example.com/">x</a>')
+        write(site, 'assets/css/styles.css', 'body { background: url("../img/bg.png"); }' + ' ' * 300)
+        write(site, 'assets/img/bg.png', b'png')
+        shard = {'base': 'images/dnc/', 'srcset_keys': ['srcset_webp'],
+                 'items': [{'id': 'a', 'srcset_webp': 'a-thumb.webp 600w, a-full.webp 1200w', 'alt': 'a, b'}]}
+        write(site, 'data/index.json', json.dumps({'sections': {'dnc': {'base': 'images/dnc/', 'count': 1}}}))
+        write(site, 'data/sections/dnc.json', json.dumps(shard))
+        for name in ('a-thumb.jpg', 'a-full.jpg', 'a-thumb.webp', 'a-full.webp', 'a-medium.jpg', 'a-focus.txt',
+                     '.DS_Store'):
+            write(site, f'images/dnc/{name}', name)
+        write(site, 'images/originals/dnc/a.jpg', 'original')
+        deploy.SITE = site
+
+        assert deploy.main(['--out', out, '--report', os.path.join(tmp, 'sizes.json'), '-j', '1']) == 0
+        bundled = {os.path.relpath(os.path.join(d, n), out) for d, _, names in os.walk(out) for n in names}
+        assert {'images/dnc/a-full.webp', 'images/dnc/a-thumb.jpg', 'assets/img/bg.png', 'data/sections/dnc.json'} <= bundled
+        assert not {'images/dnc/a-medium.jpg', 'images/dnc/a-focus.txt', 'images/dnc/.DS_Store',
+                    'images/originals/dnc/a.jpg'} & bundled
+        assert os.stat(os.path.join(out, 'images/dnc/a-full.jpg')).st_ino == \
+            os.stat(os.path.join(site, 'images/dnc/a-full.jpg')).st_ino
+        with gzip.open(os.path.join(out, 'index.html.gz')) as fh, open(os.path.join(site, 'index.html'), 'rb') as src:
+            assert fh.read() == src.read()
+        with open(os.path.join(tmp, 'sizes.json')) as fh:
+            report = json.load(fh)['categories']
+        assert report['dnc']['files'] == 6 and report['dnc']['images_bytes'] > 0
+
+        # a page that stops referencing a file drops it from the bundle on the next run
+        write(site, 'dnc.html', '<img src="images/dnc/a-thumb.jpg">')
+        assert deploy.main(['--out', out, '--report', os.path.join(tmp, 'sizes.json'), '-j', '1']) == 0
+        assert not os.path.exists(os.path.join(out, 'images/dnc/a-full.jpg'))
+        assert os.path.exists(os.path.join(out, 'images/dnc/a-full.webp'))
+
+
+if __name__ == '__main__':
+    test_bundle_keeps_only_referenced_files_and_precompresses_text()
+    print('OK')
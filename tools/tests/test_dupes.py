@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+import os
+import sys
+import random
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from PIL import Image, ImageDraw  # noqa: E402
+
+import dupes  # noqa: E402
+
+
+def test_index_matches_brute_force():
+    rng = random.Random(7)
+    hashes = {f'k{i}': rng.getrandbits(64) for i in range(300)}
+    # a few near copies with 1-3 flipped bits
+    for i in range(20):
+        h = hashes[f'k{i}']
+        for bit in rng.sample(range(64), rng.randint(1, 3)):
+            h ^= 1 << bit
+        hashes[f'near{i}'] = h
+    index = dupes.HammingIndex()
+    for key, h in hashes.items():
+        index.add(key, h)
+    for probe in list(hashes.values())[:50]:
+        expected = {k for k, h in hashes.items() if dupes.distance(h, probe) <= 6}
+        assert {k for k, _ in index.near(probe, 6)} == expected
+
+
+def test_reencoded_copy_clusters_with_original():
+    img = Image.linear_gradient('L').resize((400, 300)).convert('RGB')
+    ImageDraw.Draw(img).ellipse((100, 50, 250, 200), fill=(200, 30, 30))
+    other = Image.linear_gradient('L').rotate(90).resize((400, 300)).convert('RGB')
+    hashes = {
+        'shot': dupes.dhash(img),
+        'shot-2': dupes.dhash(img.resize((200, 150))),
+        'other': dupes.dhash(other),
+    }
+    groups = dupes.clusters(hashes)
+    assert groups == [['shot', 'shot-2']]
+    assert dupes.representative(groups[0]) == 'shot'
+    assert dupes.representative(groups[0], preferred={'shot-2'}) == 'shot-2'
+
+
+def test_clusters_do_not_chain_frames_that_are_not_alike():
+    # a burst: each frame is 4 bits from the previous one, the first and the last 8 apart
+    a = 0
+    b = a ^ 0b1111
+    c = b ^ 0b11110000
+    hashes = {'a': a, 'b': b, 'c': c}
+    assert dupes.clusters(hashes, threshold=6) == [['a', 'b']]
+    # the kept member is the centre, so every dropped one is within the threshold of it
+    assert dupes.clusters(hashes, threshold=6, preferred={'b'}) == [['a', 'b', 'c']]
+    for preferred in ((), {'c'}):
+        for group in dupes.clusters(hashes, threshold=6, preferred=preferred):
+            keep = dupes.representative(group, preferred)
+            assert all(dupes.distance(hashes[k], hashes[keep]) <= 6 for k in group)
+
+
+if __name__ == '__main__':
+    test_index_matches_brute_force()
+    test_reencoded_copy_clusters_with_original()
+    test_clusters_do_not_chain_frames_that_are_not_alike()
+    print('OK')
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+import os
+import sys
+import tempfile
+import unittest
+import importlib.util
+
+TOOLS = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, TOOLS)
+
+from PIL import ExifTags, Image, ImageCms  # noqa: E402
+
+import imaging  # noqa: E402
+from catalog import parse_focus  # noqa: E402
+
+SIZES = [
+    ('thumb', 600, 80),
+    ('medium', 1200, 85),
+    ('full', 1920, 90),
+]
+
+
+def _write_source(path, size):
+    img = Image.linear_gradient('L').resize(size).convert('RGB')
+    img.save(path, 'JPEG', quality=95)
+
+
+def test_ladder_dimensions_match_direct_resize():
+    with tempfile.TemporaryDirectory() as tmp:
+        src = os.path.join(tmp, 'wide.jpg')
+        _write_source(src, (4000, 2667))
+        ok, log, _ = imaging.write_variants(src, tmp, 'wide', SIZES)
+        assert ok, log
+        for name, width, _ in SIZES:
+            for ext in ('webp', 'jpg'):
+                with Image.open(os.path.join(tmp, f'wide-{name}.{ext}')) as out:
+                    assert out.size == imaging.target_size((4000, 2667), width)
+
+
+def test_small_originals_are_not_upscaled():
+    with tempfile.TemporaryDirectory() as tmp:
+        src = os.path.join(tmp, 'small.jpg')
+        _write_source(src, (900, 1200))
+        ok, log, _ = imaging.write_variants(src, tmp, 'small', SIZES)
+        assert ok, log
+        with Image.open(os.path.join(tmp, 'small-full.jpg')) as out:
+            assert out.size == (900, 1200)
+        with Image.open(os.path.join(tmp, 'small-thumb.webp')) as out:
+            assert out.size == (600, 800)
+
+
+@unittest.skipUnless(imaging.avif_supported(), 'Pillow was built without AVIF support')
+def test_avif_quality_is_searched_once_then_reused():
+    with tempfile.TemporaryDirectory() as tmp:
+        src = os.path.join(tmp, 'shot.jpg')
+        _write_source(src, (800, 600))
+        sizes = SIZES[:1]
+        ok, log, info = imaging.write_variants(src, tmp, 'shot', sizes, avif={'ssim': 0.95, 'qualities': {}})
+        assert ok, log
+        quality = info['avif_qualities']['thumb']
+        assert quality in imaging.AVIF_QUALITIES
+        with Image.open(os.path.join(tmp, 'shot-thumb.avif')) as out, \
+                Image.open(os.path.join(tmp, 'shot-thumb.webp')) as ref:
+            assert out.size == (600, 450)
+            assert imaging.ssim(ref, out) >= 0.9
+        # a cached quality is encoded as-is, without searching
+        ok, log, info = imaging.write_variants(src, tmp, 'shot', sizes, avif={'ssim': 0.95, 'qualities': {'thumb': 35}})
+        assert ok and info['avif_qualities'] == {'thumb': 35}
+
+
+def test_adaptive_ladder_steps_by_bytes_and_is_reused():
+    with tempfile.TemporaryDirectory() as tmp:
+        src = os.path.join(tmp, 'busy.jpg')
+        Image.effect_noise((1600, 1000), 60).convert('RGB').save(src, 'JPEG', quality=95)
+        adaptive = imaging.adaptive_options(imaging.adaptive_settings(step=40 * 1024, max_width=1400))
+        ok, log, info = imaging.write_variants(src, tmp, 'busy', SIZES, adaptive=adaptive)
+        assert ok, log
+        widths = info['widths']
+        assert widths[0] == imaging.ADAPTIVE_MIN_WIDTH and widths[-1] == 1400 and len(widths) > 3
+        assert widths == sorted(set(widths))
+        with Image.open(os.path.join(tmp, 'busy-full.webp')) as out:
+            assert out.size == (1400, 875)
+        names = [name for name, _, _ in info['sizes']]
+        assert names[0] == 'thumb' and 'medium' not in names
+        for width in widths[:-1]:
+            assert os.path.exists(os.path.join(tmp, f'busy-{width}w.jpg'))
+        # known widths from the build cache are written as they are
+        ok, log, again = imaging.write_variants(src, tmp, 'busy', SIZES, adaptive=dict(adaptive, widths=[320, 1400]))
+        assert ok and again['sizes'] == [('thumb', 600, 80), ('320w', 320, 80), ('full', 1400, 90)]
+
+
+def test_sources_are_turned_upright_and_stripped_of_metadata():
+    with tempfile.TemporaryDirectory() as tmp:
+        src = os.path.join(tmp, 'rotated.jpg')
+        exif = Image.Exif()
+        exif[ExifTags.Base.Orientation] = 6  # stored landscape, shown portrait
+        exif[ExifTags.Base.Copyright] = 'K. Dukstein'
+        exif[ExifTags.Base.Model] = 'Camera'
+        srgb = ImageCms.ImageCmsProfile(ImageCms.createProfile('sRGB')).tobytes()
+        img = Image.linear_gradient('L').resize((1600, 1200)).convert('RGB')
+        img.save(src, 'JPEG', exif=exif.tobytes(), icc_profile=srgb)
+        ok, log, info = imaging.write_variants(src, tmp, 'rotated', SIZES, keep_exif=['Copyright'])
+        assert ok, log
+        with Image.open(os.path.join(tmp, 'rotated-full.jpg')) as out:
+            assert out.size == (1200, 1600)
+            assert 'icc_profile' not in out.info
+            kept = out.getexif()
+            assert kept.get(ExifTags.Base.Copyright) == 'K. Dukstein'
+            assert ExifTags.Base.Model not in kept and ExifTags.Base.Orientation not in kept
+        with Image.open(os.path.join(tmp, 'rotated-thumb.webp')) as out:
+            assert out.size == (600, 800)
+        # sRGB needs no conversion; what is reported is what changed
+        assert info['normalized'] == ['metadata', 'rotated']
+        assert imaging.normalized_summary({'metadata': 1, 'rotated': 1}, 1) == \
+            'Normalized 1 sources: 1 rotated upright, 0 converted to sRGB, 1 stripped of EXIF/XMP/ICC'
+
+
+def test_resize_quality_check_turns_rotated_sources_upright():
+    path = os.path.join(TOOLS, 'check-resize-quality.py')
+    spec = importlib.util.spec_from_file_location('check_resize_quality', path)
+    check = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(check)
+    with tempfile.TemporaryDirectory() as tmp:
+        src = os.path.join(tmp, 'portrait.jpg')
+        exif = Image.Exif()
+        exif[ExifTags.Base.Orientation] = 6
+        Image.linear_gradient('L').resize((3000, 2000)).convert('RGB').save(src, 'JPEG', quality=95, exif=exif)
+        ref, new = check.reference_variants(src), check.cascade_variants(src)
+
+    assert ref['thumb'].size == new['thumb'].size == (600, 900)
+    for name, _, _ in check.SIZES:
+        assert check.psnr(ref[name], new[name]) > 38, name
+
+
+def test_focus_box_keeps_the_focus_point_in_frame():
+    # landscape 1600x900 cut to 4:5: full height, 720 wide
+    assert imaging.focus_box((1600, 900), 4 / 5) == (440, 0, 1160, 900)
+    assert imaging.focus_box((1600, 900), 4 / 5, parse_focus('left')) == (0, 0, 720, 900)
+    assert imaging.focus_box((1600, 900), 4 / 5, parse_focus('90% 10%')) == (880, 0, 1600, 900)
+    assert imaging.focus_box((900, 1600), 1.0, parse_focus('top')) == (0, 0, 900, 900)
+    assert parse_focus('somewhere') is None
+
+
+if __name__ == '__main__':
+    test_ladder_dimensions_match_direct_resize()
+    test_small_originals_are_not_upscaled()
+    try:
+        test_avif_quality_is_searched_once_then_reused()
+    except unittest.SkipTest as e:
+        print(f'skipped test_avif_quality_is_searched_once_then_reused: {e}')
+    test_adaptive_ladder_steps_by_bytes_and_is_reused()
+    test_sources_are_turned_upright_and_stripped_of_metadata()
+    test_resize_quality_check_turns_rotated_sources_upright()
+    test_focus_box_keeps_the_focus_point_in_frame()
+    print('OK')
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+import io
+import os
+import sys
+import json
+import tempfile
+import contextlib
+import importlib.util
+from pathlib import Path
+
+TOOLS = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, TOOLS)
+
+from PIL import Image  # noqa: E402
+
+from catalog import FileInfoCache  # noqa: E402
+
+
+def load_manifest_module():
+    spec = importlib.util.spec_from_file_location('generate_manifest', os.path.join(TOOLS, 'generate-manifest.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_srcset_uses_real_widths_and_records_dimensions():
+    gm = load_manifest_module()
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        cat_dir = root / 'images' / 'dnc'
+        cat_dir.mkdir(parents=True)
+        # a 1000px original: medium and full are clamped to 1000
+        for name, size in (('thumb', (600, 400)), ('medium', (1000, 667)), ('full', (1000, 667))):
+            img = Image.new('RGB', size, (120, 90, 60))
+            img.save(cat_dir / f'shot-{name}.webp', 'WEBP')
+            img.save(cat_dir / f'shot-{name}.jpg', 'JPEG')
+        (cat_dir / 'shot-focus.txt').write_text('30 40\n')
+
+        gm.ROOT = root
+        info = FileInfoCache(root / 'info.json')
+        gm.find_images(cat_dir, info=info)
+        info.save()
+        items = gm.find_images(cat_dir, info=FileInfoCache(root / 'info.json'))
+        # a placeholder from the optimizers' -lqip.json lands in the same key order as a cached one
+        lqip = {'placeholder': items[0]['placeholder'], 'color': items[0]['color']}
+        (cat_dir / 'shot-lqip.json').write_text(json.dumps(lqip))
+        again = gm.find_images(cat_dir, info=FileInfoCache(root / 'info.json'))
+        assert json.dumps(again) == json.dumps(items)
+
+    assert len(items) == 1
+    item = items[0]
+    assert item['srcset_webp'] == 'images/dnc/shot-thumb.webp 600w, images/dnc/shot-full.webp 1000w'
+    assert item['srcset_jpg'] == 'images/dnc/shot-thumb.jpg 600w, images/dnc/shot-full.jpg 1000w'
+    assert (item['width'], item['height']) == (1000, 667)
+    assert item['hero'] is True
+    assert item['object_position'] == {'position': '30% 40%'}
+    assert item['placeholder'].startswith('data:image/webp;base64,')
+    color = tuple(int(item['color'][i:i + 2], 16) for i in (1, 3, 5))
+    assert all(abs(a - b) <= 3 for a, b in zip(color, (120, 90, 60))), item['color']
+    assert 'srcset_avif' not in item
+
+
+def test_avif_variants_get_their_own_srcset():
+    gm = load_manifest_module()
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        cat_dir = root / 'images' / 'dnc'
+        cat_dir.mkdir(parents=True)
+        for name, size in (('thumb', (600, 400)), ('full', (1920, 1280))):
+            img = Image.new('RGB', size, (10, 20, 30))
+            img.save(cat_dir / f'shot-{name}.webp', 'WEBP')
+            (cat_dir / f'shot-{name}.avif').write_bytes(b'')
+        gm.ROOT, gm.IMAGES = root, root / 'images'
+        items = gm.find_images(cat_dir, info=FileInfoCache(root / 'info.json'))
+        shard = gm.compact_section('dnc', items)
+
+    assert items[0]['srcset_avif'] == 'images/dnc/shot-thumb.avif 600w, images/dnc/shot-full.avif 1920w'
+    assert items[0]['full_avif'] == 'images/dnc/shot-full.avif'
+    assert 'srcset_avif' in shard['srcset_keys'] and 'full_avif' in shard['path_keys']
+
+
+def test_adaptive_breakpoints_join_the_srcset_in_width_order():
+    gm = load_manifest_module()
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        cat_dir = root / 'images' / 'dnc'
+        cat_dir.mkdir(parents=True)
+        for name, size in (('thumb', (600, 400)), ('320w', (320, 213)), ('980w', (980, 653)), ('full', (1400, 933))):
+            Image.new('RGB', size, (10, 20, 30)).save(cat_dir / f'shot-{name}.webp', 'WEBP')
+        gm.ROOT, gm.IMAGES = root, root / 'images'
+        items = gm.find_images(cat_dir, info=FileInfoCache(root / 'info.json'))
+
+    assert [item['id'] for item in items] == ['shot']
+    assert items[0]['srcset_webp'] == ('images/dnc/shot-320w.webp 320w, images/dnc/shot-thumb.webp 600w, '
+                                       'images/dnc/shot-980w.webp 980w, images/dnc/shot-full.webp 1400w')
+
+
+def use_tree(gm, root):
+    """Point the generator at a scratch tree with two categories."""
+    gm.ROOT, gm.IMAGES, gm.OUT = root, root / 'images', root / 'site' / 'data'
+    gm.STATE_FILE, gm.FILE_INFO_FILE = root / 'state.json', root / 'info.json'
+    gm.CATEGORIES = ['dnc', 'misc']
+    for cat in gm.CATEGORIES:
+        (root / 'images' / cat).mkdir(parents=True)
+        for name, size in (('thumb', (600, 400)), ('full', (1200, 800))):
+            Image.new('RGB', size, (10, 20, 30)).save(root / 'images' / cat / f'{cat}-shot-{name}.webp', 'WEBP')
+
+
+def test_shards_and_index_hold_paths_relative_to_their_base():
+    gm = load_manifest_module()
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        use_tree(gm, root)
+        with contextlib.redirect_stdout(io.StringIO()):
+            gm.main([])
+        data = root / 'site' / 'data'
+        shard = json.loads((data / 'sections' / 'dnc.json').read_text())
+        index = json.loads((data / 'index.json').read_text())
+        full = json.loads((data / 'sections.json').read_text())
+        assert sorted(p.name for p in data.rglob('*')) == ['dnc.json', 'index.json', 'misc.json',
+                                                         'sections', 'sections.json']
+
+    assert shard['base'] == 'images/dnc/' and 'full_webp' in shard['path_keys']
+    assert shard['items'][0]['full_webp'] == 'dnc-shot-full.webp'
+    assert shard['items'][0]['srcset_webp'] == 'dnc-shot-thumb.webp 600w, dnc-shot-full.webp 1200w'
+    assert full['dnc'][0]['full_webp'] == 'images/dnc/dnc-shot-full.webp'
+    assert index['sections']['misc']['count'] == 1 and index['sections']['misc']['base'] == 'images/misc/'
+    assert index['sections']['dnc']['cover']['id'] == 'dnc-shot'
+
+
+def test_incremental_runs_rescan_only_categories_that_changed():
+    gm = load_manifest_module()
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        use_tree(gm, root)
+        focus = root / 'images' / 'misc' / 'misc-shot-focus.txt'
+        focus.write_text('left\n')
+
+        def run():
+            out = io.StringIO()
+            with contextlib.redirect_stdout(out):
+                gm.main(['--incremental'])
+            return next(line for line in out.getvalue().splitlines() if line.startswith('Rescanned'))
+
+        assert run() == 'Rescanned 2 of 2 categories: dnc, misc'
+        assert run() == 'Rescanned 0 of 2 categories: none'
+
+        # a new image changes the folder; an edited focus file only its own mtime
+        Image.new('RGB', (600, 400)).save(root / 'images' / 'dnc' / 'dnc-two-thumb.webp', 'WEBP')
+        st = os.stat(root / 'images' / 'dnc')
+        os.utime(root / 'images' / 'dnc', ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+        assert run() == 'Rescanned 1 of 2 categories: dnc'
+        focus.write_text('right\n')
+        st = os.stat(focus)
+        os.utime(focus, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+        assert run() == 'Rescanned 1 of 2 categories: misc'
+
+        manifest = json.loads((root / 'site' / 'data' / 'sections.json').read_text())
+        assert [it['id'] for it in manifest['dnc']] == ['dnc-shot', 'dnc-two']
+        assert manifest['misc'][0]['object_position'] == {'position': 'right'}
+
+
+if __name__ == '__main__':
+    test_srcset_uses_real_widths_and_records_dimensions()
+    test_avif_variants_get_their_own_srcset()
+    test_adaptive_breakpoints_join_the_srcset_in_width_order()
+    test_shards_and_index_hold_paths_relative_to_their_base()
+    test_incremental_runs_rescan_only_categories_that_changed()
+    print('OK')
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+import io
+import os
+import sys
+import tempfile
+import contextlib
+import importlib.util
+
+from PIL import Image
+from psd_tools import PSDImage
+from psd_tools.api.layers import PixelLayer
+from psd_tools.constants import Resource
+from psd_tools.psd.image_data import ImageData
+
+TOOLS = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, TOOLS)
+
+import buildcache  # noqa: E402
+
+RED, BLUE = (200, 10, 10), (10, 10, 200)
+
+
+def load_convert_module():
+    spec = importlib.util.spec_from_file_location('convert_psds', os.path.join(TOOLS, 'convert-psds.py'))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules['convert_psds'] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def write_psd(path, writer, size=(64, 48)):
+    """A PSD whose layer is blue but whose stored merged image is a stale black."""
+    psd = PSDImage.frompil(Image.new('RGB', size, RED))
+    psd.append(PixelLayer.frompil(Image.new('RGB', size, BLUE), psd))
+    buf = io.BytesIO()
+    psd.save(buf)
+    buf.seek(0)
+    record = PSDImage.open(buf)._record
+    record.image_data = ImageData.new(record.header, color=0)
+    record.image_resources.get_data(Resource.VERSION_INFO).writer = writer
+    with open(path, 'wb') as fh:
+        record.write(fh)
+
+
+def test_stale_merged_image_is_only_trusted_from_photoshop():
+    convert = load_convert_module()
+    with tempfile.TemporaryDirectory() as tmp:
+        for writer, method, colour in (('psd-tools 1.25.0', 'composite', BLUE),
+                                       ('Adobe Photoshop', 'preview', (0, 0, 0))):
+            path = os.path.join(tmp, 'a.psd')
+            write_psd(path, writer)
+            image, used = convert.flatten(PSDImage.open(path))
+            assert (used, image.getpixel((5, 5))) == (method, colour)
+
+
+def test_strips_fit_what_the_canvas_leaves_of_the_budget():
+    convert = load_convert_module()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'a.psd')
+        write_psd(path, 'psd-tools 1.25.0', size=(64, 300))
+        psd = PSDImage.open(path)
+        canvas = 64 * 300 * convert.CANVAS_BYTES_PER_PIXEL
+        viewports = []
+        composite = psd.composite
+        psd.composite = lambda viewport, **kw: viewports.append(viewport) or composite(viewport=viewport, **kw)
+        image, used = convert.flatten(psd, budget=canvas + 100 * 64 * convert.COMPOSITE_BYTES_PER_PIXEL)
+        assert used == 'strips' and image.size == (64, 300)
+        assert viewports == [(0, 0, 64, 100), (0, 100, 64, 200), (0, 200, 64, 300)]
+        assert image.getpixel((5, 5)) == image.getpixel((5, 299)) == BLUE
+
+
+def test_converted_psds_are_cached():
+    convert = load_convert_module()
+    cache_dir = buildcache.CACHE_DIR
+    with tempfile.TemporaryDirectory() as tmp:
+        folder = os.path.join(tmp, 'originals', 'dnc')
+        os.makedirs(folder)
+        write_psd(os.path.join(folder, 'a.psd'), 'psd-tools 1.25.0')
+        convert.ORIGINALS_ROOT = os.path.join(tmp, 'originals')
+        buildcache.CACHE_DIR = tmp
+        out = io.StringIO()
+        try:
+            with contextlib.redirect_stdout(out):
+                convert.main(['-j', '1'])
+                convert.main(['-j', '1'])
+        finally:
+            buildcache.CACHE_DIR = cache_dir
+        assert '1 converted, 0 cached' in out.getvalue() and '0 converted, 1 cached' in out.getvalue()
+        with Image.open(os.path.join(folder, 'a.jpg')) as jpg:
+            assert all(abs(a - b) < 8 for a, b in zip(jpg.getpixel((5, 5)), BLUE))
+
+
+if __name__ == '__main__':
+    test_stale_merged_image_is_only_trusted_from_photoshop()
+    test_strips_fit_what_the_canvas_leaves_of_the_budget()
+    test_converted_psds_are_cached()
+    print('OK')
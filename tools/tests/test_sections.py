@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import tempfile
+import importlib.util
+from pathlib import Path
+
+TOOLS = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, TOOLS)
+
+from assetmap import AssetMap  # noqa: E402
+
+
+def load_sections_module():
+    spec = importlib.util.spec_from_file_location('generate_sections', os.path.join(TOOLS, 'generate-sections.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_pages_render_in_one_pass_and_only_when_inputs_change():
+    gs = load_sections_module()
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp) / 'site'
+        (root / 'data').mkdir(parents=True)
+        item = {'id': 'shot', 'alt': 'shot', 'hero': True, 'thumb_jpg': 'images/dnc/shot-thumb.jpg',
+                'full_jpg': 'images/dnc/shot-full.jpg', 'srcset_jpg': 'images/dnc/shot-thumb.jpg 600w'}
+        data = {'dnc': [item], 'misc': []}
+        (root / 'data' / 'sections.json').write_text(json.dumps(data))
+        gs.ROOT, gs.DATA, gs.STATE_FILE = root, root / 'data' / 'sections.json', Path(tmp) / 'state.json'
+
+        gs.main([])
+        page = (root / 'dnc.html').read_text()
+        assert 'href="/' not in page and 'href="index.html"' in page
+        assert '<li><a href="misc.html">Misc Work</a></li>' in page
+        assert gs.FIELD_RE.search(page) is None
+        assert 'data-base="shot"' in page
+        # the hero is the LCP element: responsive, eager and preloaded, with header/hero CSS inlined
+        assert 'srcset="images/dnc/shot-thumb.jpg 600w" sizes="100vw"' in page
+        assert 'loading="eager"' in page and 'fetchpriority="high"' in page and 'loading="lazy" class="hero' not in page
+        assert '<link rel="preload" as="image" type="image/jpeg" imagesrcset="images/dnc/shot-thumb.jpg 600w"' in page
+        assert '<style>' in page and '.site-header{' in page and '.grid{' not in page
+
+        mtimes = {p.name: p.stat().st_mtime_ns for p in root.glob('*.html')}
+        gs.main([])
+        assert mtimes == {p.name: p.stat().st_mtime_ns for p in root.glob('*.html')}
+
+        data['dnc'][0]['alt'] = 'changed'
+        (root / 'data' / 'sections.json').write_text(json.dumps(data))
+        gs.main([])
+        assert (root / 'misc.html').stat().st_mtime_ns == mtimes['misc.html']
+        assert 'alt="changed"' in (root / 'dnc.html').read_text()
+
+
+def test_page_size_splits_sections_and_prefetches_the_next_page():
+    gs = load_sections_module()
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp) / 'site'
+        (root / 'data').mkdir(parents=True)
+        items = [{'id': f'shot{i}', 'alt': f'shot {i}', 'thumb_webp': f'images/dnc/shot{i}-thumb.webp',
+                  'thumb_jpg': f'images/dnc/shot{i}-thumb.jpg'} for i in range(5)]
+        (root / 'data' / 'sections.json').write_text(json.dumps({'dnc': items}))
+        gs.ROOT, gs.DATA, gs.STATE_FILE = root, root / 'data' / 'sections.json', Path(tmp) / 'state.json'
+
+        gs.main(['--page-size', '2'])
+        assert sorted(p.name for p in root.glob('*.html')) == ['dnc-2.html', 'dnc-3.html', 'dnc.html']
+        first = (root / 'dnc.html').read_text()
+        assert first.count('<picture>') == 2
+        assert '<link rel="prefetch" href="dnc-2.html">' in first
+        assert '<link rel="prefetch" href="images/dnc/shot2-thumb.webp" as="image">' in first
+        second = (root / 'dnc-2.html').read_text()
+        assert 'href="dnc.html" rel="prev"' in second and 'href="dnc-3.html" rel="next"' in second
+        assert 'data-id="dnc-2"' in second
+        last = (root / 'dnc-3.html').read_text()
+        assert 'rel="next"' not in last and 'rel="prefetch"' not in last
+
+        gs.main(['--page-size', '3'])
+        assert sorted(p.name for p in root.glob('*.html')) == ['dnc-2.html', 'dnc.html']
+
+
+def test_hero_crops_are_art_directed_by_screen_width():
+    gs = load_sections_module()
+
+    def crop(shape):
+        return {'srcset_webp': f'images/dnc/shot-crop-{shape}-480.webp 480w',
+                'srcset_jpg': f'images/dnc/shot-crop-{shape}-480.jpg 480w'}
+
+    hero = {'id': 'shot', 'hero': True, 'full_jpg': 'images/dnc/shot-full.jpg',
+            'srcset_webp': 'images/dnc/shot-full.webp 1920w', 'srcset_jpg': 'images/dnc/shot-full.jpg 1920w',
+            'crops': {'portrait': crop('portrait'), 'square': crop('square')}}
+    html = gs.pick_hero([hero])
+    portrait = html.index('<source media="(max-width: 600px)" type="image/webp"')
+    square = html.index('<source media="(max-width: 900px)" type="image/webp"')
+    assert portrait < square < html.index('<source type="image/webp"')
+    preload = gs.hero_preload([hero])
+    assert preload.count('rel="preload"') == 3
+    assert 'media="(max-width: 600px)" imagesrcset="images/dnc/shot-crop-portrait-480.webp 480w"' in preload
+    assert 'media="(min-width: 601px) and (max-width: 900px)"' in preload
+    assert 'media="(min-width: 901px)" imagesrcset="images/dnc/shot-full.webp 1920w"' in preload
+
+
+def test_hand_written_pages_follow_the_asset_map_both_ways():
+    gs = load_sections_module()
+    page = '<link href="assets/css/styles.css"><script src="assets/js/carousel.js"></script>'
+    assets = AssetMap({'assets/css/styles.css': 'assets/css/styles.0123456789.css',
+                       'assets/js/carousel.js': 'assets/js/carousel.abcdefabcd.js'})
+    hashed = gs.link_assets(page, assets)
+    assert hashed == '<link href="assets/css/styles.0123456789.css"><script src="assets/js/carousel.abcdefabcd.js"></script>'
+    assert gs.link_assets(hashed, AssetMap()) == page
+
+
+if __name__ == '__main__':
+    test_pages_render_in_one_pass_and_only_when_inputs_change()
+    test_page_size_splits_sections_and_prefetches_the_next_page()
+    test_hero_crops_are_art_directed_by_screen_width()
+    test_hand_written_pages_follow_the_asset_map_both_ways()
+    print('OK')
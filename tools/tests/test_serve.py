@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+import os
+import sys
+import gzip
+import tempfile
+import threading
+import importlib.util
+import urllib.error
+import urllib.request
+
+TOOLS = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, TOOLS)
+
+
+def load_serve_module():
+    spec = importlib.util.spec_from_file_location('serve_site', os.path.join(TOOLS, 'serve-site.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def fetch(url, **headers):
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, headers=headers)) as resp:
+            return resp.status, resp.headers, resp.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.headers, e.read()
+
+
+def test_revalidation_ranges_gzip_and_live_reload():
+    serve = load_serve_module()
+    with tempfile.TemporaryDirectory() as tmp:
+        page = b'<html><body>' + b'<p>photo</p>' * 200 + b'</body></html>'
+        with open(os.path.join(tmp, 'index.html'), 'wb') as fh:
+            fh.write(page)
+        with open(os.path.join(tmp, 'shot-full.0123456789.jpg'), 'wb') as fh:
+            fh.write(bytes(range(256)))
+
+        reloader = serve.Reloader()
+        server = serve.make_server(tmp, port=0, reloader=reloader, quiet=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base = f'http://127.0.0.1:{server.server_address[1]}'
+        try:
+            status, headers, body = fetch(base + '/')
+            assert status == 200 and body.endswith(serve.RELOAD_SCRIPT + b'</body></html>')
+            assert headers['Cache-Control'] == serve.REVALIDATE
+            assert fetch(base + '/', **{'If-None-Match': headers['ETag']})[0] == 304
+
+            status, headers, body = fetch(base + '/', **{'Accept-Encoding': 'br;q=0, gzip'})
+            assert headers['Content-Encoding'] == 'gzip' and serve.RELOAD_SCRIPT in gzip.decompress(body)
+
+            url = base + '/shot-full.0123456789.jpg'
+            status, headers, body = fetch(url, Range='bytes=10-19')
+            assert status == 206 and body == bytes(range(10, 20))
+            assert headers['Content-Range'] == 'bytes 10-19/256' and headers['Cache-Control'] == serve.IMMUTABLE
+            assert fetch(url, Range='bytes=-6')[2] == bytes(range(250, 256))
+            assert fetch(url, Range='bytes=300-')[0] == 416
+
+            with urllib.request.urlopen(base + serve.RELOAD_PATH) as stream:
+                reloader.bump()
+                assert stream.readline() == b'data: reload\n'
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+def test_watcher_sees_edits_made_during_a_build_but_not_the_build_output():
+    serve = load_serve_module()
+    with tempfile.TemporaryDirectory() as tmp:
+        source, output = os.path.join(tmp, 'shot.jpg'), os.path.join(tmp, 'shot-full.webp')
+        with open(source, 'wb') as fh:
+            fh.write(b'a')
+        calls = []
+        done = threading.Event()
+
+        def on_change(changed):
+            calls.append([os.path.basename(p) for p in changed])
+            with open(output, 'wb') as fh:
+                fh.write(b'built' * len(calls))
+            if len(calls) == 1:
+                with open(source, 'wb') as fh:
+                    fh.write(b'edited while building')
+            else:
+                done.set()
+
+        watcher = serve.Watcher([tmp], 0.05, on_change, ignore=serve.build_outputs)
+        watcher.start()
+        try:
+            watcher.stopped.wait(0.2)  # let it take its first snapshot
+            with open(source, 'wb') as fh:
+                fh.write(b'bb')
+            assert done.wait(5)
+            watcher.stopped.wait(0.3)
+        finally:
+            watcher.stopped.set()
+            watcher.join()
+
+    assert calls == [['shot.jpg'], ['shot.jpg']]
+
+
+if __name__ == '__main__':
+    test_revalidation_ranges_gzip_and_live_reload()
+    test_watcher_sees_edits_made_during_a_build_but_not_the_build_output()
+    print('OK')
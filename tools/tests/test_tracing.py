@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import tempfile
+import argparse
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import tracing  # noqa: E402
+import workers  # noqa: E402
+
+
+def _task(item):
+    with tracing.span('encode-webp', file=item) as info:
+        info['bytes_out'] = len(item)
+    return True, [f'did {item}']
+
+
+def test_worker_spans_reach_the_trace():
+    parser = argparse.ArgumentParser()
+    tracing.add_arguments(parser)
+    with tempfile.TemporaryDirectory() as tmp:
+        args = parser.parse_args(['--trace', os.path.join(tmp, 'trace.json'), '--trace-top', '2'])
+        tracing.from_args(args, 'test')
+        with tracing.span('scan'):
+            pass
+        results = list(workers.run_jobs(_task, ['a', 'bb', 'ccc'], jobs=2))
+        assert [info for _, (_, _, info) in results] == [{}, {}, {}]
+
+        events = tracing.drain()
+        files = [e for e in events if e['name'] == tracing.FILE_SPAN]
+        encodes = [e for e in events if e['name'] == 'encode-webp']
+        assert sorted(e['args']['file'] for e in files) == ['a', 'bb', 'ccc']
+        assert sorted(e['args']['bytes_out'] for e in encodes) == [1, 2, 3]
+        assert all(e['pid'] != os.getpid() for e in files + encodes)
+        assert sum(e['name'] == 'scan' for e in events) == 1
+        lines = tracing.summary(events, top=2)
+        assert lines[0] == 'Slowest 2 of 3 files:' and any(line.strip().startswith('encode-webp') for line in lines)
+
+        tracing.add(events)
+        tracing.finish(args)
+        with open(args.trace, encoding='utf-8') as fh:
+            trace = json.load(fh)
+        names = [e['args']['name'] for e in trace['traceEvents'] if e['ph'] == 'M']
+        assert 'test (main)' in names and sum(n.startswith('worker ') for n in names) >= 1
+    tracing._process = None
+
+
+if __name__ == '__main__':
+    test_worker_spans_reach_the_trace()
+    print('OK')
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+import io
+import os
+import sys
+import json
+import tempfile
+import contextlib
+import importlib.util
+
+from PIL import Image
+
+TOOLS = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, TOOLS)
+
+
+def load_verify_module():
+    spec = importlib.util.spec_from_file_location('verify_images', os.path.join(TOOLS, 'verify-images.py'))
+    module = importlib.util.module_from_spec(spec)
+    # registered so the check workers can unpickle its functions
+    sys.modules['verify_images'] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def save(folder, name, size):
+    for ext, fmt in (('webp', 'WEBP'), ('jpg', 'JPEG')):
+        Image.new('RGB', size, (90, 120, 150)).save(os.path.join(folder, f'{name}.{ext}'), fmt)
+
+
+def run(verify, *argv):
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        code = verify.main(['-j', '1', *argv])
+    return code, out.getvalue()
+
+
+def test_verifier_reports_truncated_files_wrong_widths_and_dangling_manifest_paths():
+    verify = load_verify_module()
+    with tempfile.TemporaryDirectory() as tmp:
+        site = os.path.join(tmp, 'site')
+        folder = os.path.join(site, 'images', 'dnc')
+        os.makedirs(folder)
+        os.makedirs(os.path.join(site, 'data'))
+        verify.SITE, verify.IMAGES_ROOT = site, os.path.join(site, 'images')
+        save(folder, 'a-full', (1600, 1000))
+        save(folder, 'a-medium', (1200, 750))
+        save(folder, 'a-thumb', (600, 375))
+        save(folder, 'b-full', (500, 400))
+        save(folder, 'b-medium', (500, 400))
+        save(folder, 'b-thumb', (500, 400))
+        item = {'id': 'a', 'width': 1600, 'height': 1000, 'thumb_jpg': 'images/dnc/a-thumb.jpg',
+                'full_jpg': 'images/dnc/a-full.jpg',
+                'srcset_webp': 'images/dnc/a-thumb.webp 600w, images/dnc/a-medium.webp 1200w, '
+                               'images/dnc/a-full.webp 1600w'}
+        manifest = os.path.join(site, 'data', 'sections.json')
+        with open(manifest, 'w') as fh:
+            json.dump({'dnc': [item]}, fh)
+
+        assert run(verify, '--manifest', manifest) == (0, 'Verified 12 files and 1 manifest entries: no problems\n')
+
+        # a cut-off upload, a thumb from another ladder and a manifest pointing at a deleted file
+        with open(os.path.join(folder, 'a-full.jpg'), 'r+b') as fh:
+            fh.truncate(os.path.getsize(fh.name) - 100)
+        save(folder, 'b-thumb', (400, 320))
+        os.remove(os.path.join(folder, 'a-medium.webp'))
+        code, out = run(verify, '--manifest', manifest)
+        assert code == 1
+        assert 'a-full.jpg: truncated JPEG' in out
+        assert 'b-thumb: 400px wide, expected 500px' in out
+        assert 'missing medium.webp' in out
+        assert 'srcset_webp points at missing file images/dnc/a-medium.webp' in out
+        assert 'full_jpg points at unreadable file images/dnc/a-full.jpg' in out
+        assert out.endswith('5 problems\n')
+
+
+def test_full_variant_narrower_than_its_source_is_reported():
+    verify = load_verify_module()
+    with tempfile.TemporaryDirectory() as tmp:
+        images = os.path.join(tmp, 'images')
+        folder = os.path.join(images, 'dnc')
+        os.makedirs(os.path.join(images, 'originals', 'dnc'))
+        os.makedirs(folder)
+        verify.IMAGES_ROOT = images
+        # a 2400px original, a 1000px camera JPEG turned upright by EXIF and a source next to its variants
+        Image.new('RGB', (2400, 1500)).save(os.path.join(images, 'originals', 'dnc', 'a b.jpg'))
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        Image.new('RGB', (1500, 1000)).save(os.path.join(images, 'originals', 'dnc', 'c.jpg'), exif=exif)
+        Image.new('RGB', (800, 500)).save(os.path.join(folder, 'd.png'))
+        for base, sizes in (('a-b', ((600, 375), (1200, 750), (1200, 750))),
+                            ('c', ((600, 900), (1000, 1500), (1000, 1500))),
+                            ('d', ((600, 375), (800, 500), (800, 500)))):
+            for variant, size in zip(('thumb', 'medium', 'full'), sizes):
+                save(folder, f'{base}-{variant}', size)
+        manifest = os.path.join(tmp, 'sections.json')
+        with open(manifest, 'w') as fh:
+            json.dump({}, fh)
+        sources = verify.source_widths(['dnc'])
+        code, out = run(verify, '--manifest', manifest)
+
+    assert sources == {(folder, 'a-b'): 2400, (folder, 'c'): 1000, (folder, 'd'): 800}
+    # the full variant stopped at 1200px although its original allows 1920px
+    assert code == 1
+    assert out.splitlines()[:-1] == [f'FAIL {os.path.join(folder, "a-b")}-full: 1200px wide, expected 1920px']
+
+if __name__ == '__main__':
+    test_verifier_reports_truncated_files_wrong_widths_and_dangling_manifest_paths()
+    test_full_variant_narrower_than_its_source_is_reported()
+    print('OK')
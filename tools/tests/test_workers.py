@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import workers  # noqa: E402
+
+
+def _task(item):
+    if item == 'crash':
+        time.sleep(0.1)  # the neighbours are still running when it dies
+        os._exit(1)
+    time.sleep(0.3)
+    return True, [f'did {item}'], {'item': item}
+
+
+def test_dead_worker_is_blamed_alone_and_the_run_continues():
+    items = ['a', 'b', 'crash', 'c', 'd', 'e', 'f']
+    results = list(workers.run_jobs(_task, items, jobs=3))
+    assert [item for item, _ in results] == items
+    outcomes = dict(results)
+    ok, lines, _ = outcomes.pop('crash')
+    assert not ok and 'worker process died' in lines[0]
+    assert all(ok and info == {'item': item} for item, (ok, _, info) in outcomes.items())
+
+
+if __name__ == '__main__':
+    test_dead_worker_is_blamed_alone_and_the_run_continues()
+    print('OK')
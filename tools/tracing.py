@@ -0,0 +1,118 @@
+"""Timing spans for the pipeline scripts, exported as Chrome trace-event JSON.
+
+Scripts call :func:`add_arguments` and :func:`from_args`; with ``--trace FILE``
+every ``with tracing.span(...)`` block is recorded and :func:`finish` writes
+FILE (open it in chrome://tracing or https://ui.perfetto.dev) and prints the
+slowest files and stages. Without ``--trace`` a span costs one flag check.
+
+    with tracing.span('encode-webp', file=out) as s:
+        data = ...
+        s['bytes_out'] = len(data)
+
+Spans recorded in ``workers.run_jobs`` worker processes are sent back with the
+task's result, so one trace covers the whole run with a row per worker.
+Per-item work goes in a span named ``file``; every other span name is a stage.
+"""
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+FILE_SPAN = 'file'
+DEFAULT_TOP = 10
+
+_events = []
+_process = None
+
+
+def enable(process='main'):
+    """Start recording; ``process`` names this process's row in the trace."""
+    global _process
+    _process = process
+
+
+def enabled():
+    return _process is not None
+
+
+@contextmanager
+def span(name, **args):
+    """Record how long the block takes; the yielded dict is stored as the span's args."""
+    if _process is None:
+        yield {}
+        return
+    start = time.perf_counter_ns()
+    try:
+        yield args
+    finally:
+        _events.append({'name': name, 'cat': _process, 'ph': 'X', 'ts': start // 1000,
+                        'dur': (time.perf_counter_ns() - start) // 1000, 'pid': os.getpid(),
+                        'tid': threading.get_native_id(), 'args': args})
+
+
+def drain():
+    """Return and forget the events recorded so far (workers hand them to the parent)."""
+    events = list(_events)
+    _events.clear()
+    return events
+
+
+def add(events):
+    """Merge events recorded in another process."""
+    if _process is not None and events:
+        _events.extend(events)
+
+
+def add_arguments(parser):
+    parser.add_argument('--trace', metavar='FILE',
+                        help='record decode/resize/encode/write spans and write them as Chrome trace JSON to FILE')
+    parser.add_argument('--trace-top', type=int, default=DEFAULT_TOP, metavar='N',
+                        help=f'slowest files and stages to list with --trace (default {DEFAULT_TOP})')
+
+
+def from_args(args, process):
+    if getattr(args, 'trace', None):
+        enable(process)
+
+
+def summary(events, top=DEFAULT_TOP):
+    """Lines listing the ``top`` slowest files and stages (total time, count, mean, share)."""
+    files = sorted((e for e in events if e['name'] == FILE_SPAN), key=lambda e: e['dur'], reverse=True)
+    stages = {}
+    for e in events:
+        if e['name'] != FILE_SPAN:
+            total, count = stages.get(e['name'], (0, 0))
+            stages[e['name']] = (total + e['dur'], count + 1)
+    lines = [f'Slowest {min(top, len(files))} of {len(files)} files:']
+    for e in files[:top]:
+        lines.append(f"  {e['dur'] / 1000:10.1f} ms  pid {e['pid']:<7} {e['args'].get('file', '?')}")
+    everything = sum(total for total, _ in stages.values()) or 1
+    lines.append(f'Slowest {min(top, len(stages))} of {len(stages)} stages:')
+    lines.append(f"  {'stage':<16} {'total ms':>10} {'count':>6} {'mean ms':>9} {'share':>6}")
+    for name, (total, count) in sorted(stages.items(), key=lambda kv: kv[1][0], reverse=True)[:top]:
+        lines.append(f'  {name:<16} {total / 1000:10.1f} {count:6d} {total / count / 1000:9.2f} '
+                     f'{total / everything:6.0%}')
+    return lines
+
+
+def write(path, events):
+    """Write ``events`` as Chrome trace-event JSON, naming the main process and each worker."""
+    pids = sorted({e['pid'] for e in events})
+    names = [{'name': 'process_name', 'ph': 'M', 'pid': pid, 'tid': 0,
+              'args': {'name': f'{_process} (main)' if pid == os.getpid() else f'worker {pid}'}} for pid in pids]
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as fh:
+        json.dump({'traceEvents': names + events, 'displayTimeUnit': 'ms'}, fh)
+
+
+def finish(args):
+    """Write the trace and print the summary when ``--trace`` was given."""
+    if _process is None or not getattr(args, 'trace', None):
+        return
+    events = drain()
+    write(args.trace, events)
+    for line in summary(events, args.trace_top):
+        print(line)
+    print(f'Wrote {len(events)} trace events to {args.trace}')
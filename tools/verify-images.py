@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+"""Check every derivative and every manifest entry before a deploy; exit 1 on any problem.
+
+Each variant under images/<category> (thumb/medium/full, adaptive ``<w>w``
+breakpoints and hero crops, in WebP, JPEG and AVIF) is checked in a worker
+process without decoding pixels:
+
+* the container is complete: JPEG starts with SOI and ends with the EOI
+  marker, the WebP RIFF size matches the file size, AVIF boxes add up to it;
+* the header's dimensions fit the width ladder: full is ``min(ladder width,
+  source width)`` wide (the upright width of the original or source image it
+  was made from), thumb/medium are ``min(ladder width, full width)``, ``<w>w``
+  files and crops are ``w`` wide, all with the full variant's aspect ratio
+  (crops with their shape's);
+* the WebP/JPEG/AVIF files of one variant have the same size, and every
+  base has its whole ladder in WebP and JPEG.
+
+Then every entry of site/data/sections.json is cross-checked: each path and
+srcset entry must name an existing file whose width matches its ``w``
+descriptor, and the entry's width/height must be those of its largest file.
+
+    python3 tools/verify-images.py [-j N] [--category NAME] [--manifest site/data/sections.json]
+"""
+import os
+import re
+import sys
+import json
+import struct
+import argparse
+import functools
+import importlib.util
+
+from PIL import ExifTags, Image
+
+import workers
+from assetmap import FINGERPRINT_RE
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+IMAGES_ROOT = os.path.join(ROOT, 'images')
+SITE = os.path.join(ROOT, 'site')
+MANIFEST = os.path.join(SITE, 'data', 'sections.json')
+
+# <base>-<variant>.<ext>; fingerprinted copies are hardlinks of the same files and are skipped
+VARIANT_RE = re.compile(r'^(?P<base>.+)-(?P<variant>thumb|medium|full|(?P<w>\d+)w'
+                        r'|crop-(?P<shape>portrait|square)-(?P<cw>\d+))\.(?P<ext>webp|jpg|avif)$')
+
+# Rounding differs between toolchains (Pillow truncates, sharp rounds); heights may differ by this much
+TOLERANCE = 1
+
+# EXIF orientations that turn the stored image a quarter, so its upright width is its stored height
+QUARTER_TURNS = {5, 6, 7, 8}
+
+# Item fields holding one path / a srcset list (as in generate-manifest.py)
+PATH_KEYS = ('thumb_webp', 'thumb_jpg', 'full_webp', 'full_jpg', 'full_avif')
+SRCSET_KEYS = ('srcset_avif', 'srcset_webp', 'srcset_jpg')
+
+
+@functools.lru_cache(maxsize=None)
+def _load(script):
+    name = os.path.splitext(script)[0].replace('-', '_')
+    spec = importlib.util.spec_from_file_location(name, os.path.join(os.path.dirname(__file__), script))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def ladder():
+    """``{variant: width}`` of the optimizers and ``{shape: aspect}`` of the hero crops."""
+    sizes = _load('optimize-images.py').SIZES
+    crops = _load('crop-heroes.py').HERO_CROPS
+    return {name: width for name, width, _ in sizes}, {shape: aspect for shape, aspect, _ in crops}
+
+
+def container_problem(path, ext):
+    """Why the file's container is incomplete or not what its extension says, or ``None``."""
+    size = os.path.getsize(path)
+    with open(path, 'rb') as fh:
+        head = fh.read(16)
+        fh.seek(max(0, size - 2))
+        tail = fh.read(2)
+        if ext == 'jpg':
+            if head[:3] != b'\xff\xd8\xff':
+                return 'not a JPEG (no SOI marker)'
+            if tail != b'\xff\xd9':
+                return 'truncated JPEG (no EOI marker at the end)'
+        elif ext == 'webp':
+            if len(head) < 12 or head[:4] != b'RIFF' or head[8:12] != b'WEBP':
+                return 'not a WebP (no RIFF/WEBP header)'
+            declared = struct.unpack('<I', head[4:8])[0] + 8
+            if declared != size:
+                return f'truncated WebP (RIFF says {declared} bytes, file has {size})'
+        elif ext == 'avif':
+            offset = 0
+            while offset < size:
+                fh.seek(offset)
+                box = fh.read(16)
+                if len(box) < 8:
+                    return f'truncated AVIF (partial box header at byte {offset})'
+                length, kind = struct.unpack('>I4s', box[:8])
+                if length == 1:
+                    length = struct.unpack('>Q', box[8:16])[0] if len(box) == 16 else 0
+                elif length == 0:
+                    length = size - offset
+                if offset == 0 and kind != b'ftyp':
+                    return 'not an AVIF (no ftyp box)'
+                if length < 8:
+                    return f'corrupt AVIF (box {kind!r} at byte {offset} is {length} bytes)'
+                offset += length
+            if offset != size:
+                return f'truncated AVIF (boxes need {offset} bytes, file has {size})'
+    return None
+
+
+def check_file(path):
+    """Check one variant's container and read its size; returns ``(ok, problems, {'size': (w, h)})``."""
+    ext = os.path.splitext(path)[1][1:]
+    try:
+        problem = container_problem(path, ext)
+        if problem:
+            return False, [f'{path}: {problem}'], {}
+        with Image.open(path) as img:  # parses the header only
+            size = img.size
+    except Exception as e:
+        return False, [f'{path}: unreadable ({e})'], {}
+    return True, [], {'size': size}
+
+
+def find_variants(categories):
+    """``{path: match}`` for every variant file in the given category folders."""
+    found = {}
+    for cat in categories:
+        folder = os.path.join(IMAGES_ROOT, cat)
+        for name in sorted(os.listdir(folder)):
+            m = VARIANT_RE.match(name)
+            if m and not FINGERPRINT_RE.search(name):
+                found[os.path.join(folder, name)] = m
+    return found
+
+
+def upright_width(path):
+    """Width of ``path`` once its EXIF orientation is applied (header only), or ``None`` if unreadable."""
+    try:
+        with Image.open(path) as img:
+            width, height = img.size
+            return height if img.getexif().get(ExifTags.Base.Orientation, 1) in QUARTER_TURNS else width
+    except Exception:
+        return None
+
+
+def source_widths(categories):
+    """``{(folder, base): upright width}`` of the images the variants in ``categories`` were made from.
+
+    Sources are the images next to the variants (optimize-images.py) and the
+    originals under images/originals/<category> (optimize-originals.py).
+    """
+    optimizer = _load('optimize-images.py')
+    widths = {}
+    for cat in categories:
+        folder = os.path.join(IMAGES_ROOT, cat)
+        paths = [os.path.join(folder, n) for n in sorted(os.listdir(folder))]
+        for dirpath, _, filenames in sorted(os.walk(os.path.join(IMAGES_ROOT, 'originals', cat))):
+            paths.extend(os.path.join(dirpath, n) for n in sorted(filenames))
+        for path in paths:
+            name = os.path.basename(path)
+            if (not name.lower().endswith(optimizer.EXTENSIONS) or optimizer.is_derivative(path)
+                    or FINGERPRINT_RE.search(name) or not os.path.isfile(path)):
+                continue
+            width = upright_width(path)
+            if width:
+                widths[(folder, optimizer.sanitize_name(os.path.splitext(name)[0]))] = width
+    return widths
+
+
+def near(actual, expected):
+    return abs(actual - expected) <= TOLERANCE
+
+
+def check_ladders(variants, sizes, widths, aspects, sources=None):
+    """Problems with the dimensions and completeness of each base's variants.
+
+    ``sources`` maps ``(folder, base)`` to the source's width (see
+    :func:`source_widths`); a full variant without a known source is only
+    checked against the ladder width.
+    """
+    problems = []
+    bases = {}
+    for path, m in variants.items():
+        bases.setdefault((os.path.dirname(path), m.group('base')), []).append((path, m))
+    for (folder, base), files in sorted(bases.items()):
+        by_variant = {}
+        for path, m in files:
+            by_variant.setdefault(m.group('variant'), {})[m.group('ext')] = path
+        label = os.path.join(folder, base)
+        full = [p for p in by_variant.get('full', {}).values() if p in sizes]
+        full_size = sizes[full[0]] if full else None
+
+        # the whole ladder in both formats (an adaptive ladder has <w>w files instead of medium)
+        adaptive = any(m.group('w') for _, m in files)
+        required = [v for v in widths if not (adaptive and v not in ('thumb', 'full'))]
+        if by_variant.keys() & set(widths):
+            for variant in required:
+                for ext in ('webp', 'jpg'):
+                    if ext not in by_variant.get(variant, {}):
+                        problems.append(f'{label}: missing {variant}.{ext}')
+
+        for variant, by_ext in sorted(by_variant.items()):
+            # unreadable files were reported by check_file already
+            dims = {ext: sizes[path] for ext, path in by_ext.items() if path in sizes}
+            if not dims:
+                continue
+            if len(set(dims.values())) > 1:
+                problems.append(f'{label}-{variant}: formats differ in size: '
+                                + ', '.join(f'{ext} {w}x{h}' for ext, (w, h) in sorted(dims.items())))
+            path = next(p for p in by_ext.values() if p in sizes)
+            w, h = sizes[path]
+            m = variants[path]
+            if m.group('shape'):
+                expected_w, aspect = int(m.group('cw')), aspects.get(m.group('shape'))
+            elif m.group('w'):
+                expected_w, aspect = int(m.group('w')), None
+            elif variant == 'full':
+                source_w = (sources or {}).get((folder, base))
+                if adaptive:
+                    # the top of an adaptive ladder is capped by --max-width, which is not recorded
+                    breakpoints = [int(m.group('w')) for _, m in files if m.group('w')]
+                    if (source_w and w > source_w) or w <= max(breakpoints):
+                        problems.append(f'{label}-full: {w}px wide, expected wider than its '
+                                        f'{max(breakpoints)}w breakpoint and at most the source\'s '
+                                        f'{source_w or "?"}px')
+                    expected_w, aspect = w, None
+                else:
+                    expected_w, aspect = min(source_w or w, widths['full']), None
+            elif full_size:
+                expected_w, aspect = min(widths[variant], full_size[0]), None
+            else:
+                continue
+            if w != expected_w:
+                problems.append(f'{label}-{variant}: {w}px wide, expected {expected_w}px')
+            if aspect is None and full_size and not m.group('shape'):
+                expected_h = full_size[1] * w / full_size[0]
+                if not near(h, expected_h):
+                    problems.append(f'{label}-{variant}: {w}x{h} does not keep the full variant\'s '
+                                    f'{full_size[0]}x{full_size[1]} aspect ratio')
+            elif aspect and not near(h, w / aspect):
+                problems.append(f'{label}-{variant}: {w}x{h} is not a {m.group("shape")} crop')
+    return problems
+
+
+def srcset_entries(value):
+    for part in value.split(','):
+        bits = part.split()
+        if len(bits) == 2 and bits[1].endswith('w') and bits[1][:-1].isdigit():
+            yield bits[0], int(bits[1][:-1])
+        elif bits:
+            yield bits[0], None
+
+
+def check_manifest(manifest, sizes):
+    """Problems with the manifest: paths to missing files, wrong ``w`` descriptors, wrong item sizes."""
+    problems = []
+
+    def size_of(rel):
+        path = os.path.realpath(os.path.join(SITE, rel))
+        if path in sizes:
+            return sizes[path]
+        if not os.path.isfile(path):
+            return None
+        ok, _, info = check_file(path)  # e.g. a fingerprinted copy outside the scanned folders
+        return info.get('size') if ok else False
+
+    for cat, items in manifest.items():
+        for item in items:
+            label = f"{cat}/{item.get('id', '?')}"
+            widest = None
+            fields = [(k, item.get(k), False) for k in PATH_KEYS + SRCSET_KEYS]
+            for shape, crop in sorted((item.get('crops') or {}).items()):
+                fields += [(f'crops.{shape}.{k}', crop.get(k), True) for k in SRCSET_KEYS]
+            for key, value, is_crop in fields:
+                if not value:
+                    continue
+                entries = srcset_entries(value) if key.split('.')[-1] in SRCSET_KEYS else [(value, None)]
+                for rel, descriptor in entries:
+                    size = size_of(rel)
+                    if size is None:
+                        problems.append(f'{label}: {key} points at missing file {rel}')
+                    elif size is False:
+                        problems.append(f'{label}: {key} points at unreadable file {rel}')
+                    elif descriptor is not None and size[0] != descriptor:
+                        problems.append(f'{label}: {key} says {rel} is {descriptor}w, it is {size[0]}px wide')
+                    elif not is_crop and (widest is None or size[0] > widest[0]):
+                        widest = size
+            if widest and (item.get('width'), item.get('height')) != (None, None) \
+                    and (item.get('width'), item.get('height')) != tuple(widest):
+                problems.append(f"{label}: recorded as {item.get('width')}x{item.get('height')}, "
+                                f'its largest file is {widest[0]}x{widest[1]}')
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-j', '--jobs', type=int, default=workers.default_jobs(),
+                        help='worker processes (default: number of CPUs)')
+    parser.add_argument('--category', action='append', metavar='NAME',
+                        help='only check images/NAME and its manifest section (repeatable; default: all)')
+    parser.add_argument('--manifest', default=MANIFEST, help=f'manifest to cross-check (default {MANIFEST})')
+    args = parser.parse_args(argv)
+
+    categories = args.category or sorted(n for n in os.listdir(IMAGES_ROOT)
+                                         if n != 'originals' and os.path.isdir(os.path.join(IMAGES_ROOT, n)))
+    variants = find_variants(c for c in categories if os.path.isdir(os.path.join(IMAGES_ROOT, c)))
+    problems = []
+    sizes = {}
+    for path, (ok, lines, info) in workers.run_jobs(check_file, list(variants), args.jobs):
+        if ok:
+            sizes[os.path.realpath(path)] = sizes[path] = info['size']
+        problems.extend(lines)
+
+    widths, aspects = ladder()
+    sources = source_widths(c for c in categories if os.path.isdir(os.path.join(IMAGES_ROOT, c)))
+    problems.extend(check_ladders(variants, sizes, widths, aspects, sources))
+
+    try:
+        with open(args.manifest, 'r', encoding='utf-8') as fh:
+            manifest = json.load(fh)
+    except (OSError, ValueError) as e:
+        problems.append(f'{args.manifest}: cannot read manifest ({e})')
+        manifest = {}
+    if args.category:
+        manifest = {cat: items for cat, items in manifest.items() if cat in args.category}
+    problems.extend(check_manifest(manifest, sizes))
+
+    for line in problems:
+        print(f'FAIL {line}')
+    entries = sum(len(items) for items in manifest.values())
+    print(f'Verified {len(variants)} files and {entries} manifest entries: '
+          f"{len(problems) or 'no'} problem{'' if len(problems) == 1 else 's'}")
+    return 1 if problems else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,196 @@
+"""Process-pool helpers shared by the image pipeline scripts.
+
+Tasks are plain functions that return ``(ok, log_lines)`` instead of printing,
+so output can be replayed in input order no matter which worker finished first.
+A task may add a third element, a dict of facts for the parent to record.
+With tracing enabled, every task runs in a ``file`` span and the spans a
+worker records travel back to the parent with its result.
+"""
+import os
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import tracing
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+MB = 1024 * 1024
+
+
+def default_jobs():
+    try:
+        return len(os.sched_getaffinity(0)) or 1
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def total_memory():
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (AttributeError, ValueError, OSError):
+        return 0
+
+
+def default_memory_limit(jobs):
+    """Per-worker address space cap: three quarters of RAM shared between workers."""
+    total = total_memory()
+    if not total:
+        return 0
+    return max(512 * MB, int(total * 0.75) // max(1, jobs))
+
+
+def add_arguments(parser):
+    parser.add_argument('-j', '--jobs', type=int, default=default_jobs(),
+                        help='number of worker processes (default: number of CPUs)')
+    parser.add_argument('--max-memory', type=int, default=None, metavar='MB',
+                        help='per-worker memory cap in MB (default: 75%% of RAM / jobs, 0 disables)')
+    parser.add_argument('--memory-budget', type=int, default=0, metavar='MB',
+                        help='keep the estimated decoded size of files in flight under this many MB '
+                             '(default: 0, no budget); large sources are also reduced/composited in strips to fit')
+
+
+def memory_limit_from_args(args):
+    if args.max_memory is None:
+        limit = default_memory_limit(args.jobs)
+        if limit and args.memory_budget:
+            # a file that needs the whole budget must still fit in one worker
+            limit = max(limit, args.memory_budget * MB + 512 * MB)
+        return limit
+    return args.max_memory * MB
+
+
+def memory_budget_from_args(args):
+    return args.memory_budget * MB
+
+
+def _init_worker(memory_limit):
+    if memory_limit and resource is not None:
+        try:
+            resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+        except (ValueError, OSError):
+            pass
+
+
+def _normalize(result):
+    ok, lines = result[:2]
+    return ok, lines, (result[2] if len(result) > 2 else {})
+
+
+def _traced(func, item):
+    """Run ``func(item)`` in a worker with tracing on and return its spans in ``info['trace']``."""
+    tracing.enable('worker')
+    # a forked worker starts with a copy of the parent's events; those are the parent's to report
+    tracing.drain()
+    with tracing.span(tracing.FILE_SPAN, file=str(item), worker=os.getpid()):
+        ok, lines, info = _normalize(func(item))
+    return ok, lines, dict(info, trace=tracing.drain())
+
+
+def _collect(result):
+    ok, lines, info = result
+    tracing.add(info.pop('trace', None))
+    return ok, lines, info
+
+
+def _failure(item, e):
+    return False, [f'Failed to process {item}: {e}'], {}
+
+
+def _died(item):
+    return False, [f'Failed to process {item}: worker process died (memory cap or crash)'], {}
+
+
+def _pool(jobs, memory_limit):
+    return ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=(memory_limit,))
+
+
+def run_jobs(func, items, jobs=1, memory_limit=0, cost=None, budget=0):
+    """Run ``func(item)`` for every item and yield ``(item, (ok, lines, info))`` in input order.
+
+    ``func`` must be a module-level function (or a ``functools.partial`` of
+    one) returning ``(ok, log_lines)`` or ``(ok, log_lines, info)``; ``info``
+    is ``{}`` when the task returned none. A worker that dies (for example because
+    it hit the memory cap) is reported against the file it was working on
+    rather than aborting the whole run: a dead worker breaks the whole pool, so
+    the pool is rebuilt and the items that were in flight are retried one at a
+    time, which pins the failure on the item that actually kills its worker.
+
+    With a ``budget`` (bytes) and a ``cost(item)`` estimate, a new item is only
+    started while the estimated cost of everything in flight stays under the
+    budget; an item larger than the whole budget runs on its own.
+
+    With ``jobs <= 1`` (or a single item) tasks run inline in this process and
+    ``memory_limit`` does not apply: capping the caller's own address space
+    would outlive the call.
+    """
+    items = list(items)
+    if jobs <= 1 or len(items) <= 1:
+        for item in items:
+            with tracing.span(tracing.FILE_SPAN, file=str(item), worker=os.getpid()):
+                result = _normalize(func(item))
+            yield item, result
+        return
+
+    traced = tracing.enabled()
+
+    costs = [cost(item) if (cost and budget) else 0 for item in items]
+    jobs = min(jobs, len(items))
+    queue = deque(range(len(items)))  # indexes not submitted yet
+    suspects = set()  # in flight when a worker died; retried on their own
+    pending = {}  # future -> index
+    results = {}
+    in_flight = 0
+    next_yield = 0
+    pool = _pool(jobs, memory_limit)
+    try:
+        while next_yield < len(items):
+            broken = False
+            while queue and len(pending) < jobs:
+                idx = queue[0]
+                isolate = idx in suspects or any(i in suspects for i in pending.values())
+                if pending and (isolate or (budget and in_flight + costs[idx] > budget)):
+                    break
+                try:
+                    if traced:
+                        future = pool.submit(_traced, func, items[idx])
+                    else:
+                        future = pool.submit(func, items[idx])
+                except BrokenProcessPool:
+                    broken = True
+                    break
+                queue.popleft()
+                pending[future] = idx
+                in_flight += costs[idx]
+
+            done = wait(pending, return_when=FIRST_COMPLETED)[0] if pending and not broken else ()
+            if broken or any(isinstance(f.exception(), BrokenProcessPool) for f in done):
+                # every unfinished future of a broken pool fails; collect them all before rebuilding
+                broken = True
+                done = wait(pending)[0]
+            retry = []
+            for fut in done:
+                idx = pending.pop(fut)
+                in_flight -= costs[idx]
+                try:
+                    results[idx] = _collect(_normalize(fut.result()))
+                except BrokenProcessPool:
+                    if idx in suspects:  # it ran alone, so it is the one that died
+                        results[idx] = _died(items[idx])
+                    else:
+                        suspects.add(idx)
+                        retry.append(idx)
+                except Exception as e:
+                    results[idx] = _failure(items[idx], e)
+            if broken:
+                pool.shutdown(wait=True)
+                pool = _pool(jobs, memory_limit)
+                queue.extendleft(sorted(retry, reverse=True))
+            while next_yield in results:
+                yield items[next_yield], results.pop(next_yield)
+                next_yield += 1
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)